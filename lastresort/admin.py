@@ -1,10 +1,11 @@
 from django.contrib import admin
 from django.utils import timezone
-from .models import PSAGroup, PSAEntry, AIResponse, Competition
+from . import fragments
+from .models import PSAGroup, PSAEntry, AIResponse, Competition, LeaderboardEntry, SolutionCache, AIBatchJob
 
 @admin.register(Competition)
 class CompetitionAdmin(admin.ModelAdmin):
-    list_display = ('name', 'pub_date', 'end_date', 'is_active', 'status')
+    list_display = ('name', 'pub_date', 'end_date', 'samples_per_entry', 'is_active', 'status')
     list_filter = ('is_active', 'pub_date', 'end_date')
     search_fields = ('name', 'description')
     date_hierarchy = 'pub_date'
@@ -21,4 +22,45 @@ class CompetitionAdmin(admin.ModelAdmin):
 
 admin.site.register(PSAGroup)
 admin.site.register(PSAEntry)
-admin.site.register(AIResponse)
\ No newline at end of file
+
+@admin.register(AIResponse)
+class AIResponseAdmin(admin.ModelAdmin):
+    list_display = ('psa_entry', 'ai_answer', 'is_correct', 'pub_date')
+    list_filter = ('is_correct',)
+    list_select_related = ('psa_entry',)
+    # The solution is stored compressed in AISolution and shown read-only
+    readonly_fields = ('ai_solution',)
+
+    # Deleted responses no longer count as answered, so their groups are generated again rather than graded
+    def delete_model(self, request, obj):
+        psa_group_id = obj.psa_entry.group_id
+        super().delete_model(request, obj)
+        self._responses_deleted([psa_group_id])
+
+    def delete_queryset(self, request, queryset):
+        psa_group_ids = set(queryset.values_list('psa_entry__group_id', flat=True))
+        super().delete_queryset(request, queryset)
+        self._responses_deleted(psa_group_ids)
+
+    def _responses_deleted(self, psa_group_ids):
+        PSAGroup.recount_progress(psa_group_ids)
+        # Deleting responses sends no signal the fragment cache listens to
+        fragments.bump_groups(PSAGroup.objects.filter(id__in=psa_group_ids))
+
+@admin.register(LeaderboardEntry)
+class LeaderboardEntryAdmin(admin.ModelAdmin):
+    list_display = ('competition', 'user', 'best_score', 'best_submission_date')
+    list_filter = ('competition',)
+    search_fields = ('user__username',)
+
+@admin.register(SolutionCache)
+class SolutionCacheAdmin(admin.ModelAdmin):
+    list_display = ('key', 'model', 'ai_answer', 'hit_count', 'created_at', 'last_used_at')
+    list_filter = ('model',)
+    search_fields = ('key', 'ai_answer')
+
+@admin.register(AIBatchJob)
+class AIBatchJobAdmin(admin.ModelAdmin):
+    list_display = ('batch_id', 'status', 'request_count', 'pub_date', 'completed_at')
+    list_filter = ('status',)
+    filter_horizontal = ('groups',)
\ No newline at end of file
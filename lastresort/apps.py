@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class LastResortConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'lastresort'
+
+    def ready(self):
+        from . import fragments, metrics, performance
+        performance.install()
+        fragments.install()
+        metrics.install()
@@ -0,0 +1,137 @@
+import json
+from collections import Counter
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from .models import split_ai_response, AI_MODEL, SOLUTION_PROMPT, AIBatchJob, AIResponse, PSAEntry, PSAGroup
+from .events import publish_group_event
+from .model_backends import openai_client
+from . import fragments, metrics, solution_cache
+
+BATCH_ENDPOINT = '/v1/responses'
+
+def _custom_id(entry_id):
+    return f'entry-{entry_id}'
+
+def _entry_id(custom_id):
+    return int(custom_id.split('-', 1)[1])
+
+def response_output_text(body):
+    """Join the output_text parts of a raw Responses API body, like Response.output_text"""
+    texts = []
+    for item in body.get('output') or []:
+        if item.get('type') != 'message':
+            continue
+        for content in item.get('content') or []:
+            if content.get('type') == 'output_text':
+                texts.append(content.get('text', ''))
+    return ''.join(texts)
+
+def store_responses(ai_responses):
+    """Insert AI responses in one query, count their entries towards their groups' progress and tell viewers"""
+    with transaction.atomic():
+        created = AIResponse.objects.bulk_create(ai_responses, batch_size=500)
+        # Progress counts entries; every sample of a multi-sample entry is stored in the same call
+        answered_entries = {ai_response.psa_entry_id: ai_response.psa_entry.group_id for ai_response in created}
+        for psa_group_id, answered in Counter(answered_entries.values()).items():
+            PSAGroup.record_progress(psa_group_id, answered=answered)
+    for ai_response in created:
+        publish_group_event(ai_response.psa_entry.group_id, 'response', ai_response_id=ai_response.id)
+    fragments.bump(*{f'group:{ai_response.psa_entry.group_id}' for ai_response in created})
+    return created
+
+def complete_group_ids(psa_group_ids):
+    """Ids of the given groups that now have an AI response for every entry"""
+    return list(PSAGroup.objects.filter(
+        id__in=psa_group_ids, entry_count__gt=0, answered_count__gte=F('entry_count')
+    ).values_list('id', flat=True))
+
+def submit_batch(psa_group_ids):
+    """Send every unanswered entry of the given groups to the Batch API as a single job"""
+    PSAGroup.objects.filter(id__in=psa_group_ids).update(failed_count=0)
+    entries = PSAEntry.objects.filter(group_id__in=psa_group_ids, airesponse__isnull=True).only('id', 'group_id', 'problem', 'answer')
+
+    lines = []
+    cached_responses = []
+    for entry in entries.iterator():
+        cached = solution_cache.get_cached_solution(entry.problem)
+        if cached:
+            ai_solution, ai_answer = cached
+            cached_responses.append(AIResponse(psa_entry=entry, ai_solution=ai_solution, ai_answer=ai_answer, is_correct=ai_answer == entry.answer))
+            continue
+        lines.append(json.dumps({
+            'custom_id': _custom_id(entry.id),
+            'method': 'POST',
+            'url': BATCH_ENDPOINT,
+            'body': {'model': AI_MODEL, 'input': SOLUTION_PROMPT.format(problem=entry.problem)},
+        }))
+    store_responses(cached_responses)
+
+    if not lines:
+        return None
+
+    client = openai_client()
+    input_file = client.files.create(file=('lastresort-batch.jsonl', '\n'.join(lines).encode('utf-8')), purpose='batch')
+    batch = client.batches.create(input_file_id=input_file.id, endpoint=BATCH_ENDPOINT, completion_window='24h')
+    job = AIBatchJob.objects.create(
+        batch_id=batch.id,
+        input_file_id=input_file.id,
+        status=batch.status,
+        request_count=len(lines)
+    )
+    job.groups.set(psa_group_ids)
+    return job
+
+def store_batch_output(output_text):
+    """Turn the lines of a batch output file into AIResponse rows, skipping entries already answered"""
+    results = {}
+    failed = []
+    for line in output_text.splitlines():
+        if not line.strip():
+            continue
+        result = json.loads(line)
+        response = result.get('response') or {}
+        if result.get('error') or response.get('status_code') != 200:
+            failed.append(_entry_id(result['custom_id']))
+            continue
+        body = response.get('body') or {}
+        metrics.record_tokens('batch', metrics.response_usage(body.get('usage')))
+        results[_entry_id(result['custom_id'])] = response_output_text(body)
+    if failed:
+        # Counted against their groups by refresh_batch, with the requests the job never ran
+        print(f"{len(failed)} batch request(s) failed")
+
+    answered = set(AIResponse.objects.filter(psa_entry_id__in=results).values_list('psa_entry_id', flat=True))
+    entries = PSAEntry.objects.only('id', 'group_id', 'problem', 'answer').in_bulk([entry_id for entry_id in results if entry_id not in answered])
+
+    ai_responses = []
+    for entry_id, entry in entries.items():
+        ai_solution, ai_answer = split_ai_response(results[entry_id])
+        solution_cache.store_solution(entry.problem, ai_solution, ai_answer)
+        ai_responses.append(AIResponse(psa_entry=entry, ai_solution=ai_solution, ai_answer=ai_answer, is_correct=ai_answer == entry.answer))
+    return store_responses(ai_responses)
+
+def refresh_batch(job):
+    """Sync a job with the Batch API and store its results once it has finished"""
+    client = openai_client()
+    batch = client.batches.retrieve(job.batch_id)
+    job.status = batch.status
+    job.output_file_id = batch.output_file_id or ''
+    job.error_file_id = batch.error_file_id or ''
+
+    created = []
+    if job.status in AIBatchJob.FINISHED_STATUSES:
+        if job.output_file_id:
+            created = store_batch_output(client.files.content(job.output_file_id).text)
+        if job.error_file_id:
+            store_batch_output(client.files.content(job.error_file_id).text)
+        # Failed requests, and those an expired or cancelled job never ran, left their entries unanswered
+        psa_group_ids = list(job.groups.values_list('id', flat=True))
+        PSAGroup.recount_failed(psa_group_ids)
+        for psa_group_id, answered, failed in PSAGroup.objects.filter(id__in=psa_group_ids, failed_count__gt=0).values_list(
+            'id', 'answered_count', 'failed_count'
+        ):
+            publish_group_event(psa_group_id, 'incomplete', answered=answered, failed=failed)
+        job.completed_at = timezone.now()
+    job.save(update_fields=['status', 'output_file_id', 'error_file_id', 'completed_at'])
+    return created
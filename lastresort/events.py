@@ -0,0 +1,84 @@
+import json
+import time
+import redis
+import redis.asyncio
+from django.conf import settings
+
+_connection = None
+
+# Partial solutions are deleted once the AIResponse is stored; this only cleans up after failures
+PARTIAL_TTL = 3600
+
+def group_channel(psa_group_id):
+    return f'lastresort:group:{psa_group_id}'
+
+def partial_key(psa_entry_id):
+    return f'lastresort:partial:{psa_entry_id}'
+
+def get_connection():
+    """Process-wide Redis connection for publishing events and counters"""
+    global _connection
+    if _connection is None:
+        _connection = redis.Redis.from_url(settings.EVENTS_REDIS_URL)
+    return _connection
+
+def get_async_connection():
+    """New asyncio Redis connection, owned and closed by the caller"""
+    return redis.asyncio.Redis.from_url(settings.EVENTS_REDIS_URL)
+
+def publish_group_event(psa_group_id, event, **data):
+    """Publish an event to everyone watching a PSA group; never raises"""
+    if not settings.EVENTS_REDIS_URL:
+        return
+    try:
+        get_connection().publish(group_channel(psa_group_id), json.dumps({'event': event, **data}))
+    except redis.RedisError as e:
+        print(f"Error publishing {event} event for PSA group {psa_group_id}: {e}")
+
+
+class PartialSolution:
+    """Model output for one entry as it streams in, kept in Redis and announced to watchers"""
+
+    def __init__(self, psa_group_id, psa_entry_id):
+        self.psa_group_id = psa_group_id
+        self.psa_entry_id = psa_entry_id
+        self.length = 0
+        self.pending = []
+        self.flushed_at = time.monotonic()
+
+    def write(self, delta):
+        # Batched so a token-by-token stream costs a few Redis writes a second, not one per token
+        self.pending.append(delta)
+        if time.monotonic() - self.flushed_at >= settings.AI_STREAM_FLUSH_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        self.flushed_at = time.monotonic()
+        if not self.pending:
+            return
+        delta = ''.join(self.pending)
+        self.pending = []
+        offset = self.length
+        try:
+            key = partial_key(self.psa_entry_id)
+            if offset == 0:
+                # A retried task starts over, replacing whatever the failed attempt left behind
+                get_connection().set(key, delta, ex=PARTIAL_TTL)
+            else:
+                pipe = get_connection().pipeline(transaction=False)
+                pipe.append(key, delta)
+                pipe.expire(key, PARTIAL_TTL)
+                pipe.execute()
+        except redis.RedisError as e:
+            print(f"Error storing partial solution for PSA entry {self.psa_entry_id}: {e}")
+            return
+        # Offsets count UTF-16 code units, as JavaScript strings on the output page do
+        self.length += len(delta.encode('utf-16-le')) // 2
+        publish_group_event(self.psa_group_id, 'partial', psa_entry_id=self.psa_entry_id, offset=offset, delta=delta)
+
+    def clear(self):
+        self.pending = []
+        try:
+            get_connection().delete(partial_key(self.psa_entry_id))
+        except redis.RedisError as e:
+            print(f"Error clearing partial solution for PSA entry {self.psa_entry_id}: {e}")
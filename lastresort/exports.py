@@ -0,0 +1,82 @@
+import csv
+import json
+from .models import AISolution, PSAEntry
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+}
+EXPORT_CHUNK_SIZE = 2000
+
+# One row per entry and AI response, in the order they are written out
+EXPORT_FIELDS = {
+    'competition_id': 'group__competition_id',
+    'submission_id': 'group_id',
+    'username': 'group__user__username',
+    'status': 'group__status',
+    'score': 'group__score',
+    'submitted_at': 'group__pub_date',
+    'graded_at': 'group__graded_at',
+    'entry_id': 'id',
+    'problem': 'problem',
+    'solution': 'solution',
+    'answer': 'answer',
+    'ai_answer': 'airesponse__ai_answer',
+    'is_correct': 'airesponse__is_correct',
+    'ai_solution': 'airesponse__solution__compressed_text',
+}
+
+class _Echo:
+    """File-like object whose write() hands the line back, so csv.writer can feed a stream"""
+
+    def write(self, value):
+        return value
+
+def export_rows(psa_groups):
+    """Yield a dict per entry of the given groups, reading the database in chunks"""
+    entries = PSAEntry.objects.filter(group__in=psa_groups).order_by('group_id', 'id').values_list(*EXPORT_FIELDS.values())
+    for values in entries.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        row = dict(zip(EXPORT_FIELDS, values))
+        row['ai_solution'] = AISolution.decompress(row['ai_solution'])
+        yield row
+
+def stream_csv(rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(list(EXPORT_FIELDS))
+    for row in rows:
+        yield writer.writerow([row[field] for field in EXPORT_FIELDS])
+
+def stream_jsonl(rows):
+    for row in rows:
+        yield json.dumps(row, default=str) + '\n'
+
+def stream_export(psa_groups, export_format):
+    rows = export_rows(psa_groups)
+    if export_format == 'csv':
+        return stream_csv(rows)
+    return stream_jsonl(rows)
+
+def stream_submission_text(psa_group):
+    """The plain text download of one submission, a section at a time"""
+    yield (
+        f"Submission Details\n"
+        f"{'=' * 50}\n\n"
+        f"Competition: {psa_group.competition.name}\n"
+        f"Submitted by: {psa_group.user.username}\n"
+        f"Submission Date: {psa_group.pub_date.strftime('%Y-%m-%d %H:%M:%S')}\n"
+        f"Status: {psa_group.status}\n"
+        f"Score: {psa_group.score}%\n"
+    )
+    if psa_group.reason:
+        yield f"Reason: {psa_group.reason}\n"
+    yield f"\nQuestions and Solutions\n{'=' * 50}\n\n"
+
+    entries = PSAEntry.objects.filter(group=psa_group).order_by('pub_date').only('problem', 'solution', 'answer', 'pub_date')
+    for i, entry in enumerate(entries.iterator(chunk_size=EXPORT_CHUNK_SIZE), 1):
+        yield (
+            f"Question {i}:\n"
+            f"Problem: {entry.problem}\n"
+            f"Solution: {entry.solution}\n"
+            f"Answer: {entry.answer}\n"
+            f"Submitted: {entry.pub_date.strftime('%Y-%m-%d %H:%M:%S')}\n\n"
+        )
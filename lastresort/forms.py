@@ -1,10 +1,82 @@
+import csv
+import io
+import json
 from django import forms
 
+UPLOAD_FORMATS = ['.csv', '.jsonl']
+
 class PSAEntryForm(forms.Form):
     def __init__(self, *args, **kwargs):
         num_questions = kwargs.pop('num_questions')
         super().__init__(*args, **kwargs)
+        self.num_questions = num_questions
         for i in range(num_questions):
             self.fields[f'question_{i}'] = forms.CharField(label=f'Question {i+1}', max_length=1000)
             self.fields[f'solution_{i}'] = forms.CharField(label=f'Solution {i+1}', max_length=1000)
-            self.fields[f'answer_{i}'] = forms.CharField(label=f'Answer {i+1}', max_length=100)
\ No newline at end of file
+            self.fields[f'answer_{i}'] = forms.CharField(label=f'Answer {i+1}', max_length=100)
+
+    def entries(self):
+        """(problem, solution, answer) for each question, in order"""
+        return [
+            (self.cleaned_data[f'question_{i}'], self.cleaned_data[f'solution_{i}'], self.cleaned_data[f'answer_{i}'])
+            for i in range(self.num_questions)
+        ]
+
+class PSAEntryRowForm(forms.Form):
+    """One uploaded row, validated like a single question of PSAEntryForm"""
+    problem = forms.CharField(max_length=1000)
+    solution = forms.CharField(max_length=1000)
+    answer = forms.CharField(max_length=100)
+
+def _read_rows(uploaded_file):
+    """Yield one dict per CSV row or JSON line without reading the whole file into memory"""
+    uploaded_file.seek(0)
+    text = io.TextIOWrapper(uploaded_file.file, encoding='utf-8-sig', newline='')
+    try:
+        if uploaded_file.name.lower().endswith('.csv'):
+            yield from csv.DictReader(text)
+        else:
+            for line in text:
+                if line.strip():
+                    yield json.loads(line)
+    finally:
+        text.detach()
+
+class PSAUploadForm(forms.Form):
+    file = forms.FileField(help_text='CSV with problem, solution and answer columns, or JSON lines with the same keys')
+
+    def __init__(self, *args, **kwargs):
+        self.num_questions = kwargs.pop('num_questions')
+        super().__init__(*args, **kwargs)
+
+    def clean_file(self):
+        uploaded_file = self.cleaned_data['file']
+        if not uploaded_file.name.lower().endswith(tuple(UPLOAD_FORMATS)):
+            raise forms.ValidationError(f"Upload a {' or '.join(UPLOAD_FORMATS)} file.")
+
+        entries = []
+        try:
+            for row_number, row in enumerate(_read_rows(uploaded_file), 1):
+                if len(entries) == self.num_questions:
+                    raise forms.ValidationError(f'The file has more than the {self.num_questions} questions this competition asks for.')
+                if not isinstance(row, dict):
+                    raise forms.ValidationError(f'Row {row_number}: expected an object with problem, solution and answer.')
+                row_form = PSAEntryRowForm({
+                    'problem': row.get('problem', row.get('question')),
+                    'solution': row.get('solution'),
+                    'answer': row.get('answer'),
+                })
+                if not row_form.is_valid():
+                    errors = '; '.join(f'{field}: {" ".join(messages)}' for field, messages in row_form.errors.items())
+                    raise forms.ValidationError(f'Row {row_number}: {errors}')
+                entries.append((row_form.cleaned_data['problem'], row_form.cleaned_data['solution'], row_form.cleaned_data['answer']))
+        except (UnicodeDecodeError, csv.Error, json.JSONDecodeError) as e:
+            raise forms.ValidationError(f'Could not read the file: {e}')
+
+        if len(entries) != self.num_questions:
+            raise forms.ValidationError(f'The file has {len(entries)} questions; this competition asks for {self.num_questions}.')
+        self.cleaned_data['entries'] = entries
+        return uploaded_file
+
+    def entries(self):
+        return self.cleaned_data['entries']
@@ -0,0 +1,129 @@
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.utils import timezone
+import redis
+from . import metrics, replicas
+
+VERSION_PREFIX = 'fragment-version:'
+FRAGMENT_PREFIX = 'fragment:'
+
+_missing = object()
+
+# Scopes name the data a fragment is built from; writing that data bumps the scope's version,
+# which changes the key of every fragment built from it:
+#   competitions                        any competition (dashboard lists)
+#   user:<user>:competitions            the competitions a user has registered for
+#   submissions:<competition>:<user>    a user's submissions to a competition
+#   group:<group>                       a submission and its AI responses
+#   leaderboard:<competition>           a competition's leaderboard entries
+
+def group_scopes(psa_group_id, competition_id, user_id):
+    return [f'group:{psa_group_id}', f'submissions:{competition_id}:{user_id}']
+
+def versions(scopes):
+    """Current version of each scope; unseen scopes start from the clock so an evicted version is never reused"""
+    keys = [VERSION_PREFIX + scope for scope in scopes]
+    found = cache.get_many(keys)
+    for key in keys:
+        if key not in found:
+            initial = time.time_ns()
+            cache.add(key, initial, None)
+            found[key] = cache.get(key, initial)
+    return [found[key] for key in keys]
+
+def cached(name, scopes, build, vary=(), expires=None):
+    """Return build(), cached until one of the scopes is bumped or the time given by expires(value) passes"""
+    # A replica may not have replayed the write behind the latest bump yet, so what it builds is kept
+    # apart from the primary's fragments, where read-your-writes sessions look, and only briefly
+    replica = replicas.current_replica()
+    try:
+        key = ':'.join([FRAGMENT_PREFIX + name, *map(str, vary), *map(str, versions(scopes)), *([replica] if replica else [])])
+        value = cache.get(key, _missing)
+    except redis.RedisError as e:
+        print(f"Error reading fragment {name}: {e}")
+        return build()
+    if value is not _missing:
+        metrics.inc('lastresort_fragment_cache_requests_total', fragment=name, result='hit')
+        return value
+
+    metrics.inc('lastresort_fragment_cache_requests_total', fragment=name, result='miss')
+    value = build()
+    timeout = settings.FRAGMENT_CACHE_TIMEOUT
+    expires_at = expires(value) if expires else None
+    if expires_at is not None:
+        timeout = min(timeout, int((expires_at - timezone.now()).total_seconds()))
+    if replica:
+        timeout = min(timeout, int(settings.DATABASE_REPLICA_MAX_LAG))
+    if timeout > 0:
+        try:
+            cache.set(key, value, timeout)
+        except redis.RedisError as e:
+            print(f"Error storing fragment {name}: {e}")
+    return value
+
+def _bump(scopes):
+    try:
+        for scope in scopes:
+            key = VERSION_PREFIX + scope
+            try:
+                cache.incr(key)
+            except ValueError:
+                cache.set(key, time.time_ns(), None)
+    except redis.RedisError as e:
+        print(f"Error bumping fragment versions {scopes}: {e}")
+
+def bump(*scopes):
+    """Invalidate the fragments built from these scopes once the current transaction commits"""
+    # Bumping before commit would let a reader cache the old rows under the new version
+    transaction.on_commit(lambda: _bump(scopes))
+
+def bump_groups(psa_groups):
+    """Bump the scopes of groups changed by a queryset update, which sends no signals"""
+    scopes = []
+    for psa_group_id, competition_id, user_id in psa_groups.values_list('id', 'competition_id', 'user_id'):
+        scopes.extend(group_scopes(psa_group_id, competition_id, user_id))
+    if scopes:
+        bump(*scopes)
+
+
+def _competition_changed(sender, instance, **kwargs):
+    bump('competitions')
+
+def _memberships_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ['post_add', 'post_remove', 'post_clear']:
+        return
+    if reverse:
+        bump(f'user:{instance.pk}:competitions')
+    elif pk_set:
+        bump(*(f'user:{user_id}:competitions' for user_id in pk_set))
+    else:
+        # A cleared member list does not say whose it was
+        bump('competitions')
+
+def _group_changed(sender, instance, **kwargs):
+    bump(*group_scopes(instance.id, instance.competition_id, instance.user_id))
+
+def _ai_response_changed(sender, instance, **kwargs):
+    bump(f'group:{instance.psa_entry.group_id}')
+
+def _leaderboard_changed(sender, instance, **kwargs):
+    bump(f'leaderboard:{instance.competition_id}')
+
+def install():
+    """Bump fragment versions whenever the models they are built from are written"""
+    from .models import AIResponse, Competition, LeaderboardEntry, PSAGroup
+    for model, receiver in [
+        (Competition, _competition_changed),
+        (PSAGroup, _group_changed),
+        (AIResponse, _ai_response_changed),
+        (LeaderboardEntry, _leaderboard_changed),
+    ]:
+        post_save.connect(receiver, sender=model, dispatch_uid=f'fragments_{model.__name__}_saved')
+        # Finding each deleted response's group would cost a query per row and keep cascades from
+        # deleting responses in bulk, so the code that deletes them bumps their groups itself
+        if model is not AIResponse:
+            post_delete.connect(receiver, sender=model, dispatch_uid=f'fragments_{model.__name__}_deleted')
+    m2m_changed.connect(_memberships_changed, sender=Competition.user.through, dispatch_uid='fragments_memberships')
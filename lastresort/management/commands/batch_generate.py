@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from lastresort import fragments
+from lastresort.models import AIResponse, Competition, LeaderboardEntry, PSAGroup
+from lastresort.tasks import submit_ai_batch
+
+
+class Command(BaseCommand):
+    help = "Send a competition's accepted submissions to the Batch API as one job"
+
+    def add_arguments(self, parser):
+        parser.add_argument('competition_id', type=int)
+        parser.add_argument('--regenerate', action='store_true', help='Discard existing AI responses and grade everything again')
+        parser.add_argument('--sync', action='store_true', help='Submit from this process instead of queueing a task')
+
+    def handle(self, *args, **options):
+        if not Competition.objects.filter(pk=options['competition_id']).exists():
+            raise CommandError(f"Competition {options['competition_id']} does not exist")
+
+        groups = PSAGroup.objects.filter(competition_id=options['competition_id'], status__in=['accepted', 'completed'])
+        psa_group_ids = list(groups.values_list('id', flat=True))
+        if not psa_group_ids:
+            self.stdout.write('No accepted submissions to generate responses for')
+            return
+
+        if options['regenerate']:
+            with transaction.atomic():
+                deleted, _ = AIResponse.objects.filter(psa_entry__group_id__in=psa_group_ids).delete()
+                # Progress is counted again from zero, so no group completes before its new responses are in
+                groups.update(graded_at=None, status='accepted', answered_count=0, failed_count=0)
+                # Every group will be graded again, which recreates its user's row
+                LeaderboardEntry.objects.filter(competition_id=options['competition_id']).delete()
+                fragments.bump_groups(groups)
+            self.stdout.write(f'Discarded {deleted} existing AI responses')
+
+        if options['sync']:
+            batch_id = submit_ai_batch(psa_group_ids)
+            self.stdout.write(f'Submitted batch {batch_id} for {len(psa_group_ids)} submissions')
+        else:
+            submit_ai_batch.delay(psa_group_ids)
+            self.stdout.write(f'Queued a batch for {len(psa_group_ids)} submissions')
@@ -0,0 +1,76 @@
+import json
+import time
+import uuid
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from lastresort.models import AIResponse, PSAEntry, PSAGroup
+from lastresort.tasks import generate_ai_responses, generate_ai_responses_async
+
+MODES = {
+    'fanout': generate_ai_responses,
+    'async': generate_ai_responses_async,
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Time AI response generation for one group of N entries, comparing the per-entry group() fan-out '
+        'with the single-task asyncio fan-out. Run it against real Celery workers with AI_BACKEND=stub '
+        '(and AI_STUB_LATENCY) to measure the pipeline without API costs.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000])
+        parser.add_argument('--modes', nargs='+', choices=list(MODES), default=list(MODES))
+        parser.add_argument('--timeout', type=float, default=600, help='Seconds to wait for a single run')
+        parser.add_argument('--json', dest='json_path', help='Also write the results to this file as JSON')
+
+    def handle(self, *args, **options):
+        user = User.objects.create_user(f'benchmark-{uuid.uuid4().hex[:12]}')
+        results = []
+        try:
+            for size in options['sizes']:
+                for mode in options['modes']:
+                    results.append(self.run(user, mode, size, options['timeout']))
+        finally:
+            user.delete()
+
+        self.stdout.write(f"{'mode':<8} {'entries':>8} {'seconds':>10} {'entries/s':>10} {'done':>6}")
+        for result in results:
+            self.stdout.write(f"{result['mode']:<8} {result['entries']:>8} {result['seconds']:>10.2f} {result['throughput']:>10.1f} {result['completed']:>6}")
+
+        if options['json_path']:
+            with open(options['json_path'], 'w') as f:
+                json.dump(results, f, indent=2)
+
+    def run(self, user, mode, size, timeout):
+        psa_group = PSAGroup.objects.create(user=user, name=user.username, status='accepted')
+        # Unique problem text keeps the solution cache out of the measurement
+        run_id = uuid.uuid4().hex
+        PSAEntry.objects.bulk_create(
+            PSAEntry(group=psa_group, problem=f'Benchmark {run_id} problem {i}: what is {i} + {i}?', solution='', answer=str(2 * i))
+            for i in range(size)
+        )
+
+        started = time.monotonic()
+        MODES[mode].delay(psa_group.id)
+        completed = 0
+        while time.monotonic() - started < timeout:
+            completed = AIResponse.objects.filter(psa_entry__group=psa_group).count()
+            if completed >= size:
+                break
+            time.sleep(0.1)
+        else:
+            self.stderr.write(f'{mode} with {size} entries timed out after {timeout}s ({completed} done)')
+        elapsed = time.monotonic() - started
+
+        psa_group.delete()
+        if completed == 0 and elapsed >= timeout:
+            raise CommandError('No responses were generated; are Celery workers running?')
+        return {
+            'mode': mode,
+            'entries': size,
+            'completed': completed,
+            'seconds': elapsed,
+            'throughput': completed / elapsed if elapsed else 0,
+        }
@@ -0,0 +1,114 @@
+import json
+import statistics
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.utils import timezone
+from lastresort import synthetic
+from lastresort.models import AIResponse, Competition, PSAGroup
+from lastresort.pagination import encode_cursor, keyset_queryset
+from lastresort.views import ADMIN_REVIEW_PAGE_SIZE, PAST_COMPETITIONS_PAGE_SIZE, USER_SUBMISSIONS_PAGE_SIZE
+
+PREFIX = 'plans'
+
+
+class Command(BaseCommand):
+    help = (
+        'Time the hot queries and capture their query plans. To compare schemas, run it with --json, '
+        'migrate lastresort back to an earlier migration, run it again and use --compare on the two files.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--generate', type=int, metavar='USERS', help='First create synthetic data for this many users')
+        parser.add_argument('--competitions', type=int, default=20)
+        parser.add_argument('--submissions', type=int, default=5, help='Submissions per user')
+        parser.add_argument('--delete', action='store_true', help='Remove the synthetic data created by --generate and exit')
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--analyze', action='store_true', help='Use EXPLAIN ANALYZE (PostgreSQL)')
+        parser.add_argument('--json', dest='json_path', help='Write timings and plans to this file')
+        parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'), help='Compare two --json files instead of running')
+
+    def handle(self, *args, **options):
+        if options['compare']:
+            return self.compare(*options['compare'])
+        if options['delete']:
+            synthetic.delete(PREFIX)
+            self.stdout.write('Deleted synthetic data')
+            return
+        if options['generate']:
+            started = time.monotonic()
+            counts = synthetic.generate(options['generate'], options['competitions'], options['submissions'], prefix=PREFIX)
+            self.stdout.write(f"Generated {', '.join(f'{count} {name}' for name, count in counts.items())} in {time.monotonic() - started:.0f}s")
+
+        results = [self.measure(name, queryset, evaluate, options) for name, queryset, evaluate in self.queries()]
+        self.stdout.write(f"{'query':<28} {'median ms':>10} {'index':>6}")
+        for result in results:
+            self.stdout.write(f"{result['query']:<28} {result['median_ms']:>10.2f} {'yes' if result['uses_index'] else 'no':>6}")
+
+        if options['json_path']:
+            with open(options['json_path'], 'w') as f:
+                json.dump({
+                    'created_at': timezone.now().isoformat(),
+                    'database': connection.vendor,
+                    'rows': {
+                        'psagroup': PSAGroup.objects.count(),
+                        'airesponse': AIResponse.objects.count(),
+                    },
+                    'results': results,
+                }, f, indent=2)
+
+    def queries(self):
+        """(name, queryset, evaluate) for the filters behind the busiest views and tasks"""
+        competition = Competition.objects.annotate(submission_count=Count('psagroup')).order_by('-submission_count').first()
+        if competition is None:
+            raise CommandError('No competitions to benchmark; run with --generate first')
+        psa_group = PSAGroup.objects.filter(competition=competition, status='completed').first()
+        if psa_group is None:
+            raise CommandError(f'Competition {competition.id} has no graded submissions to benchmark')
+        user = psa_group.user
+        pending = PSAGroup.objects.filter(competition=competition, status='pending')
+        # A cursor halfway down the pending list, as "Load more" sends
+        middle = pending.order_by('-pub_date', '-id')[pending.count() // 2:].first()
+        cursor = encode_cursor(middle.pub_date, middle.id) if middle else None
+
+        # The lists are read a page at a time through the (date, id) keyset indexes
+        return [
+            ('admin_review_pending', keyset_queryset(pending, 'pub_date', None)[:ADMIN_REVIEW_PAGE_SIZE + 1], list),
+            ('admin_review_next_page', keyset_queryset(pending, 'pub_date', cursor)[:ADMIN_REVIEW_PAGE_SIZE + 1], list),
+            ('competition_submissions', keyset_queryset(PSAGroup.objects.filter(competition=competition, user=user), 'pub_date', None)[:USER_SUBMISSIONS_PAGE_SIZE + 1], list),
+            ('accepted_groups', PSAGroup.objects.filter(competition=competition, status__in=['accepted', 'completed']).values('id'), list),
+            ('grade_correct_count', AIResponse.objects.filter(psa_entry__group=psa_group, is_correct=True), lambda qs: qs.count()),
+            ('group_ai_responses', AIResponse.objects.filter(psa_entry__group=psa_group).order_by('-pub_date'), list),
+            ('dashboard_active', Competition.objects.active().order_by('-pub_date'), list),
+            ('dashboard_ended', keyset_queryset(Competition.objects.ended(), 'end_date', None)[:PAST_COMPETITIONS_PAGE_SIZE + 1], list),
+            ('membership_exists', competition.user.filter(pk=user.pk), lambda qs: qs.exists()),
+        ]
+
+    def measure(self, name, queryset, evaluate, options):
+        timings = []
+        for _ in range(options['repeat']):
+            started = time.perf_counter()
+            evaluate(queryset.all())
+            timings.append((time.perf_counter() - started) * 1000)
+        plan = queryset.explain(analyze=True) if options['analyze'] and connection.vendor == 'postgresql' else queryset.explain()
+        return {
+            'query': name,
+            'sql': str(queryset.query),
+            'median_ms': statistics.median(timings),
+            'uses_index': 'index' in plan.lower(),
+            'plan': plan,
+        }
+
+    def compare(self, before_path, after_path):
+        with open(before_path) as f:
+            before = {result['query']: result for result in json.load(f)['results']}
+        with open(after_path) as f:
+            after = {result['query']: result for result in json.load(f)['results']}
+
+        self.stdout.write(f"{'query':<28} {'before ms':>10} {'after ms':>10} {'speedup':>8}")
+        for name, result in after.items():
+            if name not in before:
+                continue
+            speedup = before[name]['median_ms'] / result['median_ms'] if result['median_ms'] else 0
+            self.stdout.write(f"{name:<28} {before[name]['median_ms']:>10.2f} {result['median_ms']:>10.2f} {speedup:>7.1f}x")
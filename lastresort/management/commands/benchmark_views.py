@@ -0,0 +1,113 @@
+import json
+import statistics
+import time
+import uuid
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Count, Q
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from lastresort import fragments, synthetic
+from lastresort.models import Competition, PSAGroup
+
+VIEWS = ['dashboard', 'competition', 'leaderboard', 'output', 'check_outputs', 'admin_review', 'download_submission']
+
+
+class Command(BaseCommand):
+    help = (
+        'Generate synthetic data at each scale and record the response time and query count of the main '
+        'views, as a table and optionally as JSON for comparing releases. Uses the configured database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scales', type=int, nargs='+', default=[10, 100, 1000], help='Number of users at each scale')
+        parser.add_argument('--competitions', type=int, default=10)
+        parser.add_argument('--submissions', type=int, default=5, help='Submissions per user')
+        parser.add_argument('--repeat', type=int, default=5, help='Warm requests per view at each scale, after one cold request')
+        parser.add_argument('--views', nargs='+', choices=VIEWS, default=VIEWS)
+        parser.add_argument('--json', dest='json_path', help='Also write the results to this file as JSON')
+        parser.add_argument('--keep', action='store_true', help='Leave the generated data in the database')
+
+    def handle(self, *args, **options):
+        results = []
+        for scale in options['scales']:
+            prefix = f'bench-{uuid.uuid4().hex[:8]}'
+            counts = synthetic.generate(scale, options['competitions'], options['submissions'], prefix=prefix)
+            self.stdout.write(f"Scale {scale}: " + ', '.join(f'{count} {name}' for name, count in counts.items()))
+            try:
+                with override_settings(ALLOWED_HOSTS=['testserver'], SECURE_SSL_REDIRECT=False):
+                    for view in options['views']:
+                        results.append({'scale': scale, 'view': view, **counts, **self.measure(prefix, view, options['repeat'])})
+            finally:
+                if not options['keep']:
+                    synthetic.delete(prefix)
+
+        self.stdout.write(f"{'view':<20} {'users':>7} {'status':>6} {'cold q':>7} {'warm q':>7} {'cold ms':>9} {'median ms':>10} {'max ms':>10}")
+        for result in results:
+            self.stdout.write(
+                f"{result['view']:<20} {result['scale']:>7} {result['status']:>6} {result['cold_queries']:>7} "
+                f"{result['warm_queries']:>7} {result['cold_ms']:>9.1f} {result['median_ms']:>10.1f} {result['max_ms']:>10.1f}"
+            )
+
+        if options['json_path']:
+            with open(options['json_path'], 'w') as f:
+                json.dump({
+                    'created_at': timezone.now().isoformat(),
+                    'database': connection.vendor,
+                    'options': {key: options[key] for key in ('scales', 'competitions', 'submissions', 'repeat')},
+                    'results': results,
+                }, f, indent=2)
+
+    def targets(self, prefix):
+        """The busiest competition, one of its graded submissions and a staff reviewer"""
+        competition = Competition.objects.filter(name__startswith=f'{prefix}-competition-').annotate(
+            submission_count=Count('psagroup'),
+            pending_count=Count('psagroup', filter=Q(psagroup__status='pending'))
+        ).order_by('-pending_count', '-submission_count').first()
+        psa_group = PSAGroup.objects.filter(competition=competition, status='completed').order_by('-pub_date').first()
+        staff, _ = User.objects.get_or_create(username=f'{prefix}-user-staff', defaults={'is_staff': True})
+        return competition, psa_group, staff
+
+    def measure(self, prefix, view, repeat):
+        competition, psa_group, staff = self.targets(prefix)
+        user = staff if view == 'admin_review' else psa_group.user
+        url = {
+            'dashboard': lambda: reverse('lastresort:dashboard'),
+            'competition': lambda: reverse('lastresort:competition', args=(competition.id,)),
+            'leaderboard': lambda: reverse('lastresort:leaderboard', args=(competition.id,)),
+            'output': lambda: reverse('lastresort:output', args=(psa_group.id, competition.id)),
+            'check_outputs': lambda: reverse('lastresort:check_outputs', args=(psa_group.id,)),
+            'admin_review': lambda: reverse('lastresort:admin_review', args=(competition.id,)),
+            'download_submission': lambda: reverse('lastresort:download_submission', args=(psa_group.id,)),
+        }[view]()
+
+        client = Client()
+        client.force_login(user)
+        # The first request builds the fragments from the database and the later ones are served from the
+        # fragment cache, so they are reported apart; bumping the scopes first makes the first request cold
+        fragments._bump([
+            'competitions', f'user:{user.id}:competitions', f'leaderboard:{competition.id}',
+            *fragments.group_scopes(psa_group.id, competition.id, psa_group.user_id),
+        ])
+        counts, timings = [], []
+        for _ in range(repeat + 1):
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                response = client.get(url)
+                if response.streaming:
+                    b''.join(response.streaming_content)
+                timings.append((time.perf_counter() - started) * 1000)
+            counts.append(len(queries))
+        cold_ms, timings = timings[0], timings[1:]
+        return {
+            'status': response.status_code,
+            'cold_queries': counts[0],
+            'cold_ms': cold_ms,
+            'warm_queries': counts[-1],
+            'median_ms': statistics.median(timings),
+            'min_ms': min(timings),
+            'max_ms': max(timings),
+        }
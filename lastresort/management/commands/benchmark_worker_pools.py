@@ -0,0 +1,140 @@
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import uuid
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from lastresort.models import AIResponse, PSAEntry, PSAGroup
+from lastresort.tasks import generate_single_ai_response
+from website.celery import app
+
+
+def pool_config(value):
+    pool, _, concurrency = value.partition(':')
+    if pool not in ('prefork', 'threads', 'solo') or not concurrency.isdigit():
+        raise ValueError(value)
+    return pool, int(concurrency)
+
+def memory_mb(pid):
+    """Proportional set size of a process and its children, so pages shared after fork count once"""
+    total = 0
+    pids = [pid]
+    while pids:
+        current = pids.pop()
+        try:
+            with open(f'/proc/{current}/smaps_rollup') as f:
+                fields = dict(line.split(':', 1) for line in f if ':' in line)
+            total += int((fields.get('Pss') or fields['Rss']).split()[0])
+            with open(f'/proc/{current}/task/{current}/children') as f:
+                pids.extend(int(child) for child in f.read().split())
+        except (FileNotFoundError, ProcessLookupError):
+            continue
+    return total / 1024
+
+
+class Command(BaseCommand):
+    help = (
+        'Start a Celery worker per pool configuration on a private queue, run model-call tasks through it with '
+        'AI_BACKEND=stub and report throughput, peak memory and entries/s per GB. Needs the broker, result '
+        'backend and database the workers use; Linux only (memory is read from /proc).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pools', type=pool_config, nargs='+', default=[('prefork', 4), ('threads', 32), ('threads', 64)],
+                            metavar='POOL:CONCURRENCY', help='e.g. prefork:4 threads:32')
+        parser.add_argument('--entries', type=int, default=200)
+        parser.add_argument('--latency', type=float, default=2.0, help='Stub model latency in seconds')
+        parser.add_argument('--timeout', type=float, default=600, help='Seconds to wait for a single run')
+        parser.add_argument('--json', dest='json_path', help='Also write the results to this file as JSON')
+
+    def handle(self, *args, **options):
+        user = User.objects.create_user(f'benchmark-{uuid.uuid4().hex[:12]}')
+        results = []
+        try:
+            for pool, concurrency in options['pools']:
+                results.append(self.run(user, pool, concurrency, options))
+        finally:
+            user.delete()
+
+        self.stdout.write(f"{'pool':<8} {'workers':>8} {'entries':>8} {'seconds':>9} {'entries/s':>10} {'peak MB':>9} {'per GB':>8}")
+        for result in results:
+            self.stdout.write(
+                f"{result['pool']:<8} {result['concurrency']:>8} {result['completed']:>8} {result['seconds']:>9.2f} "
+                f"{result['throughput']:>10.1f} {result['peak_mb']:>9.0f} {result['throughput_per_gb']:>8.1f}"
+            )
+
+        if options['json_path']:
+            with open(options['json_path'], 'w') as f:
+                json.dump(results, f, indent=2)
+
+    def start_worker(self, pool, concurrency, queue, hostname, latency):
+        env = dict(
+            os.environ,
+            AI_BACKEND='stub',
+            AI_STUB_LATENCY=str(latency),
+            AI_STUB_ERROR_RATE='0',
+            # The shared quota would cap every configuration at the same rate
+            AI_RATE_LIMIT_RPM='0',
+            AI_RATE_LIMIT_TPM='0',
+        )
+        worker = subprocess.Popen(
+            [sys.executable, '-m', 'celery', '-A', 'website', 'worker', '-l', 'warning', '-Q', queue,
+             '--pool', pool, '--concurrency', str(concurrency), '--hostname', hostname, '--without-gossip', '--without-mingle'],
+            env=env,
+            stdout=subprocess.DEVNULL,
+        )
+        deadline = time.monotonic() + 60
+        while time.monotonic() < deadline:
+            if worker.poll() is not None:
+                raise CommandError(f'{pool} worker exited with status {worker.returncode}')
+            if app.control.ping(destination=[hostname], timeout=1):
+                return worker
+        worker.terminate()
+        raise CommandError(f'{pool} worker did not start within 60s')
+
+    def run(self, user, pool, concurrency, options):
+        psa_group = PSAGroup.objects.create(user=user, name=user.username, status='accepted', entry_count=options['entries'])
+        # Unique problem text keeps the solution cache out of the measurement
+        run_id = uuid.uuid4().hex
+        entries = PSAEntry.objects.bulk_create(
+            PSAEntry(group=psa_group, problem=f'Benchmark {run_id} problem {i}: what is {i} + {i}?', solution='', answer=str(2 * i))
+            for i in range(options['entries'])
+        )
+
+        queue = f'benchmark-{run_id[:12]}'
+        worker = self.start_worker(pool, concurrency, queue, f'benchmark-{pool}-{run_id[:12]}@{socket.gethostname()}', options['latency'])
+        try:
+            baseline_mb = peak_mb = memory_mb(worker.pid)
+            started = time.monotonic()
+            for entry in entries:
+                generate_single_ai_response.apply_async((psa_group.id, entry.id), queue=queue)
+            completed = 0
+            while time.monotonic() - started < options['timeout']:
+                peak_mb = max(peak_mb, memory_mb(worker.pid))
+                completed = AIResponse.objects.filter(psa_entry__group=psa_group).count()
+                if completed >= len(entries):
+                    break
+                time.sleep(0.2)
+            else:
+                self.stderr.write(f'{pool}:{concurrency} timed out after {options["timeout"]}s ({completed} done)')
+            elapsed = time.monotonic() - started
+        finally:
+            worker.terminate()
+            worker.wait(30)
+            psa_group.delete()
+
+        throughput = completed / elapsed if elapsed else 0
+        return {
+            'pool': pool,
+            'concurrency': concurrency,
+            'entries': len(entries),
+            'completed': completed,
+            'seconds': elapsed,
+            'throughput': throughput,
+            'idle_mb': baseline_mb,
+            'peak_mb': peak_mb,
+            'throughput_per_gb': throughput / (peak_mb / 1024) if peak_mb else 0,
+        }
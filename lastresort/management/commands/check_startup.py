@@ -0,0 +1,59 @@
+import os
+import subprocess
+import sys
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+SETUP_CODE = 'import django; django.setup()'
+# Only processes that call the model need these; importing them during setup slows every process
+LAZY_MODULES = ['openai', 'httpx']
+
+
+def import_times(output):
+    """(module, cumulative ms) for each line of python -X importtime output"""
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line.split('|')
+        # One space separates the columns; deeper imports are indented further
+        yield name[1:].rstrip(), int(cumulative) / 1000
+
+
+class Command(BaseCommand):
+    help = (
+        'Time django.setup() in fresh interpreters and fail if it is slower than STARTUP_BUDGET_MS '
+        'or imports a module that should only be loaded on first use.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--budget-ms', type=float, default=settings.STARTUP_BUDGET_MS)
+        parser.add_argument('--runs', type=int, default=5, help='Take the fastest of this many cold starts')
+        parser.add_argument('--top', type=int, default=10, help='Show the slowest top-level imports')
+
+    def handle(self, *args, **options):
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', 'website.settings'))
+        timings = []
+        for _ in range(options['runs']):
+            started = time.perf_counter()
+            subprocess.run([sys.executable, '-c', SETUP_CODE], env=env, check=True)
+            timings.append((time.perf_counter() - started) * 1000)
+        best = min(timings)
+
+        profile = subprocess.run([sys.executable, '-X', 'importtime', '-c', SETUP_CODE], env=env, check=True, capture_output=True, text=True)
+        modules = list(import_times(profile.stderr))
+        top_level = sorted(((name, ms) for name, ms in modules if not name.startswith(' ')), key=lambda module: module[1], reverse=True)
+        self.stdout.write(f"django.setup() in {best:.0f}ms (fastest of {options['runs']}, budget {options['budget_ms']:.0f}ms)")
+        self.stdout.write('Slowest imports (cumulative, under -X importtime):')
+        for name, ms in top_level[:options['top']]:
+            self.stdout.write(f'  {ms:>8.1f}ms  {name}')
+
+        eager = sorted({name.strip().split('.')[0] for name, _ in modules} & set(LAZY_MODULES))
+        problems = []
+        if eager:
+            problems.append(f"imported during setup: {', '.join(eager)}")
+        if best > options['budget_ms']:
+            problems.append(f"{best:.0f}ms is over the {options['budget_ms']:.0f}ms budget")
+        if problems:
+            raise CommandError('Startup check failed: ' + '; '.join(problems))
+        self.stdout.write('Startup check passed')
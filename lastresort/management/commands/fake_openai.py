@@ -0,0 +1,202 @@
+import json
+import threading
+import time
+import uuid
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from django.core.management.base import BaseCommand
+
+
+class FakeOpenAI:
+    """In-memory stand-in for the files, batches and responses endpoints"""
+
+    def __init__(self, answer, batch_delay, latency=0):
+        self.answer = answer
+        self.batch_delay = batch_delay
+        self.latency = latency
+        self.files = {}
+        self.batches = {}
+        self.lock = threading.Lock()
+
+    def solve(self, prompt):
+        return f"Stand-in solution for: {prompt}\n{self.answer}"
+
+    def response_body(self, body):
+        return {
+            'id': f'resp_{uuid.uuid4().hex}',
+            'object': 'response',
+            'created_at': int(time.time()),
+            'model': body.get('model', ''),
+            'status': 'completed',
+            'output': [{
+                'id': f'msg_{uuid.uuid4().hex}',
+                'type': 'message',
+                'role': 'assistant',
+                'status': 'completed',
+                'content': [{'type': 'output_text', 'text': self.solve(body.get('input', '')), 'annotations': []}],
+            }],
+            'parallel_tool_calls': True,
+            'tool_choice': 'auto',
+            'tools': [],
+        }
+
+    def response_events(self, body):
+        """The server-sent events of a streamed response: one delta per word, then the full response"""
+        response = self.response_body(body)
+        item_id = response['output'][0]['id']
+        words = response['output'][0]['content'][0]['text'].split(' ')
+        events = [{'type': 'response.created', 'response': {**response, 'status': 'in_progress', 'output': []}}]
+        for i, word in enumerate(words):
+            events.append({
+                'type': 'response.output_text.delta',
+                'item_id': item_id,
+                'output_index': 0,
+                'content_index': 0,
+                'delta': word if i == 0 else ' ' + word,
+                'logprobs': [],
+            })
+        events.append({'type': 'response.completed', 'response': response})
+        for sequence_number, event in enumerate(events):
+            event['sequence_number'] = sequence_number
+        return events
+
+    def create_file(self, filename, content, purpose):
+        file_id = f'file-{uuid.uuid4().hex}'
+        with self.lock:
+            self.files[file_id] = {'filename': filename, 'content': content, 'purpose': purpose}
+        return self.file_object(file_id)
+
+    def file_object(self, file_id):
+        stored = self.files[file_id]
+        return {
+            'id': file_id,
+            'object': 'file',
+            'bytes': len(stored['content']),
+            'created_at': int(time.time()),
+            'filename': stored['filename'],
+            'purpose': stored['purpose'],
+            'status': 'processed',
+        }
+
+    def create_batch(self, body):
+        batch_id = f'batch_{uuid.uuid4().hex}'
+        with self.lock:
+            self.batches[batch_id] = {
+                'id': batch_id,
+                'object': 'batch',
+                'endpoint': body['endpoint'],
+                'input_file_id': body['input_file_id'],
+                'completion_window': body['completion_window'],
+                'status': 'in_progress',
+                'created_at': int(time.time()),
+                'output_file_id': None,
+                'error_file_id': None,
+            }
+            return dict(self.batches[batch_id])
+
+    def get_batch(self, batch_id):
+        with self.lock:
+            batch = self.batches[batch_id]
+            if batch['status'] == 'in_progress' and time.time() - batch['created_at'] >= self.batch_delay:
+                self._complete_batch(batch)
+            return dict(batch)
+
+    def _complete_batch(self, batch):
+        requests = self.files[batch['input_file_id']]['content'].decode('utf-8').splitlines()
+        lines = []
+        for line in requests:
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            lines.append(json.dumps({
+                'id': f'batch_req_{uuid.uuid4().hex}',
+                'custom_id': request['custom_id'],
+                'response': {'status_code': 200, 'request_id': uuid.uuid4().hex, 'body': self.response_body(request['body'])},
+                'error': None,
+            }))
+        output_file_id = f'file-{uuid.uuid4().hex}'
+        self.files[output_file_id] = {'filename': 'output.jsonl', 'content': '\n'.join(lines).encode('utf-8'), 'purpose': 'batch_output'}
+        batch['status'] = 'completed'
+        batch['output_file_id'] = output_file_id
+        batch['request_counts'] = {'total': len(lines), 'completed': len(lines), 'failed': 0}
+
+
+def make_handler(api):
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, status, payload, content_type='application/json'):
+            data = payload if isinstance(payload, bytes) else json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _stream(self, events):
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.end_headers()
+            for event in events:
+                if event['type'] == 'response.output_text.delta':
+                    time.sleep(api.latency / len(events))
+                self.wfile.write(f"event: {event['type']}\ndata: {json.dumps(event)}\n\n".encode('utf-8'))
+                self.wfile.flush()
+            self.close_connection = True
+
+        def _body(self):
+            return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+        def do_POST(self):
+            path = self.path.split('?')[0].rstrip('/')
+            if path.endswith('/files'):
+                message = BytesParser().parsebytes(f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode('utf-8') + self._body())
+                fields = {}
+                for part in message.get_payload():
+                    fields[part.get_param('name', header='content-disposition')] = (part.get_filename(), part.get_payload(decode=True))
+                filename, content = fields['file']
+                return self._send(200, api.create_file(filename, content, fields['purpose'][1].decode('utf-8')))
+            if path.endswith('/batches'):
+                return self._send(200, api.create_batch(json.loads(self._body())))
+            if path.endswith('/responses'):
+                body = json.loads(self._body())
+                if body.get('stream'):
+                    return self._stream(api.response_events(body))
+                time.sleep(api.latency)
+                return self._send(200, api.response_body(body))
+            return self._send(404, {'error': {'message': f'Unknown endpoint {path}'}})
+
+        def do_GET(self):
+            parts = self.path.split('?')[0].strip('/').split('/')
+            try:
+                if parts[-2] == 'batches':
+                    return self._send(200, api.get_batch(parts[-1]))
+                if parts[-3] == 'files' and parts[-1] == 'content':
+                    return self._send(200, api.files[parts[-2]]['content'], 'application/octet-stream')
+                if parts[-2] == 'files':
+                    return self._send(200, api.file_object(parts[-1]))
+            except (IndexError, KeyError):
+                pass
+            return self._send(404, {'error': {'message': f'Unknown resource {self.path}'}})
+
+    return Handler
+
+
+class Command(BaseCommand):
+    help = 'Run a local stand-in for the OpenAI files, batches and responses APIs (set OPENAI_BASE_URL to use it)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8089)
+        parser.add_argument('--answer', default='42', help='Final answer line returned for every problem')
+        parser.add_argument('--batch-delay', type=float, default=0, help='Seconds before a batch reports completed')
+        parser.add_argument('--latency', type=float, default=0, help='Seconds each responses call takes')
+
+    def handle(self, *args, **options):
+        api = FakeOpenAI(options['answer'], options['batch_delay'], options['latency'])
+        server = ThreadingHTTPServer((options['host'], options['port']), make_handler(api))
+        self.stdout.write(f"Fake OpenAI API listening on http://{options['host']}:{options['port']}/v1")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
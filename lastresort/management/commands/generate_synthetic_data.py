@@ -0,0 +1,26 @@
+import time
+from django.core.management.base import BaseCommand
+from lastresort import synthetic
+
+
+class Command(BaseCommand):
+    help = 'Fill the database with synthetic users, competitions, submissions and AI responses'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--competitions', type=int, default=10)
+        parser.add_argument('--submissions', type=int, default=5, help='Submissions per user')
+        parser.add_argument('--prefix', default='synthetic', help='Name prefix, used again by --delete')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--delete', action='store_true', help='Remove previously generated data with this prefix instead')
+
+    def handle(self, *args, **options):
+        if options['delete']:
+            synthetic.delete(options['prefix'])
+            self.stdout.write(f"Deleted synthetic data with prefix {options['prefix']}")
+            return
+
+        started = time.monotonic()
+        counts = synthetic.generate(options['users'], options['competitions'], options['submissions'], prefix=options['prefix'], seed=options['seed'])
+        summary = ', '.join(f'{count} {name}' for name, count in counts.items())
+        self.stdout.write(f'Created {summary} in {time.monotonic() - started:.1f}s')
@@ -0,0 +1,14 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from lastresort import rate_limit
+
+
+class Command(BaseCommand):
+    help = 'Report how often model calls waited on the shared rate limit or were retried'
+
+    def handle(self, *args, **options):
+        stats = rate_limit.stats()
+        self.stdout.write(f"Limits:       {settings.AI_RATE_LIMIT_RPM} requests/min, {settings.AI_RATE_LIMIT_TPM} tokens/min")
+        self.stdout.write(f"Waits:        {stats['waits']}")
+        self.stdout.write(f"Time waiting: {stats['wait_seconds']:.1f}s")
+        self.stdout.write(f"Retries:      {stats['retries']}")
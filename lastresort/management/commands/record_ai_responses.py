@@ -0,0 +1,28 @@
+import json
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from lastresort.models import AIResponse, SOLUTION_PROMPT
+
+
+class Command(BaseCommand):
+    help = 'Write stored AI responses as prompt/output records for AI_BACKEND=replay'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=settings.AI_REPLAY_PATH, help='JSON lines file to write (defaults to AI_REPLAY_PATH)')
+        parser.add_argument('--competition', type=int, help='Only record responses to this competition')
+
+    def handle(self, *args, **options):
+        responses = AIResponse.objects.select_related('psa_entry', 'solution').only('psa_entry__problem', 'solution__compressed_text')
+        if options['competition']:
+            responses = responses.filter(psa_entry__group__competition_id=options['competition'])
+
+        recorded = set()
+        with open(options['output'], 'w', encoding='utf-8') as f:
+            for ai_response in responses.iterator():
+                prompt = SOLUTION_PROMPT.format(problem=ai_response.psa_entry.problem)
+                if prompt in recorded:
+                    continue
+                recorded.add(prompt)
+                # ai_solution holds the model's full output, answer line included
+                f.write(json.dumps({'prompt': prompt, 'output': ai_response.ai_solution}) + '\n')
+        self.stdout.write(f"Recorded {len(recorded)} responses to {options['output']}")
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from lastresort import solution_cache
+
+
+class Command(BaseCommand):
+    help = 'Report solution cache size and hit/miss counts, optionally evicting stale entries first'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--evict', action='store_true', help='Run TTL/LRU eviction before reporting')
+
+    def handle(self, *args, **options):
+        if options['evict']:
+            self.stdout.write(f"Evicted {solution_cache.evict()} entries")
+        stats = solution_cache.stats()
+        self.stdout.write(f"Entries:  {stats['entries']}")
+        self.stdout.write(f"Hits:     {stats['hits']}")
+        self.stdout.write(f"Misses:   {stats['misses']}")
+        self.stdout.write(f"Hit rate: {stats['hit_rate']:.1%}")
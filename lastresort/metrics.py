@@ -0,0 +1,246 @@
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from celery.signals import task_prerun, task_postrun
+from django.conf import settings
+from django.db.models import Count
+from django.http import HttpResponse, HttpResponseForbidden
+import redis
+from .events import get_connection
+
+# Every process adds its observations to one Redis hash, so the numbers are already summed over
+# gunicorn workers and prefork children when they are scraped. Fields are 'name|labels|suffix'.
+KEY = 'lastresort:metrics'
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+REQUEST_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+TASK_BUCKETS = [0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 900]
+MODEL_BUCKETS = [0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120]
+
+# name: (type, help, histogram buckets)
+METRICS = {
+    'lastresort_request_duration_seconds': ('histogram', 'Time to produce a response, per URL name', REQUEST_BUCKETS),
+    'lastresort_responses_total': ('counter', 'Responses per URL name and status class', None),
+    'lastresort_task_duration_seconds': ('histogram', 'Celery task run time, per task', TASK_BUCKETS),
+    'lastresort_task_runs_total': ('counter', 'Finished Celery task runs per task and final state', None),
+    'lastresort_model_call_duration_seconds': ('histogram', 'Model call latency, per backend', MODEL_BUCKETS),
+    'lastresort_model_calls_total': ('counter', 'Model calls per backend and outcome', None),
+    'lastresort_model_tokens_total': ('counter', 'Tokens reported by the model, per backend and kind', None),
+    'lastresort_model_samples_cancelled_total': ('counter', 'Model samples cancelled once their entry was decided or another sample failed', None),
+    'lastresort_fragment_cache_requests_total': ('counter', 'Fragment cache lookups per fragment and result', None),
+}
+
+_pending = defaultdict(float)
+_lock = threading.Lock()
+_task_started = {}
+
+
+def _labels(labels):
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return ','.join(f'{name}="{escape(value)}"' for name, value in sorted(labels.items()))
+
+def inc(name, amount=1, **labels):
+    """Add to a counter; the change reaches Redis on the next flush()"""
+    with _lock:
+        _pending[f'{name}|{_labels(labels)}|'] += amount
+
+def observe(name, value, **labels):
+    """Add an observation to a histogram; only its own bucket is stored, the cumulative counts are built on scrape"""
+    buckets = METRICS[name][2]
+    index = bisect_left(buckets, value)
+    le = _format(buckets[index]) if index < len(buckets) else '+Inf'
+    prefix = f'{name}|{_labels(labels)}|'
+    with _lock:
+        _pending[prefix + f'bucket:{le}'] += 1
+        _pending[prefix + 'sum'] += value
+        _pending[prefix + 'count'] += 1
+
+def flush():
+    """Write what this process has observed since the last flush"""
+    global _pending
+    with _lock:
+        pending, _pending = _pending, defaultdict(float)
+    if not pending or not settings.METRICS_ENABLED or not settings.EVENTS_REDIS_URL:
+        return
+    try:
+        pipe = get_connection().pipeline(transaction=False)
+        for field, amount in pending.items():
+            pipe.hincrbyfloat(KEY, field, amount)
+        pipe.execute()
+    except redis.RedisError as e:
+        print(f"Error recording metrics: {e}")
+
+@contextmanager
+def model_call(backend):
+    """Time a model call; the caller may fill in the yielded dict with input_tokens and output_tokens"""
+    usage = {}
+    started = time.perf_counter()
+    try:
+        yield usage
+    except Exception:
+        inc('lastresort_model_calls_total', backend=backend, outcome='error')
+        raise
+    finally:
+        observe('lastresort_model_call_duration_seconds', time.perf_counter() - started, backend=backend)
+    inc('lastresort_model_calls_total', backend=backend, outcome='ok')
+    record_tokens(backend, usage)
+
+def record_tokens(backend, usage):
+    for kind in ('input_tokens', 'output_tokens'):
+        if usage.get(kind):
+            inc('lastresort_model_tokens_total', usage[kind], backend=backend, kind=kind.removesuffix('_tokens'))
+
+def response_usage(usage):
+    """input_tokens and output_tokens of a Responses API usage object or dict"""
+    if usage is None:
+        return {}
+    if isinstance(usage, dict):
+        return {kind: usage.get(kind) for kind in ('input_tokens', 'output_tokens')}
+    return {kind: getattr(usage, kind, None) for kind in ('input_tokens', 'output_tokens')}
+
+
+class MetricsMiddleware:
+    """Record response time and status per URL name"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not settings.METRICS_ENABLED:
+            return self.get_response(request)
+        started = time.perf_counter()
+        response = self.get_response(request)
+        # Unresolved paths share one label so scanners cannot blow up the series count
+        view = request.resolver_match.view_name if request.resolver_match else 'unresolved'
+        observe('lastresort_request_duration_seconds', time.perf_counter() - started, view=view)
+        inc('lastresort_responses_total', view=view, status=f'{response.status_code // 100}xx')
+        flush()
+        return response
+
+    async def __acall__(self, request):
+        # Async views are long-lived streams; their duration is the viewer's patience, not latency
+        return await self.get_response(request)
+
+
+def _task_prerun(task_id=None, **kwargs):
+    _task_started[task_id] = time.perf_counter()
+
+def _task_postrun(task_id=None, task=None, retval=None, state=None, **kwargs):
+    started = _task_started.pop(task_id, None)
+    if not settings.METRICS_ENABLED:
+        return
+    if started is not None:
+        observe('lastresort_task_duration_seconds', time.perf_counter() - started, task=task.name)
+    # Tasks that catch their own errors report them as {'success': False}
+    if state == 'SUCCESS' and isinstance(retval, dict) and retval.get('success') is False:
+        state = 'FAILED'
+    inc('lastresort_task_runs_total', task=task.name, state=state)
+    flush()
+
+def install():
+    """Time Celery tasks and count their outcomes"""
+    task_prerun.connect(_task_prerun, weak=False, dispatch_uid='metrics_task_prerun')
+    task_postrun.connect(_task_postrun, weak=False, dispatch_uid='metrics_task_postrun')
+
+
+def _format(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def _stored():
+    """{name: {labels: {suffix: value}}} from the shared hash"""
+    metrics = defaultdict(lambda: defaultdict(dict))
+    for field, value in get_connection().hgetall(KEY).items():
+        name, rest = field.decode('utf-8').split('|', 1)
+        labels, suffix = rest.rsplit('|', 1)
+        metrics[name][labels][suffix] = float(value)
+    return metrics
+
+def _series(name, labels, value, extra=''):
+    labels = ','.join(part for part in (labels, extra) if part)
+    return f'{name}{{{labels}}} {_format(value)}' if labels else f'{name} {_format(value)}'
+
+def _render_stored(lines):
+    stored = _stored()
+    for name, (kind, help_text, buckets) in METRICS.items():
+        if name not in stored:
+            continue
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for labels, values in sorted(stored[name].items()):
+            if kind != 'histogram':
+                lines.append(_series(name, labels, values['']))
+                continue
+            total = 0
+            for le in [*map(_format, buckets), '+Inf']:
+                total += values.get(f'bucket:{le}', 0)
+                lines.append(_series(f'{name}_bucket', labels, total, f'le="{le}"'))
+            lines.append(_series(f'{name}_sum', labels, values.get('sum', 0)))
+            lines.append(_series(f'{name}_count', labels, values.get('count', 0)))
+
+def _queue_lengths():
+    """Messages waiting in each Celery queue, read from the Redis broker"""
+    from celery import current_app
+    if not (settings.CELERY_BROKER_URL or '').startswith(('redis://', 'rediss://')):
+        return {}
+    client = redis.Redis.from_url(settings.CELERY_BROKER_URL)
+    routes = current_app.conf.task_routes or {}
+    queues = sorted({current_app.conf.task_default_queue, *(route['queue'] for route in routes.values())})
+    pipe = client.pipeline(transaction=False)
+    for queue in queues:
+        pipe.llen(queue)
+    return dict(zip(queues, pipe.execute()))
+
+def _family(lines, name, kind, help_text, samples):
+    lines.append(f'# HELP {name} {help_text}')
+    lines.append(f'# TYPE {name} {kind}')
+    for labels, value in samples:
+        lines.append(_series(name, _labels(labels), value))
+
+def render():
+    """The Prometheus text exposition of every metric"""
+    from . import rate_limit, solution_cache
+    from .models import PSAGroup
+    lines = []
+    if settings.EVENTS_REDIS_URL:
+        try:
+            _render_stored(lines)
+            cache_stats = solution_cache.stats()
+            _family(lines, 'lastresort_solution_cache_requests_total', 'counter', 'Solution cache lookups per result',
+                   [({'result': 'hit'}, cache_stats['hits']), ({'result': 'miss'}, cache_stats['misses'])])
+            limiter = rate_limit.stats()
+            _family(lines, 'lastresort_rate_limit_waits_total', 'counter', 'Model calls that waited for the rate limiter', [({}, limiter['waits'])])
+            _family(lines, 'lastresort_rate_limit_wait_seconds_total', 'counter', 'Time spent waiting for the rate limiter', [({}, limiter['wait_seconds'])])
+            _family(lines, 'lastresort_rate_limit_retries_total', 'counter', 'Model calls retried after a rate limit or outage', [({}, limiter['retries'])])
+        except redis.RedisError as e:
+            print(f"Error reading metrics: {e}")
+    try:
+        _family(lines, 'lastresort_celery_queue_length', 'gauge', 'Messages waiting in each Celery queue',
+               [({'queue': queue}, length) for queue, length in _queue_lengths().items()])
+    except redis.RedisError as e:
+        print(f"Error reading Celery queue lengths: {e}")
+
+    pending = PSAGroup.objects.filter(status='pending').values('competition_id').annotate(count=Count('id')).order_by('competition_id')
+    _family(lines, 'lastresort_pending_reviews', 'gauge', 'Submissions waiting for admin review, per competition',
+           [({'competition': row['competition_id']}, row['count']) for row in pending])
+    return '\n'.join(lines) + '\n'
+
+def metrics_view(request):
+    """Prometheus scrape endpoint, guarded by METRICS_TOKEN; without one, only staff may read it outside DEBUG"""
+    if settings.METRICS_TOKEN:
+        allowed = request.headers.get('Authorization') == f'Bearer {settings.METRICS_TOKEN}'
+    else:
+        allowed = settings.DEBUG or request.user.is_staff
+    if not allowed:
+        return HttpResponseForbidden('Forbidden', content_type='text/plain')
+    return HttpResponse(render(), content_type=CONTENT_TYPE)
@@ -0,0 +1,58 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:09
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_leaderboard(apps, schema_editor):
+    PSAGroup = apps.get_model('lastresort', 'PSAGroup')
+    LeaderboardEntry = apps.get_model('lastresort', 'LeaderboardEntry')
+    groups = PSAGroup.objects.filter(
+        competition__isnull=False,
+        status__in=['accepted', 'completed']
+    ).order_by('competition_id', 'user_id', '-score', 'pub_date')
+
+    entries = []
+    seen = set()
+    for group in groups.iterator():
+        key = (group.competition_id, group.user_id)
+        if key in seen:
+            continue
+        seen.add(key)
+        entries.append(LeaderboardEntry(
+            competition_id=group.competition_id,
+            user_id=group.user_id,
+            best_group_id=group.id,
+            best_score=group.score,
+            best_submission_date=group.pub_date
+        ))
+    LeaderboardEntry.objects.bulk_create(entries, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lastresort', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LeaderboardEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('best_score', models.IntegerField(default=0)),
+                ('best_submission_date', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Best Submission Date')),
+                ('best_group', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='lastresort.psagroup')),
+                ('competition', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='leaderboard_entries', to='lastresort.competition')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['competition', '-best_score', 'best_submission_date'], name='leaderboard_rank_idx')],
+                'constraints': [models.UniqueConstraint(fields=('competition', 'user'), name='leaderboard_unique_competition_user')],
+            },
+        ),
+        migrations.RunPython(backfill_leaderboard, migrations.RunPython.noop),
+    ]
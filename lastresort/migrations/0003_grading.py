@@ -0,0 +1,65 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:12
+
+from django.db import migrations, models
+from django.db.models import Count, Exists, OuterRef, Q
+from django.utils import timezone
+
+
+def backfill_grading(apps, schema_editor):
+    PSAGroup = apps.get_model('lastresort', 'PSAGroup')
+    PSAEntry = apps.get_model('lastresort', 'PSAEntry')
+    AIResponse = apps.get_model('lastresort', 'AIResponse')
+    LeaderboardEntry = apps.get_model('lastresort', 'LeaderboardEntry')
+
+    AIResponse.objects.update(is_correct=Exists(
+        PSAEntry.objects.filter(pk=OuterRef('psa_entry_id'), answer=OuterRef('ai_answer'))
+    ))
+
+    groups = PSAGroup.objects.filter(status__in=['accepted', 'completed']).annotate(
+        entry_count=Count('psaentry', distinct=True),
+        response_count=Count('psaentry__airesponse', distinct=True),
+        correct_count=Count('psaentry__airesponse', filter=Q(psaentry__airesponse__is_correct=True), distinct=True)
+    ).filter(entry_count__gt=0, response_count__gte=models.F('entry_count'))
+
+    now = timezone.now()
+    for group in groups.iterator():
+        group.score = 100-group.correct_count*100/group.entry_count
+        group.graded_at = now
+        group.save(update_fields=['score', 'graded_at'])
+        if group.competition_id is None:
+            continue
+        entry = LeaderboardEntry.objects.filter(competition_id=group.competition_id, user_id=group.user_id).first()
+        if entry is None:
+            LeaderboardEntry.objects.create(
+                competition_id=group.competition_id,
+                user_id=group.user_id,
+                best_group_id=group.id,
+                best_score=group.score,
+                best_submission_date=group.pub_date
+            )
+        elif group.score > entry.best_score:
+            entry.best_group_id = group.id
+            entry.best_score = group.score
+            entry.best_submission_date = group.pub_date
+            entry.save()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lastresort', '0002_leaderboardentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='airesponse',
+            name='is_correct',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='psagroup',
+            name='graded_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Date Graded'),
+        ),
+        migrations.RunPython(backfill_grading, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:14
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lastresort', '0003_grading'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SolutionCache',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, unique=True)),
+                ('model', models.CharField(max_length=100)),
+                ('ai_solution', models.CharField(max_length=40000)),
+                ('ai_answer', models.CharField(max_length=100)),
+                ('hit_count', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Date Created')),
+                ('last_used_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now, verbose_name='Date Last Used')),
+            ],
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:16
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lastresort', '0004_solutioncache'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AIBatchJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('batch_id', models.CharField(max_length=100, unique=True)),
+                ('input_file_id', models.CharField(max_length=100)),
+                ('output_file_id', models.CharField(blank=True, default='', max_length=100)),
+                ('error_file_id', models.CharField(blank=True, default='', max_length=100)),
+                ('status', models.CharField(default='validating', max_length=100)),
+                ('request_count', models.IntegerField(default=0)),
+                ('pub_date', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Date Published')),
+                ('completed_at', models.DateTimeField(blank=True, null=True, verbose_name='Date Completed')),
+                ('groups', models.ManyToManyField(related_name='batch_jobs', to='lastresort.psagroup')),
+            ],
+        ),
+    ]
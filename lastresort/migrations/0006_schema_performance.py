@@ -0,0 +1,76 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:32
+
+from django.conf import settings
+from django.db import migrations, models
+
+STATUSES = ['pending', 'accepted', 'rejected', 'completed']
+
+
+class AddIndexConcurrently(migrations.AddIndex):
+    """CREATE INDEX CONCURRENTLY on PostgreSQL, so writes carry on while it builds; a plain AddIndex elsewhere"""
+
+    def _operation(self, schema_editor):
+        if schema_editor.connection.vendor != 'postgresql':
+            return super()
+        from django.contrib.postgres.operations import AddIndexConcurrently
+        return AddIndexConcurrently(self.model_name, self.index)
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        self._operation(schema_editor).database_forwards(app_label, schema_editor, from_state, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        self._operation(schema_editor).database_backwards(app_label, schema_editor, from_state, to_state)
+
+
+def normalize_statuses(apps, schema_editor):
+    # Anything outside the known statuses goes back to review before the constraint is added
+    PSAGroup = apps.get_model('lastresort', 'PSAGroup')
+    PSAGroup.objects.exclude(status__in=STATUSES).update(status='pending')
+
+
+class Migration(migrations.Migration):
+
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('lastresort', '0005_aibatchjob'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(normalize_statuses, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='psagroup',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('accepted', 'Accepted'), ('rejected', 'Rejected'), ('completed', 'Completed')], default='pending', max_length=20),
+        ),
+        AddIndexConcurrently(
+            model_name='airesponse',
+            index=models.Index(fields=['psa_entry', 'is_correct'], name='airesponse_entry_correct_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='competition',
+            index=models.Index(fields=['is_active', '-pub_date'], name='competition_active_pub_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='competition',
+            index=models.Index(fields=['is_active', 'end_date'], name='competition_active_end_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='psagroup',
+            index=models.Index(fields=['competition', 'status'], name='psagroup_comp_status_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='psagroup',
+            index=models.Index(fields=['competition', 'user', '-pub_date'], name='psagroup_comp_user_pub_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='psagroup',
+            index=models.Index(condition=models.Q(('status', 'pending')), fields=['competition', '-pub_date'], name='psagroup_pending_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='psagroup',
+            constraint=models.CheckConstraint(condition=models.Q(('status__in', ['pending', 'accepted', 'rejected', 'completed'])), name='psagroup_valid_status'),
+        ),
+    ]
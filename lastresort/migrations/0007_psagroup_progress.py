@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:45
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_progress(apps, schema_editor):
+    # Existing groups start from their stored entries and responses
+    PSAGroup = apps.get_model('lastresort', 'PSAGroup')
+    PSAEntry = apps.get_model('lastresort', 'PSAEntry')
+    entries = PSAEntry.objects.filter(group=OuterRef('pk')).order_by().values('group')
+    PSAGroup.objects.update(
+        entry_count=Coalesce(Subquery(entries.annotate(n=Count('id')).values('n'), output_field=IntegerField()), 0),
+        answered_count=Coalesce(Subquery(entries.filter(airesponse__isnull=False).annotate(n=Count('id', distinct=True)).values('n'), output_field=IntegerField()), 0),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lastresort', '0006_schema_performance'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='psagroup',
+            name='answered_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='psagroup',
+            name='entry_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='psagroup',
+            name='failed_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(count_progress, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:04
+
+import zlib
+import django.db.models.deletion
+from django.db import migrations, models
+
+CHUNK_SIZE = 2000
+
+
+def move_solutions(apps, schema_editor):
+    # Existing solutions are compressed into the side table a chunk at a time
+    AIResponse = apps.get_model('lastresort', 'AIResponse')
+    AISolution = apps.get_model('lastresort', 'AISolution')
+    db_alias = schema_editor.connection.alias
+    solutions = []
+    for ai_response_id, ai_solution in AIResponse.objects.using(db_alias).order_by('id').values_list('id', 'ai_solution').iterator(chunk_size=CHUNK_SIZE):
+        solutions.append(AISolution(ai_response_id=ai_response_id, compressed_text=zlib.compress(ai_solution.encode('utf-8'))))
+        if len(solutions) >= CHUNK_SIZE:
+            AISolution.objects.using(db_alias).bulk_create(solutions)
+            solutions = []
+    AISolution.objects.using(db_alias).bulk_create(solutions)
+
+
+def restore_solutions(apps, schema_editor):
+    AIResponse = apps.get_model('lastresort', 'AIResponse')
+    AISolution = apps.get_model('lastresort', 'AISolution')
+    db_alias = schema_editor.connection.alias
+    ai_responses = []
+    for ai_response_id, compressed_text in AISolution.objects.using(db_alias).order_by('ai_response_id').values_list('ai_response_id', 'compressed_text').iterator(chunk_size=CHUNK_SIZE):
+        ai_responses.append(AIResponse(id=ai_response_id, ai_solution=zlib.decompress(compressed_text).decode('utf-8')))
+        if len(ai_responses) >= CHUNK_SIZE:
+            AIResponse.objects.using(db_alias).bulk_update(ai_responses, ['ai_solution'])
+            ai_responses = []
+    AIResponse.objects.using(db_alias).bulk_update(ai_responses, ['ai_solution'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lastresort', '0007_psagroup_progress'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AISolution',
+            fields=[
+                ('ai_response', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='solution', serialize=False, to='lastresort.airesponse')),
+                ('compressed_text', models.BinaryField()),
+            ],
+        ),
+        migrations.RunPython(move_solutions, restore_solutions),
+        # A default lets the column be added back, empty, when this migration is reversed
+        migrations.AlterField(
+            model_name='airesponse',
+            name='ai_solution',
+            field=models.CharField(default='', max_length=40000),
+        ),
+        migrations.RemoveField(
+            model_name='airesponse',
+            name='ai_solution',
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:09
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lastresort', '0008_aisolution'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    # The keyset indexes supersede psagroup_comp_user_pub_idx and psagroup_pending_idx from 0006:
+    # the trailing id lets a (pub_date, id) cursor seek straight to its page
+    operations = [
+        migrations.RemoveIndex(
+            model_name='psagroup',
+            name='psagroup_comp_user_pub_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='psagroup',
+            name='psagroup_pending_idx',
+        ),
+        migrations.AddIndex(
+            model_name='competition',
+            index=models.Index(fields=['-end_date', '-id'], name='competition_end_keyset_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='psagroup',
+            index=models.Index(fields=['competition', 'user', '-pub_date', '-id'], name='psagroup_comp_user_keyset_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='psagroup',
+            index=models.Index(condition=models.Q(('status', 'pending')), fields=['competition', '-pub_date', '-id'], name='psagroup_pending_keyset_idx'),
+        ),
+    ]
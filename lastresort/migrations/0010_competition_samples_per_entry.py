@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:15
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lastresort', '0009_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='competition',
+            name='samples_per_entry',
+            field=models.PositiveSmallIntegerField(default=1, validators=[django.core.validators.MinValueValidator(1)]),
+        ),
+    ]
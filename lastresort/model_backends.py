@@ -0,0 +1,174 @@
+import asyncio
+import hashlib
+import json
+import os
+import random
+import time
+from contextlib import contextmanager
+from django.conf import settings
+from . import metrics
+
+_backends = {}
+_openai_client = None
+
+class BackendUnavailable(Exception):
+    """A transient backend failure that is worth retrying"""
+
+
+def openai_client():
+    """Process-wide OpenAI client, created on first use; its connection pool keeps connections alive between calls"""
+    global _openai_client
+    if _openai_client is None:
+        # Imported here: openai is the slowest import in the project and most processes never call the model
+        from openai import OpenAI
+        _openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    return _openai_client
+
+def _forget_openai_client():
+    # A forked child must not share the parent's sockets
+    global _openai_client
+    _openai_client = None
+
+os.register_at_fork(after_in_child=_forget_openai_client)
+
+@contextmanager
+def _transient_openai_errors():
+    """Report the OpenAI errors worth retrying as BackendUnavailable"""
+    import openai
+    try:
+        yield
+    except (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError) as e:
+        raise BackendUnavailable(str(e)) from e
+
+
+class ModelBackend:
+    """Turns a prompt into the model's raw output text"""
+
+    name = None
+
+    def complete(self, prompt):
+        raise NotImplementedError
+
+    def stream(self, prompt):
+        """Yield the output text in pieces as it is generated"""
+        yield self.complete(prompt)
+
+    async def acomplete(self, prompt):
+        return await asyncio.to_thread(self.complete, prompt)
+
+    async def aclose(self):
+        """Release anything bound to the running event loop"""
+
+
+class OpenAIBackend(ModelBackend):
+    name = 'openai'
+
+    def __init__(self, model):
+        self.model = model
+        self._async_client = None
+
+    def complete(self, prompt):
+        with metrics.model_call(self.name) as usage, _transient_openai_errors():
+            response = openai_client().responses.create(model=self.model, input=prompt)
+            usage.update(metrics.response_usage(response.usage))
+        return response.output_text
+
+    def stream(self, prompt):
+        with metrics.model_call(self.name) as usage, _transient_openai_errors():
+            with openai_client().responses.create(model=self.model, input=prompt, stream=True) as events:
+                for event in events:
+                    if event.type == 'response.output_text.delta':
+                        yield event.delta
+                    elif event.type == 'response.completed':
+                        usage.update(metrics.response_usage(event.response.usage))
+                    elif event.type in ('response.failed', 'error'):
+                        raise BackendUnavailable(f'Streamed response failed: {event}')
+
+    async def acomplete(self, prompt):
+        # AsyncOpenAI is bound to the event loop it first runs on, so each loop gets its own
+        if self._async_client is None:
+            from openai import AsyncOpenAI
+            self._async_client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        with metrics.model_call(self.name) as usage, _transient_openai_errors():
+            response = await self._async_client.responses.create(model=self.model, input=prompt)
+            usage.update(metrics.response_usage(response.usage))
+        return response.output_text
+
+    async def aclose(self):
+        if self._async_client is not None:
+            await self._async_client.close()
+            self._async_client = None
+
+
+class StubBackend(ModelBackend):
+    """Deterministic local stand-in: the same prompt always gets the same answer"""
+
+    name = 'stub'
+
+    def _output(self, prompt):
+        if random.random() < settings.AI_STUB_ERROR_RATE:
+            raise BackendUnavailable('Stub backend injected failure')
+        answer = int(hashlib.sha256(prompt.encode('utf-8')).hexdigest()[:8], 16) % settings.AI_STUB_ANSWER_RANGE
+        return f"Stub solution for: {prompt}\n{answer}"
+
+    def complete(self, prompt):
+        with metrics.model_call(self.name):
+            time.sleep(settings.AI_STUB_LATENCY)
+            return self._output(prompt)
+
+    def stream(self, prompt):
+        # Same total latency as complete(), spread over the words of the output
+        with metrics.model_call(self.name):
+            words = self._output(prompt).split(' ')
+            for i, word in enumerate(words):
+                time.sleep(settings.AI_STUB_LATENCY / len(words))
+                yield word if i == 0 else ' ' + word
+
+    async def acomplete(self, prompt):
+        with metrics.model_call(self.name):
+            await asyncio.sleep(settings.AI_STUB_LATENCY)
+            return self._output(prompt)
+
+
+class ReplayBackend(ModelBackend):
+    """Answers from a JSON lines file of {"prompt": ..., "output": ...} records"""
+
+    name = 'replay'
+
+    def __init__(self, path):
+        self.path = path
+        self.outputs = {}
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    self.outputs[record['prompt'].strip()] = record['output']
+
+    def complete(self, prompt):
+        try:
+            return self.outputs[prompt.strip()]
+        except KeyError:
+            raise LookupError(f'No recorded response in {self.path} for prompt: {prompt[:80]}') from None
+
+    async def acomplete(self, prompt):
+        return self.complete(prompt)
+
+
+def load_backend(name=None):
+    """Build a new backend; callers using acomplete should aclose it when their loop ends"""
+    from .models import AI_MODEL
+    name = name or settings.AI_BACKEND
+    if name == 'openai':
+        return OpenAIBackend(AI_MODEL)
+    if name == 'stub':
+        return StubBackend()
+    if name == 'replay':
+        return ReplayBackend(settings.AI_REPLAY_PATH)
+    raise ValueError(f'Unknown AI_BACKEND {name!r}; expected openai, stub or replay')
+
+def get_backend():
+    """Process-wide backend for synchronous calls, chosen by AI_BACKEND"""
+    name = settings.AI_BACKEND
+    if name not in _backends:
+        _backends[name] = load_backend(name)
+    return _backends[name]
@@ -1,13 +1,37 @@
-import os
-from django.db import models
+import zlib
+from django.core.validators import MinValueValidator
+from django.db import IntegrityError, models, transaction
+from django.db.models.functions import Coalesce
 from django.utils import timezone
-from openai import OpenAI
-from dotenv import load_dotenv
 from django.contrib.auth.models import User
+from .model_backends import get_backend
 
-load_dotenv()
+AI_MODEL = "gpt-4o"
+SOLUTION_PROMPT = "Solve the following problem. Output ONLY your final answer on the last line after your solution. It must only be the answer, no other text. The answer must have zero formatting. {problem}"
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+def split_ai_response(response_text):
+    """Split raw model output into (solution, answer); the answer is the last line"""
+    return (response_text, response_text.split('\n')[-1])
+
+def correct_samples_needed(samples):
+    """Right answers out of an entry's samples that count it as solved by the model: a strict majority"""
+    return samples // 2 + 1
+
+class CompetitionQuerySet(models.QuerySet):
+    def active(self):
+        """Competitions still open for entries, judged by end_date at query time"""
+        return self.filter(is_active=True, end_date__gt=timezone.now())
+
+    def ended(self):
+        """Competitions that were closed or whose end_date has passed"""
+        return self.filter(models.Q(is_active=False) | models.Q(end_date__lte=timezone.now()))
+
+    def with_open_flag(self):
+        """Annotate each competition with is_open so callers can order on it"""
+        return self.annotate(is_open_now=models.ExpressionWrapper(
+            models.Q(is_active=True, end_date__gt=timezone.now()),
+            output_field=models.BooleanField()
+        ))
 
 class Competition(models.Model):
     user = models.ManyToManyField(User, related_name='competitions')
@@ -15,30 +39,127 @@ class Competition(models.Model):
     short_description = models.CharField(max_length=1000)
     description = models.TextField()
     num_questions = models.IntegerField(default=1)
+    # Model samples per question; the question counts as solved when most of them are right
+    samples_per_entry = models.PositiveSmallIntegerField(default=1, validators=[MinValueValidator(1)])
     pub_date = models.DateTimeField('Date Published', default=timezone.now)
     end_date = models.DateTimeField('Date Ended', default=timezone.now)
     is_active = models.BooleanField(default=True)
 
+    objects = CompetitionQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['is_active', '-pub_date'], name='competition_active_pub_idx'),
+            models.Index(fields=['is_active', 'end_date'], name='competition_active_end_idx'),
+            # Keyset pagination of past competitions seeks on (end_date, id)
+            models.Index(fields=['-end_date', '-id'], name='competition_end_keyset_idx'),
+        ]
+
     def is_past_end_date(self):
         return timezone.now() > self.end_date
 
+    def is_open(self):
+        return self.is_active and not self.is_past_end_date()
+
     def save(self, *args, **kwargs):
         if self.is_past_end_date():
             self.is_active = False
         super().save(*args, **kwargs)
 
+STATUS_CHOICES = [
+    ('pending', 'Pending'),
+    ('accepted', 'Accepted'),
+    ('rejected', 'Rejected'),
+    ('completed', 'Completed'),
+]
+
 class PSAGroup(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     competition = models.ForeignKey(Competition, on_delete=models.CASCADE, null=True, blank=True)
     name = models.CharField(max_length=100)
     score = models.IntegerField(default=0)
     pub_date = models.DateTimeField('Date Published', default=timezone.now)
-    status = models.CharField(max_length=100, default='pending')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     reason = models.TextField(default='')
+    graded_at = models.DateTimeField('Date Graded', null=True, blank=True)
+    # Generation progress, kept by atomic increments as each entry's task finishes
+    entry_count = models.PositiveIntegerField(default=0)
+    answered_count = models.PositiveIntegerField(default=0)
+    failed_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.CheckConstraint(condition=models.Q(status__in=[status for status, _ in STATUS_CHOICES]), name='psagroup_valid_status'),
+        ]
+        indexes = [
+            models.Index(fields=['competition', 'status'], name='psagroup_comp_status_idx'),
+            # id breaks pub_date ties so the keyset pagination cursor is a single index seek
+            models.Index(fields=['competition', 'user', '-pub_date', '-id'], name='psagroup_comp_user_keyset_idx'),
+            # Admin review only ever lists pending groups, newest first
+            models.Index(fields=['competition', '-pub_date', '-id'], condition=models.Q(status='pending'), name='psagroup_pending_keyset_idx'),
+        ]
 
     def __str__(self):
         return self.name
 
+    @classmethod
+    @transaction.atomic
+    def submit(cls, user, competition, entries):
+        """Create a pending group and all of its entries in one transaction"""
+        psa_group = cls.objects.create(name=user.username, competition=competition, user=user, status='pending', entry_count=len(entries))
+        PSAEntry.objects.bulk_create([
+            PSAEntry(group=psa_group, problem=problem, solution=solution, answer=answer)
+            for problem, solution, answer in entries
+        ], batch_size=500)
+        return psa_group
+
+    @classmethod
+    def record_progress(cls, psa_group_id, answered=0, failed=0):
+        """Count finished entries in one UPDATE, so concurrent tasks never lose an increment"""
+        cls.objects.filter(id=psa_group_id).update(
+            answered_count=models.F('answered_count') + answered,
+            failed_count=models.F('failed_count') + failed
+        )
+
+    @classmethod
+    def recount_progress(cls, psa_group_ids):
+        """Recount answered entries from the stored AI responses, after some of them were deleted"""
+        answered = PSAEntry.objects.filter(group=models.OuterRef('pk'), airesponse__isnull=False).values('group').annotate(
+            entries=models.Count('id', distinct=True)
+        ).values('entries')
+        cls.objects.filter(id__in=psa_group_ids).update(answered_count=Coalesce(models.Subquery(answered), 0))
+
+    @classmethod
+    def recount_failed(cls, psa_group_ids):
+        """Count every entry still without an AI response as failed, once nothing is left to answer it"""
+        unanswered = PSAEntry.objects.filter(group=models.OuterRef('pk'), airesponse__isnull=True).values('group').annotate(
+            entries=models.Count('id')
+        ).values('entries')
+        cls.objects.filter(id__in=psa_group_ids).update(failed_count=Coalesce(models.Subquery(unanswered), 0))
+
+    @classmethod
+    def sampling(cls, psa_group_id):
+        """(samples per entry, right samples needed to solve it) for a group's competition"""
+        samples = cls.objects.filter(id=psa_group_id).values_list('competition__samples_per_entry', flat=True).first() or 1
+        return samples, correct_samples_needed(samples)
+
+    def generation_finished(self):
+        return self.answered_count + self.failed_count >= self.entry_count
+
+    def grade(self):
+        """Score the group from its stored AI responses and update the leaderboard"""
+        entry_count, samples = PSAGroup.objects.filter(id=self.id).annotate(entries=models.Count('psaentry')).values_list(
+            'entries', 'competition__samples_per_entry'
+        ).get()
+        # An entry is solved when enough of its samples are right; with one sample, when that one is
+        needed = correct_samples_needed(samples or 1)
+        correct = AIResponse.objects.filter(psa_entry__group=self, is_correct=True).values('psa_entry').annotate(
+            right=models.Count('id')
+        ).filter(right__gte=needed).count()
+        self.score = 100-correct*100/entry_count if entry_count else 0
+        self.save(update_fields=['score'])
+        LeaderboardEntry.record_score(self)
+
 class PSAEntry(models.Model):
     group = models.ForeignKey(PSAGroup, on_delete=models.CASCADE)
     problem = models.CharField(max_length=1000)
@@ -49,19 +170,180 @@ class PSAEntry(models.Model):
     def __str__(self):
         return f'{self.problem} - {self.solution} - {self.answer}'
     
-    def get_ai_solution_and_answer(self):
-        response = client.responses.create(
-            model="gpt-4o",
-            input=f"Solve the following problem. Output ONLY your final answer on the last line after your solution. It must only be the answer, no other text. The answer must have zero formatting. {self.problem}"
-        )
-        response_text = response.output_text
-        return (response_text, response_text.split('\n')[-1])
+    def get_ai_solution_and_answer(self, on_text=None):
+        """Ask the model; with on_text, stream the output and pass each piece to it as it arrives"""
+        prompt = SOLUTION_PROMPT.format(problem=self.problem)
+        if on_text is None:
+            return split_ai_response(get_backend().complete(prompt))
+        pieces = []
+        for piece in get_backend().stream(prompt):
+            pieces.append(piece)
+            on_text(piece)
+        return split_ai_response(''.join(pieces))
+
+    async def aget_ai_solution_and_answer(self, backend):
+        return split_ai_response(await backend.acomplete(SOLUTION_PROMPT.format(problem=self.problem)))
+
+class AIResponseQuerySet(models.QuerySet):
+    def bulk_create(self, objs, *args, **kwargs):
+        """Insert the responses, then their solutions into the side table"""
+        with transaction.atomic(using=self.db):
+            created = super().bulk_create(objs, *args, **kwargs)
+            AISolution.store(created, using=self.db)
+        return created
 
 class AIResponse(models.Model):
     psa_entry = models.ForeignKey(PSAEntry, on_delete=models.CASCADE)
-    ai_solution = models.CharField(max_length=40000)
     ai_answer = models.CharField(max_length=100)
+    is_correct = models.BooleanField(default=False)
+    pub_date = models.DateTimeField('Date Published', default=timezone.now)
+
+    objects = AIResponseQuerySet.as_manager()
+
+    # The full model output lives in AISolution so lists and grading never read it;
+    # a solution passed to the constructor is written when the response is saved
+    _ai_solution = None
+    _ai_solution_changed = False
+
+    class Meta:
+        indexes = [
+            # Grading counts correct responses per entry without touching the solution text
+            models.Index(fields=['psa_entry', 'is_correct'], name='airesponse_entry_correct_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.psa_entry_id} - {self.ai_answer}'
+
+    @property
+    def ai_solution(self):
+        """Full model output, read from the side table on first use (select_related('solution') preloads it)"""
+        if self._ai_solution is None:
+            try:
+                self._ai_solution = self.solution.text
+            except AISolution.DoesNotExist:
+                self._ai_solution = ''
+        return self._ai_solution
+
+    @ai_solution.setter
+    def ai_solution(self, value):
+        self._ai_solution = value
+        self._ai_solution_changed = True
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+            if self._ai_solution_changed:
+                AISolution.store([self], using=self._state.db)
+
+class AISolution(models.Model):
+    """An AI response's full output, zlib-compressed in its own table and only loaded when shown"""
+    ai_response = models.OneToOneField(AIResponse, on_delete=models.CASCADE, primary_key=True, related_name='solution')
+    compressed_text = models.BinaryField()
+
+    def __str__(self):
+        return f'Solution of AI response {self.ai_response_id}'
+
+    @staticmethod
+    def compress(text):
+        return zlib.compress(text.encode('utf-8'))
+
+    @staticmethod
+    def decompress(data):
+        return zlib.decompress(data).decode('utf-8') if data is not None else ''
+
+    @property
+    def text(self):
+        return self.decompress(self.compressed_text)
+
+    @classmethod
+    def store(cls, ai_responses, using=None):
+        """Write the pending solutions of saved responses in one query, replacing any stored before"""
+        solutions = [
+            cls(ai_response=ai_response, compressed_text=cls.compress(ai_response._ai_solution))
+            for ai_response in ai_responses if ai_response._ai_solution_changed
+        ]
+        if solutions:
+            cls.objects.using(using).bulk_create(
+                solutions, update_conflicts=True, unique_fields=['ai_response'], update_fields=['compressed_text']
+            )
+        for ai_response in ai_responses:
+            ai_response._ai_solution_changed = False
+
+class AIBatchJob(models.Model):
+    batch_id = models.CharField(max_length=100, unique=True)
+    input_file_id = models.CharField(max_length=100)
+    output_file_id = models.CharField(max_length=100, blank=True, default='')
+    error_file_id = models.CharField(max_length=100, blank=True, default='')
+    status = models.CharField(max_length=100, default='validating')
+    groups = models.ManyToManyField(PSAGroup, related_name='batch_jobs')
+    request_count = models.IntegerField(default=0)
     pub_date = models.DateTimeField('Date Published', default=timezone.now)
+    completed_at = models.DateTimeField('Date Completed', null=True, blank=True)
+
+    FINISHED_STATUSES = ['completed', 'failed', 'expired', 'cancelled']
 
     def __str__(self):
-        return f'{self.ai_solution} - {self.ai_answer}'
\ No newline at end of file
+        return f'{self.batch_id} - {self.status}'
+
+class SolutionCache(models.Model):
+    key = models.CharField(max_length=64, unique=True)
+    model = models.CharField(max_length=100)
+    ai_solution = models.CharField(max_length=40000)
+    ai_answer = models.CharField(max_length=100)
+    hit_count = models.IntegerField(default=0)
+    created_at = models.DateTimeField('Date Created', default=timezone.now)
+    last_used_at = models.DateTimeField('Date Last Used', default=timezone.now, db_index=True)
+
+    def __str__(self):
+        return f'{self.key[:12]} - {self.ai_answer}'
+
+class LeaderboardEntry(models.Model):
+    competition = models.ForeignKey(Competition, on_delete=models.CASCADE, related_name='leaderboard_entries')
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    best_group = models.ForeignKey(PSAGroup, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    best_score = models.IntegerField(default=0)
+    best_submission_date = models.DateTimeField('Best Submission Date', default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['competition', 'user'], name='leaderboard_unique_competition_user'),
+        ]
+        indexes = [
+            models.Index(fields=['competition', '-best_score', 'best_submission_date'], name='leaderboard_rank_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.competition_id} - {self.user_id} - {self.best_score}'
+
+    @classmethod
+    def record_score(cls, psa_group):
+        """Bring the user's leaderboard row for the group's competition up to date after it was graded"""
+        if psa_group.competition_id is None:
+            return None
+        return cls.recompute(psa_group.competition_id, psa_group.user_id)
+
+    @classmethod
+    def recompute(cls, competition_id, user_id):
+        """Set a user's row to their best graded group, which a re-grade can lower, or remove it when none is graded"""
+        with transaction.atomic():
+            # The locked row serializes concurrent gradings for the same user, so the later one sees the earlier score
+            entry = cls.objects.select_for_update().filter(competition_id=competition_id, user_id=user_id).first()
+            best = PSAGroup.objects.filter(
+                competition_id=competition_id, user_id=user_id, status__in=['accepted', 'completed'], graded_at__isnull=False
+            ).order_by('-score', 'pub_date', 'id').only('score', 'pub_date').first()
+            if best is None:
+                if entry:
+                    entry.delete()
+                return None
+            best_fields = {'best_group': best, 'best_score': best.score, 'best_submission_date': best.pub_date}
+            if entry is None:
+                try:
+                    with transaction.atomic():
+                        return cls.objects.create(competition_id=competition_id, user_id=user_id, **best_fields)
+                except IntegrityError:
+                    # Another grading created the row first; wait for it and overwrite it
+                    entry = cls.objects.select_for_update().get(competition_id=competition_id, user_id=user_id)
+            for name, value in best_fields.items():
+                setattr(entry, name, value)
+            entry.save(update_fields=list(best_fields))
+        return entry
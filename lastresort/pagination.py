@@ -0,0 +1,39 @@
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.db.models import Q
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def encode_cursor(value, pk):
+    """Position just after the row (value, pk) in a newest-first list, as '<epoch microseconds>-<id>'"""
+    return f'{(value - EPOCH) // timedelta(microseconds=1)}-{pk}'
+
+def decode_cursor(cursor):
+    """(datetime, id) of a cursor, or None when it is missing or malformed"""
+    try:
+        micros, pk = cursor.rsplit('-', 1)
+        return EPOCH + timedelta(microseconds=int(micros)), int(pk)
+    except (AttributeError, ValueError, OverflowError):
+        return None
+
+def keyset_queryset(queryset, field, cursor):
+    """The rows after the cursor, newest first by (field, id)"""
+    queryset = queryset.order_by(f'-{field}', '-id')
+    position = decode_cursor(cursor)
+    if position:
+        value, pk = position
+        # The plain <= bound is what lets the database start the index scan at the cursor
+        queryset = queryset.filter(Q(**{f'{field}__lte': value}), Q(**{f'{field}__lt': value}) | Q(id__lt=pk))
+    return queryset
+
+def keyset_page(queryset, field, cursor, size):
+    """Up to size rows newest first by (field, id), starting after the cursor; returns (rows, next_cursor).
+
+    Rows are found by seeking in an index on (field, id) rather than skipping an offset, so every page
+    costs the same however deep it is, and rows added at the top do not shift later pages.
+    """
+    rows = list(keyset_queryset(queryset, field, cursor)[:size + 1])
+    if len(rows) <= size:
+        return rows, None
+    last = rows[size - 1]
+    return rows[:size], encode_cursor(getattr(last, field), last.pk)
@@ -0,0 +1,219 @@
+import contextvars
+import time
+from contextlib import ExitStack, contextmanager
+from datetime import timedelta
+from functools import wraps
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from celery.signals import task_prerun, task_postrun
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+import redis
+from .events import get_connection
+
+KEY_PREFIX = 'lastresort:performance:'
+METRICS = ['count', 'queries', 'db_ms', 'render_ms', 'total_ms', 'violations']
+
+_current = contextvars.ContextVar('lastresort_performance_sample', default=None)
+_task_trackers = {}
+
+
+class BudgetExceeded(Exception):
+    """A view or task used more queries or time than its declared budget"""
+
+
+def budget(queries=None, ms=None):
+    """Declare the most queries and milliseconds a view or task should need"""
+    def decorator(func):
+        func.performance_budget = {'queries': queries, 'ms': ms}
+        return func
+    return decorator
+
+
+class Sample:
+    """Query count, database time and template render time of one request or task"""
+
+    def __init__(self, kind, name=None, budget=None):
+        self.kind = kind
+        self.name = name
+        self.budget = budget
+        self.queries = 0
+        self.db_time = 0
+        self.render_time = 0
+        self.started = time.perf_counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        if _current.get() is not self:
+            # A task run eagerly inside this one counts its own queries
+            return execute(sql, params, many, context)
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.db_time += time.perf_counter() - started
+
+    def violations(self, total_ms):
+        if not self.budget:
+            return []
+        exceeded = []
+        if self.budget['queries'] is not None and self.queries > self.budget['queries']:
+            exceeded.append(f"{self.queries} queries (budget {self.budget['queries']})")
+        if self.budget['ms'] is not None and total_ms > self.budget['ms']:
+            exceeded.append(f"{total_ms:.0f}ms (budget {self.budget['ms']}ms)")
+        return exceeded
+
+
+def _bucket_key(moment):
+    return KEY_PREFIX + moment.strftime('%Y%m%d%H')
+
+def _record(sample, total_ms, violated):
+    if not settings.EVENTS_REDIS_URL:
+        return
+    values = {
+        'count': 1,
+        'queries': sample.queries,
+        'db_ms': sample.db_time * 1000,
+        'render_ms': sample.render_time * 1000,
+        'total_ms': total_ms,
+        'violations': int(violated),
+    }
+    key = _bucket_key(timezone.now())
+    try:
+        pipe = get_connection().pipeline(transaction=False)
+        for metric, value in values.items():
+            pipe.hincrbyfloat(key, f'{sample.kind}|{sample.name}|{metric}', value)
+        pipe.expire(key, settings.PERFORMANCE_RETENTION_HOURS * 3600)
+        pipe.execute()
+    except redis.RedisError as e:
+        print(f"Error recording performance of {sample.kind} {sample.name}: {e}")
+
+@contextmanager
+def track(kind, name=None, budget=None):
+    """Measure the enclosed block; the name and budget may be filled in on the yielded sample"""
+    sample = Sample(kind, name, budget)
+    token = _current.set(sample)
+    try:
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(sample))
+            yield sample
+    finally:
+        _current.reset(token)
+
+    if sample.name is None:
+        return
+    total_ms = (time.perf_counter() - sample.started) * 1000
+    exceeded = sample.violations(total_ms)
+    _record(sample, total_ms, bool(exceeded))
+    if exceeded:
+        message = f"Performance budget exceeded by {sample.kind} {sample.name}: {', '.join(exceeded)}"
+        print(message)
+        if settings.PERFORMANCE_BUDGET_RAISE:
+            raise BudgetExceeded(message)
+
+
+class PerformanceMiddleware:
+    """Record query count, database, render and total time per URL name"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not settings.PERFORMANCE_TRACKING_ENABLED:
+            return self.get_response(request)
+        with track('view') as sample:
+            response = self.get_response(request)
+            if request.resolver_match:
+                sample.name = request.resolver_match.view_name
+        return response
+
+    async def __acall__(self, request):
+        # Async views are long-lived streams whose queries run on other threads
+        return await self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        sample = _current.get()
+        if sample is not None:
+            sample.budget = getattr(view_func, 'performance_budget', None)
+
+
+def _task_started(task_id=None, task=None, **kwargs):
+    if not settings.PERFORMANCE_TRACKING_ENABLED:
+        return
+    tracker = track('task', task.name, getattr(task.run, 'performance_budget', None))
+    tracker.__enter__()
+    _task_trackers[task_id] = tracker
+
+def _task_finished(task_id=None, **kwargs):
+    tracker = _task_trackers.pop(task_id, None)
+    if tracker is not None:
+        # Celery logs rather than propagates errors from signal handlers
+        tracker.__exit__(None, None, None)
+
+def install():
+    """Time template rendering and hook into Celery task signals"""
+    from django.template.backends.django import Template
+    if getattr(Template.render, 'performance_timed', False):
+        return
+    render = Template.render
+
+    @wraps(render)
+    def timed_render(self, context=None, request=None):
+        sample = _current.get()
+        if sample is None:
+            return render(self, context, request)
+        started = time.perf_counter()
+        try:
+            return render(self, context, request)
+        finally:
+            sample.render_time += time.perf_counter() - started
+
+    timed_render.performance_timed = True
+    Template.render = timed_render
+    task_prerun.connect(_task_started, weak=False)
+    task_postrun.connect(_task_finished, weak=False)
+
+def report(hours=1):
+    """Averages per view and task over the last `hours`, with the window before it for comparison"""
+    if not settings.EVENTS_REDIS_URL:
+        return []
+    now = timezone.now()
+    pipe = get_connection().pipeline(transaction=False)
+    for hour in range(hours * 2):
+        pipe.hgetall(_bucket_key(now - timedelta(hours=hour)))
+    buckets = pipe.execute()
+
+    windows = ({}, {})
+    for hour, bucket in enumerate(buckets):
+        totals = windows[hour // hours]
+        for field, value in bucket.items():
+            kind, name, metric = field.decode('utf-8').split('|')
+            row = totals.setdefault((kind, name), dict.fromkeys(METRICS, 0))
+            row[metric] += float(value)
+
+    rows = []
+    current, previous = windows
+    for (kind, name), totals in current.items():
+        count = totals['count'] or 1
+        before = previous.get((kind, name))
+        rows.append({
+            'kind': kind,
+            'name': name,
+            'count': int(totals['count']),
+            'queries': totals['queries'] / count,
+            'db_ms': totals['db_ms'] / count,
+            'render_ms': totals['render_ms'] / count,
+            'total_ms': totals['total_ms'] / count,
+            'violations': int(totals['violations']),
+            'previous_queries': before['queries'] / before['count'] if before and before['count'] else None,
+            'previous_total_ms': before['total_ms'] / before['count'] if before and before['count'] else None,
+        })
+    return sorted(rows, key=lambda row: row['total_ms'] * row['count'], reverse=True)
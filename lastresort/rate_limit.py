@@ -0,0 +1,141 @@
+import asyncio
+import random
+import time
+from django.conf import settings
+import redis
+from .events import get_connection
+
+REQUESTS_KEY = 'lastresort:rate_limit:requests'
+TOKENS_KEY = 'lastresort:rate_limit:tokens'
+WAIT_SECONDS_KEY = 'lastresort:rate_limit:wait_seconds'
+WAITS_KEY = 'lastresort:rate_limit:waits'
+RETRIES_KEY = 'lastresort:rate_limit:retries'
+
+# Token buckets shared by every worker. Each bucket takes (capacity, refill per second,
+# cost) in ARGV; either all buckets are charged or none are and the wait is returned.
+ACQUIRE_SCRIPT = """
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local wait = 0
+local levels = {}
+for i, key in ipairs(KEYS) do
+    local capacity = tonumber(ARGV[i * 3 - 2])
+    local rate = tonumber(ARGV[i * 3 - 1])
+    local cost = math.min(tonumber(ARGV[i * 3]), capacity)
+    local state = redis.call('HMGET', key, 'tokens', 'ts')
+    local tokens = tonumber(state[1]) or capacity
+    local ts = tonumber(state[2]) or now
+    tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+    levels[i] = tokens - cost
+    if tokens < cost then
+        wait = math.max(wait, (cost - tokens) / rate)
+    end
+end
+if wait > 0 then
+    return tostring(wait)
+end
+for i, key in ipairs(KEYS) do
+    redis.call('HSET', key, 'tokens', tostring(levels[i]), 'ts', tostring(now))
+    redis.call('EXPIRE', key, 3600)
+end
+return '0'
+"""
+
+
+class RateLimited(Exception):
+    """The shared quota will not have room for this call within the allowed wait"""
+
+    def __init__(self, wait):
+        super().__init__(f'Rate limited, next slot in {wait:.1f}s')
+        self.wait = wait
+
+
+def enabled():
+    return bool(settings.EVENTS_REDIS_URL) and (settings.AI_RATE_LIMIT_RPM > 0 or settings.AI_RATE_LIMIT_TPM > 0)
+
+def estimate_tokens(prompt):
+    """Rough token cost of one call: ~4 characters per prompt token plus the expected output"""
+    return len(prompt) // 4 + settings.AI_EXPECTED_OUTPUT_TOKENS
+
+def try_acquire(tokens):
+    """Charge one request and `tokens` tokens; returns 0 on success or the seconds to wait"""
+    if not enabled():
+        return 0
+    keys = []
+    args = []
+    if settings.AI_RATE_LIMIT_RPM > 0:
+        keys.append(REQUESTS_KEY)
+        args += [settings.AI_RATE_LIMIT_RPM, settings.AI_RATE_LIMIT_RPM / 60, 1]
+    if settings.AI_RATE_LIMIT_TPM > 0:
+        keys.append(TOKENS_KEY)
+        args += [settings.AI_RATE_LIMIT_TPM, settings.AI_RATE_LIMIT_TPM / 60, tokens]
+    try:
+        return float(get_connection().register_script(ACQUIRE_SCRIPT)(keys=keys, args=args))
+    except redis.RedisError as e:
+        # Never block model calls because the limiter itself is unavailable
+        print(f"Error checking rate limit: {e}")
+        return 0
+
+def _record_wait(waited):
+    try:
+        pipe = get_connection().pipeline()
+        pipe.incrbyfloat(WAIT_SECONDS_KEY, waited)
+        pipe.incr(WAITS_KEY)
+        pipe.execute()
+    except redis.RedisError as e:
+        print(f"Error recording rate limit wait: {e}")
+
+def record_retry():
+    if not settings.EVENTS_REDIS_URL:
+        return
+    try:
+        get_connection().incr(RETRIES_KEY)
+    except redis.RedisError as e:
+        print(f"Error recording rate limit retry: {e}")
+
+def acquire(tokens, max_wait=None):
+    """Block until the shared quota has room, or raise RateLimited past max_wait seconds"""
+    max_wait = settings.AI_RATE_LIMIT_MAX_WAIT if max_wait is None else max_wait
+    started = time.monotonic()
+    waited = 0
+    while True:
+        wait = try_acquire(tokens)
+        if wait == 0 or waited + wait > max_wait:
+            if waited:
+                _record_wait(waited)
+            if wait:
+                raise RateLimited(wait)
+            return waited
+        time.sleep(wait)
+        waited = time.monotonic() - started
+
+async def aacquire(tokens):
+    """asyncio version of acquire that waits for as long as it takes"""
+    if not enabled():
+        return 0
+    started = time.monotonic()
+    waited = 0
+    while True:
+        # The Redis client blocks, so it runs in a thread rather than stalling the other calls on the loop
+        wait = await asyncio.to_thread(try_acquire, tokens)
+        if wait == 0:
+            if waited:
+                await asyncio.to_thread(_record_wait, waited)
+            return waited
+        await asyncio.sleep(wait)
+        waited = time.monotonic() - started
+
+def backoff_delay(retries):
+    """Full-jitter exponential backoff for the given retry attempt"""
+    ceiling = min(settings.AI_RETRY_BACKOFF_MAX, settings.AI_RETRY_BACKOFF_BASE * 2 ** retries)
+    return random.uniform(0, ceiling)
+
+def stats():
+    if not settings.EVENTS_REDIS_URL:
+        return {'waits': 0, 'wait_seconds': 0, 'retries': 0}
+    waits, wait_seconds, retries = get_connection().mget(WAITS_KEY, WAIT_SECONDS_KEY, RETRIES_KEY)
+    return {
+        'waits': int(waits or 0),
+        'wait_seconds': float(wait_seconds or 0),
+        'retries': int(retries or 0),
+    }
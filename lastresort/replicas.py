@@ -0,0 +1,147 @@
+import random
+import threading
+import time
+from contextvars import ContextVar
+from functools import wraps
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DatabaseError, OperationalError, connections
+
+# Only views marked with replica_reads set this, so Celery tasks and every write path read from the
+# primary unless they opt in. Sessions that just wrote are kept on the primary for a while.
+_replica = ContextVar('lastresort_replica', default=None)
+_health = {}
+_lock = threading.Lock()
+_done = object()
+
+SESSION_KEY = '_primary_reads_until'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+# Seconds of WAL a streaming replica has still to replay; 0 when it is caught up or is not a standby
+LAG_SQL = {
+    'postgresql': (
+        'SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 '
+        'ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END'
+    ),
+}
+
+
+def current_replica():
+    """Alias of the replica the current request reads from, or None for the primary"""
+    return _replica.get()
+
+def replica_lag(alias):
+    """Seconds the replica is behind the primary; None when it cannot tell"""
+    connection = connections[alias]
+    with connection.cursor() as cursor:
+        cursor.execute(LAG_SQL.get(connection.vendor, 'SELECT 0'))
+        lag = cursor.fetchone()[0]
+    return None if lag is None else float(lag)
+
+def _mark(alias, usable):
+    with _lock:
+        _health[alias] = (time.monotonic(), usable)
+
+def is_usable(alias):
+    """Whether a replica answers and is within DATABASE_REPLICA_MAX_LAG, rechecked every DATABASE_REPLICA_CHECK_INTERVAL"""
+    with _lock:
+        checked_at, usable = _health.get(alias, (None, False))
+    if checked_at is not None and time.monotonic() - checked_at < settings.DATABASE_REPLICA_CHECK_INTERVAL:
+        return usable
+    try:
+        lag = replica_lag(alias)
+        usable = lag is not None and lag <= settings.DATABASE_REPLICA_MAX_LAG
+        if not usable:
+            print(f"Replica {alias} is {lag}s behind, reading from the primary")
+    except DatabaseError as e:
+        print(f"Error checking replica {alias}: {e}")
+        usable = False
+    _mark(alias, usable)
+    return usable
+
+def choose_replica(request):
+    """A usable replica for this request, or None when it must read from the primary"""
+    if not settings.DATABASE_REPLICAS or request.method not in SAFE_METHODS:
+        return None
+    # Read-your-writes: a session that just submitted or reviewed sees the primary
+    if request.session.get(SESSION_KEY, 0) > time.time():
+        return None
+    replicas = [alias for alias in settings.DATABASE_REPLICAS if is_usable(alias)]
+    return random.choice(replicas) if replicas else None
+
+def _stream_from(alias, chunks):
+    # A streamed body is produced after the view returns, so each chunk is read with the replica set again
+    chunks = iter(chunks)
+    while True:
+        token = _replica.set(alias)
+        try:
+            chunk = next(chunks, _done)
+        finally:
+            _replica.reset(token)
+        if chunk is _done:
+            return
+        yield chunk
+
+def replica_reads(view):
+    """Send the reads of a read-only view, including a streamed response, to a replica when one is usable"""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        alias = choose_replica(request)
+        if alias is None:
+            return view(request, *args, **kwargs)
+        token = _replica.set(alias)
+        try:
+            response = view(request, *args, **kwargs)
+        except OperationalError as e:
+            # The replica went away since it was checked; skip it until the next check and retry on the primary
+            print(f"Error reading from replica {alias}: {e}")
+            _mark(alias, False)
+            response = None
+        finally:
+            _replica.reset(token)
+        if response is None:
+            return view(request, *args, **kwargs)
+        if response.streaming:
+            response.streaming_content = _stream_from(alias, response.streaming_content)
+        return response
+    return wrapper
+
+
+class ReplicaRouter:
+    """Reads go to the replica chosen for the current request, if any; writes and migrations to the primary"""
+
+    def db_for_read(self, model, **hints):
+        return _replica.get()
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in settings.DATABASE_REPLICAS
+
+
+class PrimaryAfterWriteMiddleware:
+    """Keep a session's reads on the primary for DATABASE_REPLICA_STICKY_SECONDS after it writes"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        response = self.get_response(request)
+        if settings.DATABASE_REPLICAS and request.method not in SAFE_METHODS and request.user.is_authenticated:
+            request.session[SESSION_KEY] = time.time() + settings.DATABASE_REPLICA_STICKY_SECONDS
+        return response
+
+    async def __acall__(self, request):
+        # The async views only stream; nothing is written through them
+        return await self.get_response(request)
@@ -0,0 +1,109 @@
+import hashlib
+import re
+import unicodedata
+from datetime import timedelta
+from django.conf import settings
+from django.db import IntegrityError
+from django.db.models import F
+from django.utils import timezone
+import redis
+from .events import get_connection
+from .models import SolutionCache, AI_MODEL, SOLUTION_PROMPT
+
+HITS_KEY = 'lastresort:solution_cache:hits'
+MISSES_KEY = 'lastresort:solution_cache:misses'
+
+def normalize_problem(problem):
+    """Collapse the cosmetic differences users introduce when resubmitting a problem"""
+    problem = unicodedata.normalize('NFKC', problem)
+    return re.sub(r'\s+', ' ', problem).strip()
+
+def cache_key(problem, model=AI_MODEL, prompt=SOLUTION_PROMPT):
+    digest = hashlib.sha256()
+    for part in (model, prompt, normalize_problem(problem)):
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+def enabled():
+    """Only answers from the real model are cached, so stub and replay runs never reach real traffic"""
+    return settings.SOLUTION_CACHE_ENABLED and settings.AI_BACKEND == 'openai'
+
+def _count(key, amount=1):
+    if not settings.EVENTS_REDIS_URL or not amount:
+        return
+    try:
+        get_connection().incrby(key, amount)
+    except redis.RedisError as e:
+        print(f"Error recording solution cache stat {key}: {e}")
+
+def get_cached_solution(problem):
+    """Return (ai_solution, ai_answer) for an already solved problem, or None"""
+    if not enabled():
+        return None
+    key = cache_key(problem)
+    cutoff = timezone.now() - timedelta(seconds=settings.SOLUTION_CACHE_TTL)
+    cached = SolutionCache.objects.filter(key=key, created_at__gte=cutoff).values_list('ai_solution', 'ai_answer').first()
+    if cached is None:
+        _count(MISSES_KEY)
+        return None
+    SolutionCache.objects.filter(key=key).update(hit_count=F('hit_count') + 1, last_used_at=timezone.now())
+    _count(HITS_KEY)
+    return cached
+
+def get_cached_solutions(problems):
+    """Bulk version of get_cached_solution, returning {problem: (ai_solution, ai_answer)}"""
+    if not enabled() or not problems:
+        return {}
+    keys = {cache_key(problem): problem for problem in problems}
+    cutoff = timezone.now() - timedelta(seconds=settings.SOLUTION_CACHE_TTL)
+    found = SolutionCache.objects.filter(key__in=keys, created_at__gte=cutoff).values_list('key', 'ai_solution', 'ai_answer')
+    cached = {keys[key]: (ai_solution, ai_answer) for key, ai_solution, ai_answer in found}
+    if cached:
+        SolutionCache.objects.filter(key__in=[cache_key(problem) for problem in cached]).update(hit_count=F('hit_count') + 1, last_used_at=timezone.now())
+    _count(HITS_KEY, len(cached))
+    _count(MISSES_KEY, len(keys) - len(cached))
+    return cached
+
+def store_solution(problem, ai_solution, ai_answer):
+    if not enabled():
+        return
+    now = timezone.now()
+    try:
+        SolutionCache.objects.update_or_create(key=cache_key(problem), defaults={
+            'model': AI_MODEL,
+            'ai_solution': ai_solution,
+            'ai_answer': ai_answer,
+            'created_at': now,
+            'last_used_at': now,
+        })
+    except IntegrityError:
+        # Another worker solved the same problem first; its entry is just as good
+        pass
+
+def evict():
+    """Drop expired entries, then the least recently used ones beyond the size limit"""
+    cutoff = timezone.now() - timedelta(seconds=settings.SOLUTION_CACHE_TTL)
+    expired, _ = SolutionCache.objects.filter(created_at__lt=cutoff).delete()
+
+    overflow = 0
+    limit = settings.SOLUTION_CACHE_MAX_ENTRIES
+    first_evicted = list(SolutionCache.objects.order_by('-last_used_at').values_list('last_used_at', flat=True)[limit:limit + 1])
+    if first_evicted:
+        overflow, _ = SolutionCache.objects.filter(last_used_at__lte=first_evicted[0]).delete()
+    return expired + overflow
+
+def stats():
+    hits = misses = 0
+    if settings.EVENTS_REDIS_URL:
+        try:
+            hits, misses = (int(value or 0) for value in get_connection().mget(HITS_KEY, MISSES_KEY))
+        except redis.RedisError as e:
+            print(f"Error reading solution cache stats: {e}")
+    lookups = hits + misses
+    return {
+        'entries': SolutionCache.objects.count(),
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': hits / lookups if lookups else 0,
+    }
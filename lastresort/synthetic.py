@@ -0,0 +1,124 @@
+import random
+from datetime import timedelta
+from django.contrib.auth.models import User
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from django.utils import timezone
+from .models import AIResponse, Competition, LeaderboardEntry, PSAEntry, PSAGroup
+
+BATCH_SIZE = 1000
+
+# Share of submissions left in each review state; the rest are graded
+PENDING_SHARE = 0.1
+REJECTED_SHARE = 0.05
+
+def _problem(rng, competition, index):
+    a, b = rng.randint(2, 999), rng.randint(2, 999)
+    return f'[{competition.name}] Problem {index + 1}: what is {a} * {b}?', str(a * b)
+
+@transaction.atomic
+def generate(users, competitions, submissions, prefix='synthetic', seed=0, competitions_per_user=3):
+    """Create users, competitions and submissions with entries, AI responses and leaderboard rows"""
+    rng = random.Random(seed)
+    now = timezone.now()
+    password = make_password(None)
+
+    user_objs = User.objects.bulk_create([
+        User(username=f'{prefix}-user-{i}', password=password) for i in range(users)
+    ], batch_size=BATCH_SIZE)
+
+    competition_objs = []
+    for i in range(competitions):
+        # Roughly a third of the competitions have already ended
+        ended = i % 3 == 2
+        competition_objs.append(Competition(
+            name=f'{prefix}-competition-{i}',
+            short_description=f'Synthetic competition {i}',
+            description=f'Synthetic competition {i} generated for benchmarking.',
+            num_questions=rng.randint(3, 10),
+            pub_date=now - timedelta(days=30 + i),
+            end_date=now - timedelta(days=1) if ended else now + timedelta(days=30),
+            is_active=not ended
+        ))
+    competition_objs = Competition.objects.bulk_create(competition_objs, batch_size=BATCH_SIZE)
+
+    memberships = []
+    groups = []
+    for user in user_objs:
+        registered = rng.sample(competition_objs, min(competitions_per_user, len(competition_objs)))
+        memberships += [Competition.user.through(competition_id=c.id, user_id=user.id) for c in registered]
+        if not registered:
+            continue
+        for j in range(submissions):
+            roll = rng.random()
+            status = 'pending' if roll < PENDING_SHARE else 'rejected' if roll < PENDING_SHARE + REJECTED_SHARE else 'completed'
+            groups.append(PSAGroup(
+                user=user,
+                competition=registered[j % len(registered)],
+                name=user.username,
+                status=status,
+                reason='Synthetic rejection' if status == 'rejected' else '',
+                entry_count=registered[j % len(registered)].num_questions,
+                pub_date=now - timedelta(minutes=rng.randint(0, 60 * 24 * 30))
+            ))
+    Competition.user.through.objects.bulk_create(memberships, batch_size=BATCH_SIZE)
+    groups = PSAGroup.objects.bulk_create(groups, batch_size=BATCH_SIZE)
+
+    entries = []
+    for psa_group in groups:
+        for index in range(psa_group.competition.num_questions):
+            problem, answer = _problem(rng, psa_group.competition, index)
+            entries.append(PSAEntry(group=psa_group, problem=problem, solution=f'Multiply to get {answer}.', answer=answer, pub_date=psa_group.pub_date))
+    entries = PSAEntry.objects.bulk_create(entries, batch_size=BATCH_SIZE)
+
+    ai_responses = []
+    correct_counts = {}
+    entry_counts = {}
+    for entry in entries:
+        psa_group = entry.group
+        if psa_group.status != 'completed':
+            continue
+        is_correct = rng.random() < 0.5
+        ai_answer = entry.answer if is_correct else str(rng.randint(0, 999999))
+        ai_responses.append(AIResponse(psa_entry=entry, ai_solution=f'Working through it...\n{ai_answer}', ai_answer=ai_answer, is_correct=is_correct, pub_date=psa_group.pub_date))
+        correct_counts[psa_group.id] = correct_counts.get(psa_group.id, 0) + is_correct
+        entry_counts[psa_group.id] = entry_counts.get(psa_group.id, 0) + 1
+    AIResponse.objects.bulk_create(ai_responses, batch_size=BATCH_SIZE)
+
+    best = {}
+    graded = []
+    for psa_group in groups:
+        if psa_group.id not in entry_counts:
+            continue
+        psa_group.score = int(100 - correct_counts[psa_group.id] * 100 / entry_counts[psa_group.id])
+        psa_group.graded_at = psa_group.pub_date
+        psa_group.answered_count = entry_counts[psa_group.id]
+        graded.append(psa_group)
+        key = (psa_group.competition_id, psa_group.user_id)
+        # Ties go to the earlier submission, as in LeaderboardEntry.recompute
+        if key not in best or (-psa_group.score, psa_group.pub_date) < (-best[key].score, best[key].pub_date):
+            best[key] = psa_group
+    PSAGroup.objects.bulk_update(graded, ['score', 'graded_at', 'answered_count'], batch_size=BATCH_SIZE)
+    LeaderboardEntry.objects.bulk_create([
+        LeaderboardEntry(
+            competition_id=psa_group.competition_id,
+            user_id=psa_group.user_id,
+            best_group=psa_group,
+            best_score=psa_group.score,
+            best_submission_date=psa_group.pub_date
+        ) for psa_group in best.values()
+    ], batch_size=BATCH_SIZE)
+
+    return {
+        'users': len(user_objs),
+        'competitions': len(competition_objs),
+        'submissions': len(groups),
+        'entries': len(entries),
+        'ai_responses': len(ai_responses),
+    }
+
+def delete(prefix='synthetic'):
+    """Remove everything generate() created with this prefix"""
+    with transaction.atomic():
+        Competition.objects.filter(name__startswith=f'{prefix}-competition-').delete()
+        User.objects.filter(username__startswith=f'{prefix}-user-').delete()
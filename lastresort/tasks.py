@@ -1,57 +1,358 @@
-from celery import shared_task, group
-from .models import PSAGroup, PSAEntry, AIResponse
+import asyncio
+from celery import shared_task, chain, chord
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from .models import PSAGroup, PSAEntry, AIResponse, Competition, AIBatchJob, SOLUTION_PROMPT, correct_samples_needed
+from .events import PartialSolution, publish_group_event
+from .model_backends import BackendUnavailable, load_backend
+from .performance import budget
+from . import batch, fragments, metrics, rate_limit, solution_cache
 
-@shared_task
-def generate_single_ai_response(psa_group_id, psa_entry_id):
+# Failures that clear up by themselves and are worth retrying later; backends report
+# their own transient errors (OpenAI rate limits, connection and server errors) as BackendUnavailable
+RETRYABLE_ERRORS = (
+    rate_limit.RateLimited,
+    BackendUnavailable,
+)
+
+# A cache miss: the entry, the cache lookup and store, the response and its solution, the progress update and their savepoints
+@shared_task(bind=True)
+@budget(queries=15)
+def generate_single_ai_response(self, psa_group_id, psa_entry_id):
     """Generate a single AI response for a PSA entry"""
     try:
-        psa_entry = PSAEntry.objects.get(id=psa_entry_id, group_id=psa_group_id)
+        psa_entry = PSAEntry.objects.annotate(samples=F('group__competition__samples_per_entry')).get(id=psa_entry_id, group_id=psa_group_id)
+        samples = psa_entry.samples or 1
+        if samples > 1:
+            return _sample_single_entry(psa_entry, samples)
         
-        ai_solution, ai_answer = psa_entry.get_ai_solution_and_answer()
+        partial = None
+        cached = solution_cache.get_cached_solution(psa_entry.problem)
+        if cached:
+            ai_solution, ai_answer = cached
+        else:
+            rate_limit.acquire(rate_limit.estimate_tokens(SOLUTION_PROMPT.format(problem=psa_entry.problem)))
+            if settings.AI_STREAM_PARTIALS and settings.EVENTS_REDIS_URL:
+                partial = PartialSolution(psa_group_id, psa_entry_id)
+            ai_solution, ai_answer = psa_entry.get_ai_solution_and_answer(on_text=partial.write if partial else None)
+            solution_cache.store_solution(psa_entry.problem, ai_solution, ai_answer)
         
-        ai_response = AIResponse.objects.create(
-            psa_entry=psa_entry,
-            ai_solution=ai_solution,
-            ai_answer=ai_answer
-        )
+        # Only the finished output is stored; viewers saw the partial text through Redis
+        with transaction.atomic():
+            ai_response = AIResponse.objects.create(
+                psa_entry=psa_entry,
+                ai_solution=ai_solution,
+                ai_answer=ai_answer,
+                is_correct=ai_answer == psa_entry.answer
+            )
+            PSAGroup.record_progress(psa_group_id, answered=1)
+        if partial:
+            partial.clear()
+        
+        publish_group_event(psa_group_id, 'response', ai_response_id=ai_response.id)
         
         return {
             'ai_response_id': ai_response.id,
             'psa_entry_id': psa_entry_id,
+            'cached': cached is not None,
             'success': True
         }
+    except RETRYABLE_ERRORS as e:
+        if self.request.retries < settings.AI_MAX_RETRIES:
+            rate_limit.record_retry()
+            countdown = max(rate_limit.backoff_delay(self.request.retries), getattr(e, 'wait', 0))
+            raise self.retry(exc=e, countdown=countdown, max_retries=settings.AI_MAX_RETRIES)
+        print(f"Giving up on AI response for PSA entry {psa_entry_id} after {self.request.retries} retries: {e}")
+        PSAGroup.record_progress(psa_group_id, failed=1)
+        return {
+            'psa_entry_id': psa_entry_id,
+            'success': False,
+            'error': str(e)
+        }
     except Exception as e:
         print(f"Error generating AI response for PSA entry {psa_entry_id}: {e}")
+        PSAGroup.record_progress(psa_group_id, failed=1)
         return {
             'psa_entry_id': psa_entry_id,
             'success': False,
             'error': str(e)
         }
 
+def _sample_single_entry(psa_entry, samples):
+    """Sample one entry of a multi-sample competition concurrently inside the calling task"""
+    results = asyncio.run(_solve_entries([psa_entry], samples, correct_samples_needed(samples)))[0]
+    if results is None:
+        # The calls were already retried inside _solve_entries
+        PSAGroup.record_progress(psa_entry.group_id, failed=1)
+        return {
+            'psa_entry_id': psa_entry.id,
+            'success': False,
+            'error': 'A model sample failed'
+        }
+    created = batch.store_responses([
+        AIResponse(psa_entry=psa_entry, ai_solution=ai_solution, ai_answer=ai_answer, is_correct=ai_answer == psa_entry.answer)
+        for ai_solution, ai_answer in results
+    ])
+    return {
+        'ai_response_ids': [ai_response.id for ai_response in created],
+        'psa_entry_id': psa_entry.id,
+        'samples': len(created),
+        'success': True
+    }
+
 @shared_task
+@budget(queries=15, ms=1000)
+def grade_submission(psa_group_id):
+    """Score a submission exactly once, after its last AI response has been stored"""
+    with transaction.atomic():
+        claimed = PSAGroup.objects.filter(id=psa_group_id, graded_at__isnull=True).update(graded_at=timezone.now())
+        if not claimed:
+            return None
+        psa_group = PSAGroup.objects.get(id=psa_group_id)
+        psa_group.grade()
+    
+    publish_group_event(psa_group_id, 'complete', score=psa_group.score)
+    print(f"Graded submission {psa_group_id}: {psa_group.score}%")
+    return psa_group.score
+
+@shared_task
+@budget(queries=5, ms=1000)
 def generate_ai_responses(psa_group_id):
-    """Generate AI responses for all PSA entries in a group"""
+    """Generate AI responses for every unanswered entry of a group, completing it once they have all finished"""
     try:
-        psa_group = PSAGroup.objects.get(id=psa_group_id)
-        psa_entries = psa_group.psaentry_set.all()
+        return _entry_chord(psa_group_id).delay().id
+    except Exception as e:
+        print(f"Error setting up parallel tasks for PSA group {psa_group_id}: {e}")
+        return None
+
+def _entry_chord(psa_group_id):
+    """One task per unanswered entry of a group, then completing the group"""
+    entry_ids = list(PSAEntry.objects.filter(group_id=psa_group_id, airesponse__isnull=True).values_list('id', flat=True))
+    PSAGroup.objects.filter(id=psa_group_id).update(failed_count=0)
+    if not entry_ids:
+        return mark_submission_completed.si([], psa_group_id)
+    # The chord calls back only after every entry's task, retries included, has returned
+    return chord(
+        (generate_single_ai_response.si(psa_group_id, entry_id) for entry_id in entry_ids),
+        mark_submission_completed.s(psa_group_id)
+    )
+
+async def _call_model(psa_entry, backend, semaphore):
+    """One model call for an entry, retried on transient errors; None if it keeps failing"""
+    tokens = rate_limit.estimate_tokens(SOLUTION_PROMPT.format(problem=psa_entry.problem))
+    retries = 0
+    async with semaphore:
+        while True:
+            try:
+                await rate_limit.aacquire(tokens)
+                return await psa_entry.aget_ai_solution_and_answer(backend)
+            except RETRYABLE_ERRORS as e:
+                if retries >= settings.AI_MAX_RETRIES:
+                    print(f"Giving up on AI response for PSA entry {psa_entry.id} after {retries} retries: {e}")
+                    return None
+                rate_limit.record_retry()
+                await asyncio.sleep(rate_limit.backoff_delay(retries))
+                retries += 1
+            except Exception as e:
+                print(f"Error generating AI response for PSA entry {psa_entry.id}: {e}")
+                return None
+
+async def _sample_entry(psa_entry, backend, semaphore, samples, needed):
+    """Sample an entry until needed answers are right, or too many are wrong for that, at most samples times.
+
+    The needed calls start together, which settles an entry whose answers all agree; the other samples
+    only start once two answers disagree, and any still running when the entry is settled are cancelled.
+    Returns every finished (ai_solution, ai_answer), or None if a call failed.
+    """
+    results = []
+    correct = wrong = launched = 0
+    wanted = needed
+    running = set()
+    try:
+        while correct < needed and wrong <= samples - needed:
+            while launched < wanted:
+                running.add(asyncio.create_task(_call_model(psa_entry, backend, semaphore)))
+                launched += 1
+            done, running = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                result = task.result()
+                if result is None:
+                    return None
+                results.append(result)
+                if result[1] == psa_entry.answer:
+                    correct += 1
+                else:
+                    wrong += 1
+            if correct and wrong:
+                wanted = samples
+        return results
+    finally:
+        if running:
+            metrics.inc('lastresort_model_samples_cancelled_total', len(running))
+            for task in running:
+                task.cancel()
+            await asyncio.gather(*running, return_exceptions=True)
+
+async def _solve_entries(psa_entries, samples=1, needed=1):
+    """Sample entries concurrently, at most AI_ASYNC_CONCURRENCY requests in flight; a list of samples or None per entry"""
+    semaphore = asyncio.Semaphore(settings.AI_ASYNC_CONCURRENCY)
+    backend = load_backend()
+    try:
+        return await asyncio.gather(*(_sample_entry(psa_entry, backend, semaphore, samples, needed) for psa_entry in psa_entries))
+    finally:
+        await backend.aclose()
+
+@shared_task
+def generate_ai_responses_async(psa_group_id):
+    """Generate AI responses for all PSA entries in a group concurrently inside this task"""
+    try:
+        psa_entries = list(PSAEntry.objects.filter(group_id=psa_group_id, airesponse__isnull=True))
+        samples, needed = PSAGroup.sampling(psa_group_id)
+        # Repeated samples have to be independent draws, so they are never answered from the cache
+        cached = solution_cache.get_cached_solutions([psa_entry.problem for psa_entry in psa_entries]) if samples == 1 else {}
+        uncached = [psa_entry for psa_entry in psa_entries if psa_entry.problem not in cached]
+        
+        solved = dict(zip((psa_entry.id for psa_entry in uncached), asyncio.run(_solve_entries(uncached, samples, needed))))
         
-        job = group(generate_single_ai_response.s(psa_group_id, entry.id) for entry in psa_entries)
-        result = job.apply_async()
+        ai_responses = []
+        failed = 0
+        for psa_entry in psa_entries:
+            results = [cached[psa_entry.problem]] if psa_entry.problem in cached else solved.get(psa_entry.id)
+            if results is None:
+                failed += 1
+                continue
+            if psa_entry.id in solved:
+                solution_cache.store_solution(psa_entry.problem, *results[0])
+            ai_responses.extend(
+                AIResponse(psa_entry=psa_entry, ai_solution=ai_solution, ai_answer=ai_answer, is_correct=ai_answer == psa_entry.answer)
+                for ai_solution, ai_answer in results
+            )
+        created = batch.store_responses(ai_responses)
+        PSAGroup.objects.filter(id=psa_group_id).update(failed_count=failed)
         
-        return result.id
+        return {
+            'psa_group_id': psa_group_id,
+            'created': len(created),
+            'cached': len(cached),
+            'failed': failed
+        }
     except Exception as e:
-        print(f"Error setting up parallel tasks for PSA group {psa_group_id}: {e}")
+        print(f"Error generating AI responses for PSA group {psa_group_id}: {e}")
         return None
 
+# Includes grading, which creates the leaderboard row on a user's first graded submission
 @shared_task
+@budget(queries=16, ms=1000)
 def mark_submission_completed(result, psa_group_id):
-    """Mark a submission as completed after all AI responses are generated"""
+    """Complete and grade a submission once generation has finished for all of its entries"""
     try:
         psa_group = PSAGroup.objects.get(id=psa_group_id)
+        if psa_group.failed_count or psa_group.answered_count < psa_group.entry_count:
+            print(f"Submission {psa_group_id} not completed: {psa_group.answered_count} of {psa_group.entry_count} answered, {psa_group.failed_count} failed")
+            publish_group_event(psa_group_id, 'incomplete', answered=psa_group.answered_count, failed=psa_group.failed_count)
+            return result
         psa_group.status = 'completed'
-        psa_group.save()
+        psa_group.save(update_fields=['status'])
         print(f"Marked submission {psa_group_id} as completed")
+        grade_submission(psa_group_id)
         return result
     except Exception as e:
         print(f"Error marking submission {psa_group_id} as completed: {e}")
-        return result
\ No newline at end of file
+        return result
+
+@shared_task
+def expire_competitions():
+    """Deactivate every competition whose end date has passed in a single update"""
+    expired = Competition.objects.filter(is_active=True, end_date__lte=timezone.now()).update(is_active=False)
+    if expired:
+        fragments.bump('competitions')
+        print(f"Deactivated {expired} expired competition(s)")
+    return expired
+
+@shared_task
+def evict_solution_cache():
+    """Expire old cached solutions and trim the cache to its size limit"""
+    evicted = solution_cache.evict()
+    stats = solution_cache.stats()
+    print(f"Evicted {evicted} cached solution(s); {stats['entries']} left, hit rate {stats['hit_rate']:.1%} ({stats['hits']} hits, {stats['misses']} misses)")
+    return evicted
+
+@shared_task
+def submit_ai_batch(psa_group_ids):
+    """Generate AI responses for one or more groups through a single Batch API job"""
+    try:
+        job = batch.submit_batch(psa_group_ids)
+    except Exception as e:
+        print(f"Error submitting batch for PSA groups {psa_group_ids}: {e}")
+        return None
+    
+    # Groups answered entirely from the solution cache are done already
+    finish_batch_groups(psa_group_ids)
+    if job:
+        print(f"Submitted batch {job.batch_id} with {job.request_count} request(s)")
+        return job.batch_id
+    return None
+
+@shared_task
+def poll_ai_batches():
+    """Check unfinished batch jobs and store the results of any that have finished"""
+    finished = 0
+    for job in AIBatchJob.objects.filter(completed_at__isnull=True):
+        try:
+            created = batch.refresh_batch(job)
+        except Exception as e:
+            print(f"Error polling batch {job.batch_id}: {e}")
+            continue
+        if job.status in AIBatchJob.FINISHED_STATUSES:
+            finished += 1
+            print(f"Batch {job.batch_id} {job.status}: stored {len(created)} AI response(s)")
+            finish_batch_groups(list(job.groups.values_list('id', flat=True)))
+    return finished
+
+def finish_batch_groups(psa_group_ids):
+    """Mark and grade the groups whose entries have all been answered"""
+    complete_ids = batch.complete_group_ids(psa_group_ids)
+    PSAGroup.objects.filter(id__in=complete_ids).update(status='completed')
+    fragments.bump_groups(PSAGroup.objects.filter(id__in=complete_ids))
+    for psa_group_id in complete_ids:
+        grade_submission.delay(psa_group_id)
+
+def dispatch_ai_generation(psa_group_id):
+    """Queue AI response generation for an accepted group in the configured execution mode"""
+    mode = settings.AI_EXECUTION_MODE
+    # A batch job can neither stop early nor cancel calls, so multi-sample groups are solved in async mode
+    if mode == 'batch' and PSAGroup.sampling(psa_group_id)[0] > 1:
+        mode = 'async'
+    if mode == 'batch':
+        submit_ai_batch.delay([psa_group_id])
+    elif mode == 'async':
+        (generate_ai_responses_async.s(psa_group_id) | mark_submission_completed.s(psa_group_id)).delay()
+    else:
+        generate_ai_responses.delay(psa_group_id)
+
+@shared_task
+def dispatch_accepted_groups(psa_group_ids):
+    """Generate AI responses for many accepted groups, at most AI_DISPATCH_CONCURRENCY groups at a time"""
+    if settings.AI_EXECUTION_MODE == 'batch':
+        multi_sample = set(PSAGroup.objects.filter(id__in=psa_group_ids, competition__samples_per_entry__gt=1).values_list('id', flat=True))
+        single_sample = [psa_group_id for psa_group_id in psa_group_ids if psa_group_id not in multi_sample]
+        batch_id = submit_ai_batch(single_sample) if single_sample else None
+        # Multi-sample groups go through the async lanes below, like dispatch_ai_generation does
+        psa_group_ids = [psa_group_id for psa_group_id in psa_group_ids if psa_group_id in multi_sample]
+        if not psa_group_ids:
+            return batch_id
+    
+    # Each lane works through its groups one after another, so lanes bound the concurrency.
+    # In realtime mode a group's entries still run as separate tasks, so viewers see partial output,
+    # and the lane moves on to its next group once that group's chord has completed it.
+    realtime = settings.AI_EXECUTION_MODE == 'realtime'
+    lane_count = min(settings.AI_DISPATCH_CONCURRENCY, len(psa_group_ids))
+    for lane in range(lane_count):
+        chain(*(
+            _entry_chord(psa_group_id) if realtime else
+            generate_ai_responses_async.si(psa_group_id) | mark_submission_completed.s(psa_group_id)
+            for psa_group_id in psa_group_ids[lane::lane_count]
+        )).delay()
+    return lane_count
@@ -1,3 +1,1733 @@
-from django.test import TestCase
+import asyncio
+import csv
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from importlib import import_module
+from types import SimpleNamespace
+from unittest import mock, skipUnless
+from celery import Task, current_app
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, OperationalError, connection, connections, router
+from django.db.migrations.executor import MigrationExecutor
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from . import batch, events, fragments, metrics, performance, rate_limit, replicas, solution_cache, synthetic, views
+from . import model_backends
+from .exports import EXPORT_FIELDS
+from .forms import PSAUploadForm
+from .management.commands import check_startup
+from .management.commands.benchmark_views import VIEWS
+from .model_backends import BackendUnavailable, ReplayBackend, StubBackend
+from .models import SOLUTION_PROMPT, AIBatchJob, AIResponse, AISolution, Competition, LeaderboardEntry, PSAEntry, PSAGroup, SolutionCache, correct_samples_needed
+from .pagination import decode_cursor, encode_cursor, keyset_page
+from .tasks import (
+    _entry_chord, _sample_entry, _solve_entries, dispatch_accepted_groups, dispatch_ai_generation, expire_competitions,
+    generate_ai_responses, generate_ai_responses_async, generate_single_ai_response, grade_submission, mark_submission_completed
+)
 
-# Create your tests here.
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'lastresort-tests'}}
+
+
+def create_competition(**fields):
+    return Competition.objects.create(**{
+        'name': 'Competition',
+        'short_description': 'Short',
+        'description': 'Description',
+        'end_date': timezone.now() + timedelta(days=1),
+        **fields
+    })
+
+
+def use_fake_redis(test):
+    """Point the event, counter and stream connections of a test at one in-memory Redis server"""
+    server = fakeredis.FakeServer()
+    test.redis = fakeredis.FakeRedis(server=server)
+    for patcher in [
+        mock.patch.object(events, '_connection', test.redis),
+        mock.patch.object(views, 'get_async_connection', lambda: fakeredis.FakeAsyncRedis(server=server)),
+    ]:
+        patcher.start()
+        test.addCleanup(patcher.stop)
+    settings_override = override_settings(EVENTS_REDIS_URL='redis://fake')
+    settings_override.enable()
+    test.addCleanup(settings_override.disable)
+
+
+
+    def setUp(self):
+        self.open = create_competition(name='Open')
+        self.ended = create_competition(name='Ended')
+        # save() would deactivate it already; the task has to catch competitions that ended since
+        Competition.objects.filter(id=self.ended.id).update(end_date=timezone.now() - timedelta(minutes=1))
+
+    def test_ended_competitions_are_deactivated_in_one_update(self):
+        with CaptureQueriesContext(connections['default']) as queries:
+            self.assertEqual(expire_competitions(), 1)
+        self.assertEqual([query['sql'].split()[0] for query in queries.captured_queries], ['UPDATE'])
+        self.assertEqual(set(Competition.objects.filter(is_active=True)), {self.open})
+        self.assertEqual(expire_competitions(), 0)
+
+    def test_end_date_is_checked_at_query_time(self):
+        # Before the task runs, the ended competition is already out of the active list
+        self.assertEqual(list(Competition.objects.active()), [self.open])
+        self.assertEqual(list(Competition.objects.ended()), [self.ended])
+
+    @override_settings(CACHES=LOCMEM_CACHES, DATABASE_REPLICAS=[])
+    def test_dashboard_does_not_write(self):
+        cache.clear()
+        self.client.force_login(User.objects.create_user('expiry', password='password'))
+        with CaptureQueriesContext(connections['default']) as queries:
+            response = self.client.get(reverse('lastresort:dashboard'))
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse([query for query in queries.captured_queries if 'lastresort_competition' in query['sql'] and not query['sql'].startswith('SELECT')])
+        self.assertIn(self.open, response.context['active_competitions'])
+        self.assertIn(self.ended, response.context['past_competitions'])
+
+
+class LeaderboardTests(TestCase):
+    def setUp(self):
+        self.competition = create_competition()
+        self.user = User.objects.create_user('leader', password='password')
+        self.now = timezone.now()
+
+    def graded(self, score, minutes_ago=0, user=None):
+        psa_group = PSAGroup.objects.create(
+            name='leader', competition=self.competition, user=user or self.user, status='completed',
+            score=score, pub_date=self.now - timedelta(minutes=minutes_ago), graded_at=self.now
+        )
+        LeaderboardEntry.record_score(psa_group)
+        return psa_group
+
+    def entry(self, user=None):
+        return LeaderboardEntry.objects.get(competition=self.competition, user=user or self.user)
+
+    def test_best_graded_group_is_kept(self):
+        self.graded(40, minutes_ago=3)
+        best = self.graded(70, minutes_ago=2)
+        self.graded(50, minutes_ago=1)
+        entry = self.entry()
+        self.assertEqual((entry.best_score, entry.best_group, entry.best_submission_date), (70, best, best.pub_date))
+        self.assertEqual(LeaderboardEntry.objects.count(), 1)
+
+    def test_ties_keep_the_earlier_submission(self):
+        first = self.graded(60, minutes_ago=2)
+        self.graded(60, minutes_ago=1)
+        self.assertEqual(self.entry().best_group, first)
+
+    def test_regrade_can_lower_the_score(self):
+        self.graded(40, minutes_ago=2)
+        best = self.graded(70, minutes_ago=1)
+        best.score = 20
+        best.save(update_fields=['score'])
+        LeaderboardEntry.record_score(best)
+        self.assertEqual(self.entry().best_score, 40)
+
+    def test_row_is_removed_without_graded_groups(self):
+        psa_group = self.graded(70)
+        PSAGroup.objects.filter(id=psa_group.id).update(graded_at=None)
+        self.assertIsNone(LeaderboardEntry.recompute(self.competition.id, self.user.id))
+        self.assertFalse(LeaderboardEntry.objects.exists())
+
+    @override_settings(CACHES=LOCMEM_CACHES, DATABASE_REPLICAS=[])
+    def test_view_ranks_in_the_database(self):
+        cache.clear()
+        others = [User.objects.create_user(f'leader-{number}', password='password') for number in range(3)]
+        self.graded(50, minutes_ago=5)
+        self.graded(90, minutes_ago=4, user=others[0])
+        self.graded(50, minutes_ago=3, user=others[1])
+        self.graded(10, minutes_ago=2, user=others[2])
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('lastresort:leaderboard', args=(self.competition.id,)))
+        ranking = [(entry.user, entry.best_score, entry.rank) for entry in response.context['leaderboard_entries']]
+        # Equal scores share a rank and the earlier submission is listed first
+        self.assertEqual(ranking, [(others[0], 90, 1), (self.user, 50, 2), (others[1], 50, 2), (others[2], 10, 4)])
+        self.assertEqual((response.context['your_rank'], response.context['participant_count'], response.context['top_score']), (2, 4, 90))
+
+
+def read_event(chunk):
+    """Split one server-sent event into its name and data"""
+    lines = chunk.rstrip('\n').splitlines()
+    return lines[0].removeprefix('event: '), '\n'.join(line.removeprefix('data: ') for line in lines[1:])
+
+
+@skipUnless(fakeredis, 'fakeredis is not installed')
+@override_settings(CACHES=LOCMEM_CACHES, DATABASE_REPLICAS=[])
+class OutputStreamTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        use_fake_redis(self)
+        self.user = User.objects.create_user('watcher', password='password')
+        self.psa_group = PSAGroup.objects.create(name='stream', user=self.user, status='accepted', entry_count=2)
+        self.answered, self.writing = [
+            PSAEntry.objects.create(group=self.psa_group, problem=f'Problem {number}', solution='', answer='4') for number in range(2)
+        ]
+        AIResponse.objects.create(psa_entry=self.answered, ai_answer='4', is_correct=True, ai_solution='2 + 2\n4')
+
+    def test_other_users_are_forbidden(self):
+        self.client.force_login(User.objects.create_user('stranger', password='password'))
+        response = self.client.get(reverse('lastresort:stream_outputs', args=(self.psa_group.id,)))
+        self.assertEqual(response.status_code, 403)
+
+    async def test_stream_catches_up_then_relays_events(self):
+        await self.async_client.aforce_login(self.user)
+        await asyncio.to_thread(self.redis.set, events.partial_key(self.writing.id), 'Half')
+        response = await self.async_client.get(reverse('lastresort:stream_outputs', args=(self.psa_group.id,)))
+        self.assertEqual((response['Content-Type'], response['X-Accel-Buffering']), ('text/event-stream', 'no'))
+        stream = aiter(response.streaming_content)
+
+        async def next_event():
+            chunk = ': keepalive'
+            # Keepalive comments go out while no event is published
+            while chunk.startswith(':'):
+                chunk = await anext(stream)
+                chunk = chunk.decode() if isinstance(chunk, bytes) else chunk
+            return read_event(chunk)
+
+        # Stored responses first, then the solution still being written, whole
+        name, data = await next_event()
+        self.assertEqual(name, 'response')
+        self.assertIn(f'data-entry-id="{self.answered.id}"', data)
+        self.assertEqual(await next_event(), ('partial', json.dumps({'psa_entry_id': self.writing.id, 'offset': 0, 'delta': 'Half'})))
+
+        events.publish_group_event(self.psa_group.id, 'partial', psa_entry_id=self.writing.id, offset=4, delta=' done')
+        name, data = await next_event()
+        self.assertEqual((name, json.loads(data)['delta']), ('partial', ' done'))
+
+        await PSAGroup.objects.filter(id=self.psa_group.id).aupdate(graded_at=timezone.now(), score=50, status='completed')
+        events.publish_group_event(self.psa_group.id, 'complete')
+        name, data = await next_event()
+        self.assertEqual(name, 'complete')
+        with self.assertRaises(StopAsyncIteration):
+            await anext(stream)
+
+    async def test_failed_generation_ends_the_stream(self):
+        await PSAGroup.objects.filter(id=self.psa_group.id).aupdate(answered_count=1, failed_count=1)
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(reverse('lastresort:stream_outputs', args=(self.psa_group.id,)))
+        chunks = [chunk.decode() if isinstance(chunk, bytes) else chunk async for chunk in response.streaming_content]
+        self.assertEqual([read_event(chunk)[0] for chunk in chunks], ['response', 'incomplete'])
+        self.assertEqual(json.loads(read_event(chunks[-1])[1]), {'answered': 1, 'failed': 1})
+
+    def test_publish_is_skipped_without_redis(self):
+        with override_settings(EVENTS_REDIS_URL=''), mock.patch.object(events, 'get_connection') as get_connection:
+            events.publish_group_event(self.psa_group.id, 'complete')
+        get_connection.assert_not_called()
+
+
+class GradingTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('graded', password='password')
+        self.psa_group = PSAGroup.objects.create(name='grading', user=self.user, status='accepted', entry_count=2)
+        for number, is_correct in enumerate([True, False]):
+            psa_entry = PSAEntry.objects.create(group=self.psa_group, problem=f'Problem {number}', solution='', answer='4')
+            AIResponse.objects.create(psa_entry=psa_entry, ai_answer='4' if is_correct else '5', is_correct=is_correct)
+
+    def test_submission_is_graded_once(self):
+        with mock.patch('lastresort.tasks.publish_group_event') as publish:
+            self.assertEqual(grade_submission(self.psa_group.id), 50)
+            graded_at = PSAGroup.objects.get(id=self.psa_group.id).graded_at
+            with CaptureQueriesContext(connections['default']) as queries:
+                self.assertIsNone(grade_submission(self.psa_group.id))
+        self.assertEqual(publish.call_count, 1)
+        # The repeat loses the claim and writes nothing
+        self.assertEqual(len([query for query in queries.captured_queries if query['sql'].startswith('UPDATE')]), 1)
+        self.assertFalse([query for query in queries.captured_queries if query['sql'].startswith(('INSERT', 'DELETE'))])
+        self.psa_group.refresh_from_db()
+        self.assertEqual((self.psa_group.score, self.psa_group.graded_at), (50, graded_at))
+
+    @override_settings(CACHES=LOCMEM_CACHES, DATABASE_REPLICAS=[])
+    def test_polling_does_not_write(self):
+        cache.clear()
+        self.client.force_login(self.user)
+        url = reverse('lastresort:check_outputs', args=(self.psa_group.id,))
+        with CaptureQueriesContext(connections['default']) as pending:
+            self.assertTemplateUsed(self.client.get(url), 'lastresort/loading_partial.html')
+        with mock.patch('lastresort.tasks.publish_group_event'):
+            grade_submission(self.psa_group.id)
+        with CaptureQueriesContext(connections['default']) as graded:
+            response = self.client.get(url)
+            revalidated = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual((response.status_code, revalidated.status_code), (200, 304))
+        self.assertEqual({query['sql'].split()[0] for query in pending.captured_queries + graded.captured_queries}, {'SELECT'})
+        self.assertEqual(PSAGroup.objects.get(id=self.psa_group.id).score, 50)
+
+
+@override_settings(SOLUTION_CACHE_ENABLED=True, AI_BACKEND='openai', EVENTS_REDIS_URL='', SOLUTION_CACHE_TTL=3600, SOLUTION_CACHE_MAX_ENTRIES=2)
+class SolutionCacheTests(TestCase):
+    def test_key_ignores_cosmetic_differences(self):
+        key = solution_cache.cache_key('What is 2 + 2?')
+        self.assertEqual(solution_cache.cache_key('  What is\t2 +\n2?  '), key)
+        # NFKC folds the full-width characters users paste in
+        self.assertEqual(solution_cache.cache_key('What is ２ + ２?'), key)
+        self.assertNotEqual(solution_cache.cache_key('What is 2 + 3?'), key)
+        self.assertNotEqual(solution_cache.cache_key('What is 2 + 2?', model='other-model'), key)
+        self.assertNotEqual(solution_cache.cache_key('What is 2 + 2?', prompt='Answer: {problem}'), key)
+
+    def test_only_the_real_model_is_cached(self):
+        self.assertTrue(solution_cache.enabled())
+        with override_settings(AI_BACKEND='stub'):
+            self.assertFalse(solution_cache.enabled())
+            solution_cache.store_solution('What is 2 + 2?', '2 + 2\n4', '4')
+        self.assertFalse(SolutionCache.objects.exists())
+
+    def test_hits_are_counted(self):
+        solution_cache.store_solution('What is 2 + 2?', '2 + 2\n4', '4')
+        self.assertEqual(solution_cache.get_cached_solution('What is  2 + 2?'), ('2 + 2\n4', '4'))
+        self.assertIsNone(solution_cache.get_cached_solution('What is 2 + 3?'))
+        self.assertEqual(
+            solution_cache.get_cached_solutions(['What is 2 + 2?', 'What is 2 + 3?']),
+            {'What is 2 + 2?': ('2 + 2\n4', '4')}
+        )
+        self.assertEqual(SolutionCache.objects.get().hit_count, 2)
+
+    def test_expired_entries_are_misses_and_evicted(self):
+        solution_cache.store_solution('What is 2 + 2?', '2 + 2\n4', '4')
+        SolutionCache.objects.update(created_at=timezone.now() - timedelta(hours=2))
+        self.assertIsNone(solution_cache.get_cached_solution('What is 2 + 2?'))
+        self.assertEqual(solution_cache.evict(), 1)
+        self.assertFalse(SolutionCache.objects.exists())
+
+    def test_least_recently_used_entries_are_evicted_beyond_the_limit(self):
+        now = timezone.now()
+        for minutes_ago in range(4):
+            solution_cache.store_solution(f'Problem {minutes_ago}', 'solution', 'answer')
+            SolutionCache.objects.filter(key=solution_cache.cache_key(f'Problem {minutes_ago}')).update(last_used_at=now - timedelta(minutes=minutes_ago))
+        self.assertEqual(solution_cache.evict(), 2)
+        self.assertEqual(
+            set(SolutionCache.objects.values_list('key', flat=True)),
+            {solution_cache.cache_key('Problem 0'), solution_cache.cache_key('Problem 1')}
+        )
+
+
+def batch_line(entry_id, text=None):
+    """One line of a batch output file; without text, the request failed"""
+    if text is None:
+        return json.dumps({'custom_id': f'entry-{entry_id}', 'response': None, 'error': {'message': 'failed'}})
+    body = {'output': [{'type': 'message', 'content': [{'type': 'output_text', 'text': text}]}]}
+    return json.dumps({'custom_id': f'entry-{entry_id}', 'response': {'status_code': 200, 'body': body}, 'error': None})
+
+
+@override_settings(SOLUTION_CACHE_ENABLED=False, EVENTS_REDIS_URL='')
+class BatchTests(TestCase):
+    def setUp(self):
+        self.competition = create_competition()
+        self.user = User.objects.create_user('batched', password='password')
+        self.psa_group = PSAGroup.objects.create(name='batch', user=self.user, competition=self.competition, status='accepted', entry_count=3)
+        self.entries = [
+            PSAEntry.objects.create(group=self.psa_group, problem=f'Problem {number}', solution='', answer='4') for number in range(3)
+        ]
+        self.job = AIBatchJob.objects.create(batch_id='batch-1', input_file_id='file-in', request_count=3)
+        self.job.groups.set([self.psa_group])
+
+    def refresh(self, status, output=(), errors=()):
+        files = {'file-out': '\n'.join(output), 'file-err': '\n'.join(errors)}
+        client = mock.Mock()
+        client.batches.retrieve.return_value = SimpleNamespace(
+            status=status, output_file_id='file-out' if output else None, error_file_id='file-err' if errors else None
+        )
+        client.files.content.side_effect = lambda file_id: SimpleNamespace(text=files[file_id])
+        with mock.patch('lastresort.batch.openai_client', return_value=client), \
+                mock.patch('lastresort.batch.publish_group_event') as publish:
+            created = batch.refresh_batch(self.job)
+        self.psa_group.refresh_from_db()
+        return created, publish
+
+    def test_unfinished_job_records_nothing(self):
+        created, publish = self.refresh('in_progress')
+        self.assertEqual((created, self.job.completed_at, self.psa_group.failed_count), ([], None, 0))
+        publish.assert_not_called()
+
+    def test_requests_an_expired_job_never_ran_count_as_failed(self):
+        created, publish = self.refresh('expired', output=[batch_line(self.entries[0].id, 'Work\n4')], errors=[batch_line(self.entries[1].id)])
+        self.assertEqual([(ai_response.psa_entry_id, ai_response.is_correct) for ai_response in created], [(self.entries[0].id, True)])
+        # The error file's entry and the one never run are each counted once
+        self.assertEqual((self.psa_group.answered_count, self.psa_group.failed_count), (1, 2))
+        self.assertIsNotNone(self.job.completed_at)
+        publish.assert_any_call(self.psa_group.id, 'incomplete', answered=1, failed=2)
+
+    def test_completed_job_has_no_failures(self):
+        self.refresh('completed', output=[batch_line(entry.id, 'Work\n5') for entry in self.entries])
+        self.assertEqual((self.psa_group.answered_count, self.psa_group.failed_count), (3, 0))
+
+    def test_regenerate_discards_responses_and_leaderboard_rows(self):
+        for entry in self.entries:
+            AIResponse.objects.create(psa_entry=entry, ai_answer='4', is_correct=True)
+        PSAGroup.objects.filter(id=self.psa_group.id).update(status='completed', answered_count=3, graded_at=timezone.now())
+        LeaderboardEntry.record_score(PSAGroup.objects.get(id=self.psa_group.id))
+        with mock.patch('lastresort.management.commands.batch_generate.submit_ai_batch') as submit:
+            call_command('batch_generate', self.competition.id, '--regenerate', stdout=mock.Mock())
+        submit.delay.assert_called_once_with([self.psa_group.id])
+        self.assertFalse(AIResponse.objects.exists())
+        self.assertFalse(LeaderboardEntry.objects.filter(competition=self.competition).exists())
+        self.psa_group.refresh_from_db()
+        self.assertEqual((self.psa_group.status, self.psa_group.graded_at, self.psa_group.answered_count), ('accepted', None, 0))
+
+
+class TrackingStubBackend(StubBackend):
+    """Stub that records its peak concurrency, fails problems containing 'fail' and refuses 'flaky' ones once"""
+
+    def __init__(self):
+        self.in_flight = self.peak = 0
+        self.refused = set()
+
+    async def acomplete(self, prompt):
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        try:
+            await asyncio.sleep(0.01)
+            if 'fail' in prompt:
+                raise ValueError('Tracked failure')
+            if 'flaky' in prompt and prompt not in self.refused:
+                self.refused.add(prompt)
+                raise BackendUnavailable('Tracked transient failure')
+            return self._output(prompt)
+        finally:
+            self.in_flight -= 1
+
+
+@override_settings(
+    AI_BACKEND='stub', AI_STUB_ERROR_RATE=0, AI_RATE_LIMIT_RPM=0, AI_RATE_LIMIT_TPM=0, AI_MAX_RETRIES=1,
+    AI_ASYNC_CONCURRENCY=2, SOLUTION_CACHE_ENABLED=False, EVENTS_REDIS_URL=''
+)
+class AsyncGenerationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('async', password='password')
+        self.backend = TrackingStubBackend()
+
+    def generate(self, problems):
+        psa_group = PSAGroup.submit(self.user, None, [(problem, 'Solution', '1') for problem in problems])
+        with mock.patch('lastresort.tasks.load_backend', return_value=self.backend), \
+                mock.patch('lastresort.rate_limit.backoff_delay', return_value=0):
+            result = generate_ai_responses_async(psa_group.id)
+        psa_group.refresh_from_db()
+        return psa_group, result
+
+    def test_entries_are_solved_concurrently_within_the_limit(self):
+        psa_group, result = self.generate([f'Problem {number}' for number in range(5)])
+        self.assertEqual((result['created'], result['failed']), (5, 0))
+        self.assertEqual(self.backend.peak, 2)
+        self.assertEqual((psa_group.answered_count, psa_group.failed_count), (5, 0))
+        self.assertEqual(AIResponse.objects.filter(psa_entry__group=psa_group).count(), 5)
+        # Answered entries are skipped when the task runs again
+        with mock.patch('lastresort.tasks.load_backend', return_value=self.backend):
+            self.assertEqual(generate_ai_responses_async(psa_group.id)['created'], 0)
+
+    def test_transient_errors_are_retried_and_failures_counted(self):
+        psa_group, result = self.generate(['Problem flaky', 'Problem fail', 'Problem 3'])
+        self.assertEqual((result['created'], result['failed']), (2, 1))
+        self.assertEqual((psa_group.answered_count, psa_group.failed_count), (2, 1))
+        self.assertEqual(
+            set(AIResponse.objects.filter(psa_entry__group=psa_group).values_list('psa_entry__problem', flat=True)),
+            {'Problem flaky', 'Problem 3'}
+        )
+
+
+@skipUnless(fakeredis, 'fakeredis is not installed')
+@override_settings(AI_RATE_LIMIT_RPM=0, AI_RATE_LIMIT_TPM=0)
+class RateLimitTests(SimpleTestCase):
+    def setUp(self):
+        use_fake_redis(self)
+
+    def drain(self, key, tokens=0):
+        """Leave a bucket with this many tokens as of now"""
+        self.redis.hset(key, mapping={'tokens': tokens, 'ts': time.time()})
+
+    def test_disabled_without_limits(self):
+        with mock.patch.object(events, 'get_connection') as get_connection:
+            self.assertEqual(rate_limit.try_acquire(10 ** 6), 0)
+            self.assertEqual(asyncio.run(rate_limit.aacquire(10 ** 6)), 0)
+        get_connection.assert_not_called()
+
+    @override_settings(AI_RATE_LIMIT_RPM=2)
+    def test_requests_per_minute(self):
+        self.assertEqual([rate_limit.try_acquire(1) for _ in range(2)], [0, 0])
+        # Two requests a minute refill one every 30 seconds
+        self.assertAlmostEqual(rate_limit.try_acquire(1), 30, delta=1)
+
+    @override_settings(AI_RATE_LIMIT_TPM=120)
+    def test_tokens_per_minute(self):
+        self.assertEqual(rate_limit.try_acquire(100), 0)
+        self.assertAlmostEqual(rate_limit.try_acquire(50), 15, delta=1)
+        # A call larger than the whole quota waits for a full bucket instead of forever
+        self.drain(rate_limit.TOKENS_KEY, tokens=120)
+        self.assertEqual(rate_limit.try_acquire(500), 0)
+
+    @override_settings(AI_RATE_LIMIT_RPM=60)
+    def test_bucket_refills_with_time(self):
+        self.redis.hset(rate_limit.REQUESTS_KEY, mapping={'tokens': 0, 'ts': time.time() - 5})
+        self.assertEqual(rate_limit.try_acquire(1), 0)
+        self.assertAlmostEqual(float(self.redis.hget(rate_limit.REQUESTS_KEY, 'tokens')), 4, delta=0.5)
+
+    @override_settings(AI_RATE_LIMIT_RPM=60, AI_RATE_LIMIT_TPM=100)
+    def test_buckets_are_charged_together_or_not_at_all(self):
+        self.assertEqual(rate_limit.try_acquire(90), 0)
+        self.assertGreater(rate_limit.try_acquire(50), 0)
+        self.assertAlmostEqual(float(self.redis.hget(rate_limit.REQUESTS_KEY, 'tokens')), 59, delta=0.5)
+
+    @override_settings(AI_RATE_LIMIT_RPM=600, AI_RATE_LIMIT_MAX_WAIT=5)
+    def test_waits_are_recorded(self):
+        self.drain(rate_limit.REQUESTS_KEY)
+        waited = rate_limit.acquire(1)
+        self.assertGreater(waited, 0)
+        self.drain(rate_limit.REQUESTS_KEY)
+        with self.assertRaises(rate_limit.RateLimited):
+            rate_limit.acquire(1, max_wait=0)
+        stats = rate_limit.stats()
+        self.assertEqual(stats['waits'], 1)
+        self.assertAlmostEqual(stats['wait_seconds'], waited)
+
+    @override_settings(AI_RATE_LIMIT_RPM=600)
+    def test_async_waits_off_the_event_loop(self):
+        self.drain(rate_limit.REQUESTS_KEY)
+        callers = []
+        try_acquire = rate_limit.try_acquire
+
+        def tracked(tokens):
+            callers.append(threading.get_ident())
+            return try_acquire(tokens)
+
+        with mock.patch.object(rate_limit, 'try_acquire', tracked):
+            waited = asyncio.run(rate_limit.aacquire(1))
+        self.assertGreater(waited, 0)
+        self.assertGreaterEqual(len(callers), 2)
+        self.assertNotIn(threading.get_ident(), callers)
+        self.assertEqual(rate_limit.stats()['waits'], 1)
+
+
+@override_settings(AI_STUB_LATENCY=0, AI_STUB_ERROR_RATE=0, AI_STUB_ANSWER_RANGE=10)
+class ModelBackendTests(TestCase):
+    def test_stub_is_deterministic(self):
+        prompt = SOLUTION_PROMPT.format(problem='What is 2 + 2?')
+        output = StubBackend().complete(prompt)
+        self.assertEqual(StubBackend().complete(prompt), output)
+        self.assertIn(int(output.rsplit('\n', 1)[1]), range(10))
+        # Streaming yields the same output in pieces
+        self.assertEqual(''.join(StubBackend().stream(prompt)), output)
+        self.assertEqual(asyncio.run(StubBackend().acomplete(prompt)), output)
+
+    @override_settings(AI_STUB_ERROR_RATE=1)
+    def test_stub_injects_transient_failures(self):
+        with self.assertRaises(BackendUnavailable):
+            StubBackend().complete('What is 2 + 2?')
+
+    @override_settings(AI_BACKEND='stub')
+    def test_backend_is_chosen_by_setting(self):
+        self.addCleanup(model_backends._backends.clear)
+        self.assertIsInstance(model_backends.get_backend(), StubBackend)
+        self.assertIs(model_backends.get_backend(), model_backends.get_backend())
+        with self.assertRaises(ValueError):
+            model_backends.load_backend('other')
+
+    def test_recorded_responses_are_replayed(self):
+        user = User.objects.create_user('recorded', password='password')
+        psa_group = PSAGroup.submit(user, None, [('What is 2 + 2?', 'Solution', '4'), ('What is 2 + 3?', 'Solution', '5')])
+        for psa_entry in psa_group.psaentry_set.all():
+            AIResponse.objects.create(psa_entry=psa_entry, ai_solution=f'Worked on {psa_entry.problem}\n{psa_entry.answer}', ai_answer=psa_entry.answer)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'responses.jsonl')
+        call_command('record_ai_responses', output=path, stdout=mock.Mock())
+
+        backend = ReplayBackend(path)
+        prompt = SOLUTION_PROMPT.format(problem='What is 2 + 3?')
+        self.assertEqual(backend.complete(prompt), 'Worked on What is 2 + 3?\n5')
+        self.assertEqual(asyncio.run(backend.acomplete(f'  {prompt}\n')), 'Worked on What is 2 + 3?\n5')
+        with self.assertRaises(LookupError):
+            backend.complete(SOLUTION_PROMPT.format(problem='What is 2 + 5?'))
+
+
+class SyntheticDataTests(TestCase):
+    def test_generated_data_is_consistent(self):
+        counts = synthetic.generate(6, 3, 4, prefix='consistent')
+        self.assertEqual(counts['users'], 6)
+        self.assertEqual(counts['submissions'], PSAGroup.objects.filter(user__username__startswith='consistent-user-').count())
+        self.assertEqual(counts['entries'], PSAEntry.objects.filter(group__user__username__startswith='consistent-user-').count())
+        for psa_group in PSAGroup.objects.filter(user__username__startswith='consistent-user-').select_related('competition'):
+            responses = AIResponse.objects.filter(psa_entry__group=psa_group).count()
+            self.assertEqual(psa_group.entry_count, psa_group.competition.num_questions)
+            self.assertEqual((responses, psa_group.answered_count), (psa_group.entry_count, psa_group.entry_count) if psa_group.status == 'completed' else (0, 0))
+        # Each user's row is the one grading would have kept
+        rows = list(LeaderboardEntry.objects.filter(user__username__startswith='consistent-user-').values_list('competition_id', 'user_id', 'best_group_id'))
+        self.assertTrue(rows)
+        for competition_id, user_id, best_group_id in rows:
+            self.assertEqual(LeaderboardEntry.recompute(competition_id, user_id).best_group_id, best_group_id)
+
+    def test_seed_makes_data_reproducible(self):
+        synthetic.generate(2, 2, 2, prefix='first', seed=7)
+        synthetic.generate(2, 2, 2, prefix='second', seed=7)
+        answers = [
+            list(PSAEntry.objects.filter(group__user__username__startswith=f'{prefix}-user-').order_by('id').values_list('answer', flat=True))
+            for prefix in ('first', 'second')
+        ]
+        self.assertEqual(answers[0], answers[1])
+
+    def test_delete_only_removes_its_prefix(self):
+        synthetic.generate(2, 2, 2, prefix='kept')
+        synthetic.generate(2, 2, 2, prefix='removed')
+        synthetic.delete('removed')
+        self.assertFalse(User.objects.filter(username__startswith='removed-').exists())
+        self.assertFalse(Competition.objects.filter(name__startswith='removed-').exists())
+        self.assertEqual(User.objects.filter(username__startswith='kept-').count(), 2)
+        self.assertTrue(PSAGroup.objects.filter(user__username__startswith='kept-').exists())
+
+    @override_settings(CACHES=LOCMEM_CACHES, DATABASE_REPLICAS=[])
+    def test_benchmark_writes_every_view(self):
+        cache.clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'views.json')
+        call_command('benchmark_views', scales=[4], competitions=2, submissions=3, repeat=1, json_path=path, stdout=mock.Mock())
+        with open(path) as f:
+            report = json.load(f)
+        self.assertEqual([result['view'] for result in report['results']], VIEWS)
+        self.assertEqual({result['status'] for result in report['results']}, {200})
+        leaderboard = next(result for result in report['results'] if result['view'] == 'leaderboard')
+        # Warm requests are served from the fragment cache
+        self.assertLess(leaderboard['warm_queries'], leaderboard['cold_queries'])
+        # The generated data is removed again
+        self.assertFalse(Competition.objects.exists())
+
+
+@override_settings(PERFORMANCE_TRACKING_ENABLED=True, PERFORMANCE_BUDGET_RAISE=False, EVENTS_REDIS_URL='')
+class PerformanceTests(TestCase):
+    def recorded(self):
+        """(kind, name, queries, violated) of every sample recorded while the patch is active"""
+        samples = []
+        patcher = mock.patch.object(performance, '_record', lambda sample, total_ms, violated: samples.append(
+            (sample.kind, sample.name, sample.queries, violated)
+        ))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return samples
+
+    def test_nested_samples_count_their_own_queries(self):
+        samples = self.recorded()
+        with performance.track('task', 'outer') as outer:
+            User.objects.count()
+            with performance.track('task', 'inner') as inner:
+                User.objects.count()
+                User.objects.count()
+            User.objects.count()
+        self.assertEqual((outer.queries, inner.queries), (2, 2))
+        self.assertEqual(samples, [('task', 'inner', 2, False), ('task', 'outer', 2, False)])
+
+    def test_eager_task_is_tracked_apart_from_its_caller(self):
+        samples = self.recorded()
+        with performance.track('task', 'caller', {'queries': 0, 'ms': None}) as caller:
+            expire_competitions.apply()
+        self.assertEqual(caller.queries, 0)
+        self.assertEqual(samples, [('task', 'lastresort.tasks.expire_competitions', 1, False), ('task', 'caller', 0, False)])
+
+    def test_budget_violations(self):
+        samples = self.recorded()
+        with performance.track('task', 'over', {'queries': 1, 'ms': None}):
+            User.objects.count()
+            User.objects.count()
+        self.assertEqual(samples, [('task', 'over', 2, True)])
+        with override_settings(PERFORMANCE_BUDGET_RAISE=True), self.assertRaises(performance.BudgetExceeded):
+            with performance.track('task', 'over', {'queries': 1, 'ms': None}):
+                User.objects.count()
+                User.objects.count()
+
+    @override_settings(CACHES=LOCMEM_CACHES, DATABASE_REPLICAS=[])
+    def test_views_are_recorded_by_url_name(self):
+        cache.clear()
+        self.client.force_login(User.objects.create_user('tracked', password='password'))
+        samples = self.recorded()
+        self.client.get(reverse('lastresort:dashboard'))
+        self.assertEqual([sample[:2] for sample in samples], [('view', 'lastresort:dashboard')])
+        self.assertFalse(samples[0][3])
+
+
+def upload(name, content):
+    return SimpleUploadedFile(name, content.encode('utf-8'))
+
+
+class UploadFormTests(SimpleTestCase):
+    def clean(self, name, content, num_questions=2):
+        form = PSAUploadForm({}, {'file': upload(name, content)}, num_questions=num_questions)
+        return form.entries() if form.is_valid() else form.errors['file']
+
+    def test_csv(self):
+        # The byte order mark Excel writes is skipped, and quoted cells may hold commas and newlines
+        content = '\ufeffproblem,solution,answer\n"What is 1, plus 1?","One\nplus one",2\nWhat is 2 + 2?,Add,4\n'
+        self.assertEqual(self.clean('questions.CSV', content), [('What is 1, plus 1?', 'One\nplus one', '2'), ('What is 2 + 2?', 'Add', '4')])
+
+    def test_jsonl(self):
+        content = '{"question": "What is 1 + 1?", "solution": "Add", "answer": "2"}\n\n{"problem": "What is 2 + 2?", "solution": "Add", "answer": "4"}\n'
+        self.assertEqual(self.clean('questions.jsonl', content), [('What is 1 + 1?', 'Add', '2'), ('What is 2 + 2?', 'Add', '4')])
+
+    def test_invalid_files(self):
+        row = '{"problem": "P", "solution": "S", "answer": "A"}\n'
+        for name, content, error in [
+            ('questions.txt', row, 'Upload a .csv or .jsonl file.'),
+            ('questions.jsonl', row, 'The file has 1 questions; this competition asks for 2.'),
+            ('questions.jsonl', row * 3, 'The file has more than the 2 questions this competition asks for.'),
+            ('questions.jsonl', row + '[1, 2]\n', 'Row 2: expected an object with problem, solution and answer.'),
+            ('questions.jsonl', row + '{"problem": "P", "solution": "S"}\n', 'Row 2: answer: This field is required.'),
+            ('questions.jsonl', row + '{not json\n', 'Could not read the file'),
+            ('questions.csv', 'problem,solution,answer\nP,S,' + 'A' * 101 + '\nP,S,A\n', 'Row 1: answer: Ensure this value has at most 100 characters (it has 101).'),
+        ]:
+            with self.subTest(name=name, error=error):
+                errors = self.clean(name, content)
+                self.assertIsInstance(errors, list)
+                self.assertTrue(errors[0].startswith(error), errors)
+
+
+@override_settings(CACHES=LOCMEM_CACHES, DATABASE_REPLICAS=[])
+class SubmitUploadTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('uploader', password='password')
+        self.client.force_login(self.user)
+
+    def submit(self, num_questions, data):
+        competition = create_competition(num_questions=num_questions)
+        competition.user.add(self.user)
+        return competition, self.client.post(reverse('lastresort:submit', args=(competition.id,)), data)
+
+    def test_upload_creates_the_submission(self):
+        rows = ''.join(f'{{"problem": "Problem {number}", "solution": "S", "answer": "{number}"}}\n' for number in range(60))
+        competition, response = self.submit(60, {'file': upload('questions.jsonl', rows)})
+        self.assertRedirects(response, reverse('lastresort:competition', args=(competition.id,)))
+        psa_group = PSAGroup.objects.get(competition=competition)
+        self.assertEqual((psa_group.status, psa_group.entry_count, psa_group.psaentry_set.count()), ('pending', 60, 60))
+
+    def test_large_competition_keeps_the_question_form_hidden(self):
+        for data in [{}, {'file': upload('questions.jsonl', '{"problem": "P", "solution": "S", "answer": "A"}\n')}]:
+            with self.subTest(uploaded=bool(data)):
+                competition, response = self.submit(60, data)
+                self.assertEqual(response.status_code, 200)
+                self.assertIsNone(response.context['form'])
+                self.assertNotContains(response, 'name="question_0"')
+                self.assertTrue(response.context['upload_form'].errors)
+                self.assertFalse(PSAGroup.objects.filter(competition=competition).exists())
+
+    def test_small_competition_accepts_the_question_form(self):
+        data = {f'{field}_{number}': f'{field} {number}' for number in range(2) for field in ('question', 'solution', 'answer')}
+        competition, response = self.submit(2, data)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(PSAGroup.objects.get(competition=competition).entry_count, 2)
+
+    def test_failed_submit_leaves_nothing_behind(self):
+        rows = '{"problem": "P", "solution": "S", "answer": "A"}\n' * 2
+        with mock.patch('lastresort.models.PSAEntry.objects.bulk_create', side_effect=OperationalError('disk full')):
+            with self.assertRaises(OperationalError):
+                self.submit(2, {'file': upload('questions.jsonl', rows)})
+        self.assertFalse(PSAGroup.objects.exists())
+
+
+@override_settings(CACHES=LOCMEM_CACHES, DATABASE_REPLICAS=[])
+class AdminReviewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.competition = create_competition()
+        self.user = User.objects.create_user('reviewed', password='password')
+        self.pending = [PSAGroup.submit(self.user, self.competition, [('Problem', 'Solution', '1')]) for _ in range(3)]
+        self.accepted = PSAGroup.objects.create(name='accepted', user=self.user, competition=self.competition, status='accepted')
+        self.client.force_login(User.objects.create_user('reviewer', password='password', is_staff=True))
+        self.url = reverse('lastresort:admin_review', args=(self.competition.id,))
+
+    def review(self, data):
+        with mock.patch('lastresort.views.dispatch_ai_generation') as single, \
+                mock.patch('lastresort.views.dispatch_accepted_groups') as many, \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(self.url, data)
+        self.assertRedirects(response, self.url)
+        return single, many
+
+    def statuses(self):
+        return [psa_group.status for psa_group in PSAGroup.objects.filter(id__in=[psa_group.id for psa_group in self.pending]).order_by('id')]
+
+    def test_selected_submissions_are_accepted_together(self):
+        single, many = self.review({'action': 'accept', 'submission_ids': [self.pending[0].id, self.pending[2].id, self.accepted.id]})
+        self.assertEqual(self.statuses(), ['accepted', 'pending', 'accepted'])
+        # Already reviewed submissions are left alone and generation is queued once for the batch
+        many.delay.assert_called_once_with([self.pending[0].id, self.pending[2].id])
+        single.assert_not_called()
+
+    def test_single_submission_is_dispatched_directly(self):
+        single, many = self.review({'action': 'accept', 'submission_id': self.pending[1].id})
+        self.assertEqual(self.statuses(), ['pending', 'accepted', 'pending'])
+        single.assert_called_once_with(self.pending[1].id)
+        many.delay.assert_not_called()
+
+    def test_rejection_keeps_the_reason_and_dispatches_nothing(self):
+        single, many = self.review({'action': 'reject', 'reason': 'Duplicate', 'submission_ids': [self.pending[0].id, self.pending[1].id]})
+        self.assertEqual(self.statuses(), ['rejected', 'rejected', 'pending'])
+        self.assertEqual(PSAGroup.objects.get(id=self.pending[0].id).reason, 'Duplicate')
+        single.assert_not_called()
+        many.delay.assert_not_called()
+
+    def test_accept_all(self):
+        _, many = self.review({'action': 'accept_all'})
+        self.assertEqual(self.statuses(), ['accepted'] * 3)
+        many.delay.assert_called_once_with(sorted(psa_group.id for psa_group in self.pending))
+
+    def test_staff_only(self):
+        self.client.force_login(self.user)
+        response = self.client.post(self.url, {'action': 'accept_all'})
+        self.assertTemplateUsed(response, 'lastresort/access_denied.html')
+        self.assertEqual(self.statuses(), ['pending'] * 3)
+
+
+@override_settings(AI_DISPATCH_CONCURRENCY=2)
+class DispatchTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('dispatched', password='password')
+        self.competition = create_competition()
+        self.psa_group_ids = [
+            PSAGroup.submit(self.user, self.competition, [(f'Problem {number}', 'Solution', '1') for number in range(2)]).id
+            for _ in range(5)
+        ]
+
+    def lanes(self):
+        """The signatures of each lane that dispatch_accepted_groups queued"""
+        with mock.patch('lastresort.tasks.chain') as chain:
+            dispatch_accepted_groups(self.psa_group_ids)
+        self.assertEqual(chain.return_value.delay.call_count, len(chain.call_args_list))
+        return [call.args for call in chain.call_args_list]
+
+    @override_settings(AI_EXECUTION_MODE='async')
+    def test_async_lanes_bound_the_concurrency(self):
+        lanes = self.lanes()
+        self.assertEqual(len(lanes), 2)
+        first_tasks = [[signature.tasks[0] for signature in lane] for lane in lanes]
+        self.assertEqual(
+            [[signature.args[0] for signature in lane] for lane in first_tasks],
+            [self.psa_group_ids[0::2], self.psa_group_ids[1::2]]
+        )
+        self.assertEqual({signature.task for lane in first_tasks for signature in lane}, {'lastresort.tasks.generate_ai_responses_async'})
+
+    @override_settings(AI_EXECUTION_MODE='realtime')
+    def test_realtime_groups_keep_their_per_entry_tasks(self):
+        lanes = self.lanes()
+        self.assertEqual(len(lanes), 2)
+        for lane, psa_group_ids in zip(lanes, [self.psa_group_ids[0::2], self.psa_group_ids[1::2]]):
+            for group_chord, psa_group_id in zip(lane, psa_group_ids):
+                entry_ids = list(PSAEntry.objects.filter(group_id=psa_group_id).order_by('id').values_list('id', flat=True))
+                # One task per entry, so viewers watch each solution stream in, then the group is completed
+                self.assertEqual([(task.task, task.args) for task in group_chord.tasks], [
+                    ('lastresort.tasks.generate_single_ai_response', (psa_group_id, entry_id)) for entry_id in entry_ids
+                ])
+                self.assertEqual((group_chord.body.task, group_chord.body.args), ('lastresort.tasks.mark_submission_completed', (psa_group_id,)))
+
+    @override_settings(AI_EXECUTION_MODE='batch')
+    def test_batch_mode_sends_single_sample_groups_in_one_job(self):
+        multi = create_competition(samples_per_entry=3)
+        multi_sample_id = PSAGroup.submit(self.user, multi, [('Problem', 'Solution', '1')]).id
+        self.psa_group_ids.append(multi_sample_id)
+        with mock.patch('lastresort.tasks.submit_ai_batch', return_value='batch-1') as submit:
+            lanes = self.lanes()
+        submit.assert_called_once_with(self.psa_group_ids[:5])
+        # Multi-sample groups can stop early, which a batch job cannot
+        self.assertEqual([[signature.tasks[0].args[0] for signature in lane] for lane in lanes], [[multi_sample_id]])
+
+    def test_single_group_dispatch_per_mode(self):
+        psa_group_id = self.psa_group_ids[0]
+        for mode, task in [('realtime', 'generate_ai_responses'), ('async', 'generate_ai_responses_async'), ('batch', 'submit_ai_batch')]:
+            with self.subTest(mode=mode), override_settings(AI_EXECUTION_MODE=mode), \
+                    mock.patch.object(Task, 'apply_async', autospec=True) as apply_async:
+                dispatch_ai_generation(psa_group_id)
+                self.assertEqual([call.args[0].name for call in apply_async.call_args_list], [f'lastresort.tasks.{task}'])
+
+
+@override_settings(CACHES=LOCMEM_CACHES, DATABASE_REPLICAS=[])
+class ExportTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.competition = create_competition()
+        self.user = User.objects.create_user('exported', password='password')
+        self.psa_group = PSAGroup.submit(self.user, self.competition, [
+            ('What is "one", plus\none?', 'Add, then check', '2'),
+            ('Unanswered', 'Solution', '3'),
+        ])
+        PSAGroup.objects.filter(id=self.psa_group.id).update(status='completed', score=50, graded_at=timezone.now())
+        self.answered, self.unanswered = self.psa_group.psaentry_set.order_by('id')
+        AIResponse.objects.create(psa_entry=self.answered, ai_solution='Ünïcode, "quoted"\n2', ai_answer='2', is_correct=True)
+        self.client.force_login(User.objects.create_user('exporter', password='password', is_staff=True))
+
+    def export(self, export_format, extension=None):
+        response = self.client.get(reverse('lastresort:export_competition', args=(self.competition.id,)), {'format': export_format})
+        filename = f'competition_{self.competition.id}.{extension or export_format}'
+        self.assertEqual(response['Content-Disposition'], f'attachment; filename="{filename}"')
+        return response, b''.join(response.streaming_content).decode('utf-8')
+
+    def test_csv_escapes_every_field(self):
+        response, content = self.export('csv')
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        header, *rows = list(csv.reader(io.StringIO(content)))
+        self.assertEqual(header, list(EXPORT_FIELDS))
+        answered, unanswered = (dict(zip(header, row)) for row in rows)
+        self.assertEqual(
+            (answered['problem'], answered['solution'], answered['ai_solution'], answered['is_correct'], answered['score']),
+            ('What is "one", plus\none?', 'Add, then check', 'Ünïcode, "quoted"\n2', 'True', '50')
+        )
+        self.assertEqual((unanswered['entry_id'], unanswered['ai_answer'], unanswered['ai_solution']), (str(self.unanswered.id), '', ''))
+
+    def test_jsonl_has_one_object_per_entry(self):
+        response, content = self.export('jsonl')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual([list(row) for row in rows], [list(EXPORT_FIELDS)] * 2)
+        self.assertEqual(
+            (rows[0]['problem'], rows[0]['ai_solution'], rows[0]['is_correct'], rows[0]['username']),
+            ('What is "one", plus\none?', 'Ünïcode, "quoted"\n2', True, 'exported')
+        )
+        self.assertEqual((rows[1]['ai_answer'], rows[1]['is_correct'], rows[1]['ai_solution']), (None, None, ''))
+
+    def test_unknown_format_falls_back_to_csv(self):
+        _, content = self.export('xml', extension='csv')
+        self.assertTrue(content.startswith(','.join(EXPORT_FIELDS)))
+
+    def test_exports_are_restricted(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('lastresort:export_competition', args=(self.competition.id,)))
+        self.assertTemplateUsed(response, 'lastresort/access_denied.html')
+        # A user downloads their own submission in the same formats
+        response = self.client.get(reverse('lastresort:download_submission', args=(self.psa_group.id,)), {'format': 'jsonl'})
+        self.assertEqual(len(b''.join(response.streaming_content).decode('utf-8').splitlines()), 2)
+
+
+class SchemaTests(TestCase):
+    def test_status_is_constrained(self):
+        user = User.objects.create_user('constrained', password='password')
+        with self.assertRaises(IntegrityError):
+            PSAGroup.objects.create(name='invalid', user=user, status='archived')
+
+    def test_hot_queries_have_indexes(self):
+        with connection.cursor() as cursor:
+            names = {
+                name for table in ('lastresort_psagroup', 'lastresort_competition', 'lastresort_airesponse')
+                for name in connection.introspection.get_constraints(cursor, table)
+            }
+        self.assertLessEqual({
+            'psagroup_comp_status_idx', 'psagroup_valid_status', 'airesponse_entry_correct_idx',
+            'competition_active_pub_idx', 'competition_active_end_idx',
+        }, names)
+
+
+class ConcurrentIndexTests(TransactionTestCase):
+    def test_indexes_are_built_concurrently_on_postgres(self):
+        module = import_module('lastresort.migrations.0006_schema_performance')
+        self.assertFalse(module.Migration.atomic)
+        state = MigrationExecutor(connection).loader.project_state(('lastresort', '0005_aibatchjob'))
+        with connection.schema_editor(collect_sql=True, atomic=False) as editor:
+            for operation in module.Migration.operations:
+                new_state = state.clone()
+                operation.state_forwards('lastresort', new_state)
+                if isinstance(operation, module.AddIndexConcurrently):
+                    operation.database_forwards('lastresort', editor, state, new_state)
+                state = new_state
+        statements = [sql for sql in editor.collected_sql if 'CREATE INDEX' in sql]
+        self.assertEqual(len(statements), 6)
+        self.assertEqual({'CONCURRENTLY' in sql for sql in statements}, {connection.vendor == 'postgresql'})
+
+
+@skipUnless(fakeredis, 'fakeredis is not installed')
+@override_settings(AI_STREAM_FLUSH_INTERVAL=0.5)
+class PartialSolutionTests(SimpleTestCase):
+    def setUp(self):
+        use_fake_redis(self)
+        self.clock = 100.0
+        for patcher in [
+            mock.patch.object(events.time, 'monotonic', lambda: self.clock),
+            mock.patch.object(events, 'publish_group_event'),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.partial = events.PartialSolution(psa_group_id=1, psa_entry_id=2)
+
+    def stored(self):
+        text = self.redis.get(events.partial_key(2))
+        return text.decode('utf-8') if text is not None else None
+
+    def published(self):
+        return [call.kwargs for call in events.publish_group_event.call_args_list]
+
+    def test_pieces_are_flushed_once_per_interval(self):
+        self.partial.write('Let')
+        self.partial.write(' us')
+        self.clock += 0.4
+        self.partial.write(' add')
+        self.assertIsNone(self.stored())
+        self.clock += 0.1
+        self.partial.write(' 2')
+        self.assertEqual(self.stored(), 'Let us add 2')
+        self.assertEqual(self.published(), [{'psa_entry_id': 2, 'offset': 0, 'delta': 'Let us add 2'}])
+        self.partial.write(' and 2')
+        self.partial.flush()
+        self.assertEqual(self.stored(), 'Let us add 2 and 2')
+        self.assertEqual(self.published()[-1], {'psa_entry_id': 2, 'offset': 12, 'delta': ' and 2'})
+        self.assertGreater(self.redis.ttl(events.partial_key(2)), 0)
+
+    def test_offsets_count_utf16_code_units(self):
+        # The emoji is one code point but two UTF-16 code units, as JavaScript measures strings
+        for delta in ['π≈3 😀', '!', 'é']:
+            self.partial.write(delta)
+            self.partial.flush()
+        self.assertEqual([event['offset'] for event in self.published()], [0, 6, 7])
+        self.assertEqual(self.stored(), 'π≈3 😀!é')
+
+    def test_a_retry_starts_over(self):
+        self.redis.set(events.partial_key(2), 'Left by a failed attempt')
+        self.partial.write('Fresh')
+        self.partial.flush()
+        self.assertEqual(self.stored(), 'Fresh')
+
+    def test_nothing_pending_publishes_nothing(self):
+        self.partial.flush()
+        self.assertEqual(self.published(), [])
+
+    def test_clear_drops_the_stored_text(self):
+        self.partial.write('Done')
+        self.partial.flush()
+        self.partial.write(' unsent')
+        self.partial.clear()
+        self.assertIsNone(self.stored())
+        self.assertEqual(self.partial.pending, [])
+
+
+@override_settings(CACHES=LOCMEM_CACHES, DATABASE_REPLICAS=[])
+class FragmentInvalidationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('fragmented', password='password')
+
+    def answered_group(self, entries):
+        psa_group = PSAGroup.submit(self.user, None, [(f'Problem {number}', 'Solution', '1') for number in range(entries)])
+        AIResponse.objects.bulk_create([
+            AIResponse(psa_entry=psa_entry, ai_solution='Solution\n1', ai_answer='1', is_correct=True) for psa_entry in psa_group.psaentry_set.all()
+        ])
+        PSAGroup.objects.filter(id=psa_group.id).update(answered_count=entries)
+        return psa_group
+
+    def delete_queries(self, delete):
+        with CaptureQueriesContext(connections['default']) as queries:
+            delete()
+        return len(queries)
+
+    def test_deleting_responses_does_not_query_per_row(self):
+        counts = [
+            self.delete_queries(AIResponse.objects.filter(psa_entry__group=self.answered_group(entries)).delete)
+            for entries in (3, 9)
+        ]
+        self.assertEqual(counts[0], counts[1])
+
+    def test_synthetic_delete_does_not_query_per_row(self):
+        synthetic.generate(20, 2, 3, prefix='bulk')
+        responses = AIResponse.objects.count()
+        # Rows go in batched DELETEs, without looking up each response's group
+        self.assertLess(self.delete_queries(lambda: synthetic.delete('bulk')), responses / 10)
+
+    def test_admin_deletes_bump_the_groups(self):
+        psa_group = self.answered_group(3)
+        scopes = fragments.group_scopes(psa_group.id, None, self.user.id)
+        before = fragments.versions(scopes)
+        model_admin = admin.site._registry[AIResponse]
+        request = RequestFactory().post('/')
+        deleted = list(AIResponse.objects.filter(psa_entry__group=psa_group).values_list('id', flat=True)[:2])
+        with self.captureOnCommitCallbacks(execute=True):
+            model_admin.delete_queryset(request, AIResponse.objects.filter(id__in=deleted))
+        after = fragments.versions(scopes)
+        self.assertTrue(all(new > old for old, new in zip(before, after)))
+        self.assertEqual(PSAGroup.objects.get(id=psa_group.id).answered_count, 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            model_admin.delete_model(request, AIResponse.objects.get(psa_entry__group=psa_group))
+        self.assertGreater(fragments.versions(scopes)[0], after[0])
+        self.assertEqual(PSAGroup.objects.get(id=psa_group.id).answered_count, 0)
+
+    def test_saved_response_bumps_its_group(self):
+        psa_group = self.answered_group(1)
+        before = fragments.versions([f'group:{psa_group.id}'])
+        with self.captureOnCommitCallbacks(execute=True):
+            AIResponse.objects.create(psa_entry=psa_group.psaentry_set.get(), ai_answer='2')
+        self.assertGreater(fragments.versions([f'group:{psa_group.id}']), before)
+
+
+class FailingStubBackend(StubBackend):
+    """Stub whose synchronous calls fail for problems containing 'fail'"""
+
+    def complete(self, prompt):
+        if 'fail' in prompt:
+            raise ValueError('Stub failure')
+        return super().complete(prompt)
+
+
+@override_settings(
+    AI_BACKEND='stub', AI_STUB_LATENCY=0, AI_STUB_ERROR_RATE=0, AI_RATE_LIMIT_RPM=0, AI_RATE_LIMIT_TPM=0, AI_MAX_RETRIES=0,
+    AI_EXECUTION_MODE='realtime', SOLUTION_CACHE_ENABLED=False, EVENTS_REDIS_URL='',
+    CELERY_TASK_ALWAYS_EAGER=True, CELERY_TASK_EAGER_PROPAGATES=True
+)
+class PipelineTests(TestCase):
+    """The realtime pipeline end to end, with Celery running every task in this process"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('pipeline', password='password')
+        patcher = mock.patch('lastresort.models.get_backend', return_value=FailingStubBackend())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def submit(self, problems):
+        psa_group = PSAGroup.submit(self.user, None, [(problem, 'Solution', '1') for problem in problems])
+        PSAGroup.objects.filter(id=psa_group.id).update(status='accepted')
+        return psa_group
+
+    def generate(self, psa_group):
+        with mock.patch('lastresort.tasks.publish_group_event') as publish:
+            generate_ai_responses(psa_group.id)
+        psa_group.refresh_from_db()
+        return [call.args[1] for call in publish.call_args_list]
+
+    def test_group_completes_once_every_entry_is_answered(self):
+        psa_group = self.submit(['Problem 1', 'Problem 2', 'Problem 3'])
+        events_published = self.generate(psa_group)
+        self.assertEqual((psa_group.answered_count, psa_group.failed_count, psa_group.entry_count), (3, 0, 3))
+        self.assertEqual(psa_group.status, 'completed')
+        self.assertIsNotNone(psa_group.graded_at)
+        self.assertEqual(events_published, ['response'] * 3 + ['complete'])
+        # Completing again, as a redelivered callback would, grades nothing twice
+        with mock.patch('lastresort.tasks.publish_group_event') as publish:
+            mark_submission_completed([], psa_group.id)
+        self.assertFalse(publish.called)
+        self.assertEqual(PSAGroup.objects.get(id=psa_group.id).graded_at, psa_group.graded_at)
+
+    def test_failed_entries_leave_the_group_incomplete_until_retried(self):
+        psa_group = self.submit(['Problem 1', 'Problem fail', 'Problem 3'])
+        self.assertEqual(self.generate(psa_group), ['response', 'response', 'incomplete'])
+        self.assertEqual((psa_group.answered_count, psa_group.failed_count), (2, 1))
+        self.assertEqual(psa_group.status, 'accepted')
+        self.assertIsNone(psa_group.graded_at)
+
+        # A retry only runs the unanswered entry, starting its failures from zero
+        PSAEntry.objects.filter(group=psa_group, problem='Problem fail').update(problem='Problem 2')
+        retry = _entry_chord(psa_group.id)
+        self.assertEqual(len(retry.tasks), 1)
+        self.assertEqual(PSAGroup.objects.get(id=psa_group.id).failed_count, 0)
+        self.assertEqual(self.generate(psa_group), ['response', 'complete'])
+        self.assertEqual((psa_group.answered_count, psa_group.failed_count, psa_group.status), (3, 0, 'completed'))
+
+    def test_answered_group_is_completed_without_entry_tasks(self):
+        psa_group = self.submit(['Problem 1'])
+        self.generate(psa_group)
+        PSAGroup.objects.filter(id=psa_group.id).update(failed_count=2)
+        signature = _entry_chord(psa_group.id)
+        self.assertEqual((signature.task, signature.args), ('lastresort.tasks.mark_submission_completed', ([], psa_group.id)))
+        self.assertEqual(PSAGroup.objects.get(id=psa_group.id).failed_count, 0)
+
+    def test_progress_is_counted_and_recounted(self):
+        psa_group = self.submit(['Problem 1', 'Problem 2', 'Problem 3'])
+        PSAGroup.record_progress(psa_group.id, answered=2)
+        PSAGroup.record_progress(psa_group.id, failed=1)
+        psa_group.refresh_from_db()
+        self.assertEqual((psa_group.answered_count, psa_group.failed_count), (2, 1))
+        self.assertTrue(psa_group.generation_finished())
+
+        AIResponse.objects.create(psa_entry=psa_group.psaentry_set.first(), ai_answer='1')
+        PSAGroup.recount_progress([psa_group.id])
+        self.assertEqual(PSAGroup.objects.get(id=psa_group.id).answered_count, 1)
+        AIResponse.objects.filter(psa_entry__group=psa_group).delete()
+        PSAGroup.recount_progress([psa_group.id])
+        self.assertEqual(PSAGroup.objects.get(id=psa_group.id).answered_count, 0)
+
+    def test_regenerate_resets_the_counters(self):
+        competition = create_competition()
+        psa_group = self.submit(['Problem 1', 'Problem 2'])
+        PSAGroup.objects.filter(id=psa_group.id).update(competition=competition)
+        self.generate(psa_group)
+        PSAGroup.objects.filter(id=psa_group.id).update(failed_count=1)
+        with mock.patch('lastresort.tasks.submit_ai_batch.delay'):
+            call_command('batch_generate', competition.id, '--regenerate', stdout=io.StringIO())
+        psa_group.refresh_from_db()
+        self.assertEqual((psa_group.answered_count, psa_group.failed_count, psa_group.status, psa_group.graded_at), (0, 0, 'accepted', None))
+        self.assertFalse(psa_group.generation_finished())
+        # Generated again, the group completes from its new responses
+        self.assertEqual(self.generate(psa_group)[-1], 'complete')
+        self.assertEqual((psa_group.answered_count, psa_group.status), (2, 'completed'))
+
+
+@override_settings(METRICS_ENABLED=True, EVENTS_REDIS_URL='', CELERY_BROKER_URL='memory://', DEBUG=False)
+class MetricsViewTests(TestCase):
+    def setUp(self):
+        self.url = reverse('metrics')
+        PSAGroup.objects.create(name='waiting', user=User.objects.create_user('waiting', password='password'), competition=create_competition())
+
+    def test_without_a_token_only_staff_may_read(self):
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+        self.client.force_login(User.objects.create_user('visitor', password='password'))
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+        self.client.force_login(User.objects.create_user('operator', password='password', is_staff=True))
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], metrics.CONTENT_TYPE)
+        self.assertIn('lastresort_pending_reviews{competition=', response.content.decode())
+
+    def test_debug_opens_it_without_a_token(self):
+        with override_settings(DEBUG=True):
+            self.assertEqual(self.client.get(self.url).status_code, 200)
+
+    @override_settings(METRICS_TOKEN='scrape-secret')
+    def test_token_is_required_once_set(self):
+        self.assertEqual(self.client.get(self.url, HTTP_AUTHORIZATION='Bearer scrape-secret').status_code, 200)
+        self.assertEqual(self.client.get(self.url, HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+        # With a token set, staff sessions and DEBUG no longer open it
+        self.client.force_login(User.objects.create_user('operator', password='password', is_staff=True))
+        with override_settings(DEBUG=True):
+            self.assertEqual(self.client.get(self.url).status_code, 403)
+
+    @skipUnless(fakeredis, 'fakeredis is not installed')
+    def test_flushed_counters_are_rendered(self):
+        use_fake_redis(self)
+        metrics.flush()
+        metrics.inc('lastresort_model_calls_total', 2, backend='stub', outcome='ok')
+        metrics.flush()
+        self.client.force_login(User.objects.create_user('operator', password='password', is_staff=True))
+        body = self.client.get(self.url).content.decode()
+        self.assertIn('lastresort_model_calls_total{backend="stub",outcome="ok"} 2.0\n', body)
+
+
+class QueueRoutingTests(SimpleTestCase):
+    def queue(self, task_name):
+        return current_app.amqp.router.route({}, task_name)['queue'].name
+
+    def test_model_calls_go_to_the_model_queue(self):
+        for task_name in settings.CELERY_TASK_ROUTES:
+            with self.subTest(task=task_name):
+                self.assertIn(task_name, current_app.tasks)
+                self.assertEqual(self.queue(task_name), settings.CELERY_MODEL_QUEUE)
+
+    def test_bookkeeping_stays_on_the_default_queue(self):
+        for task_name in [
+            'lastresort.tasks.generate_ai_responses', 'lastresort.tasks.mark_submission_completed', 'lastresort.tasks.grade_submission',
+            'lastresort.tasks.expire_competitions', 'lastresort.tasks.evict_solution_cache',
+        ]:
+            with self.subTest(task=task_name):
+                self.assertEqual(self.queue(task_name), settings.CELERY_TASK_DEFAULT_QUEUE)
+
+    def test_sent_messages_carry_their_queue(self):
+        with mock.patch.object(current_app.amqp, 'send_task_message') as send:
+            generate_single_ai_response.delay(1, 2)
+            grade_submission.delay(1)
+        self.assertEqual(
+            [(call.args[2].headers['task'], call.kwargs['queue'].name) for call in send.call_args_list],
+            [('lastresort.tasks.generate_single_ai_response', 'model'), ('lastresort.tasks.grade_submission', 'celery')]
+        )
+
+    def test_compose_files_run_a_worker_per_queue(self):
+        for name in ['docker-compose.yml', 'docker-compose.prod.yml']:
+            with self.subTest(file=name), open(os.path.join(settings.BASE_DIR, name)) as f:
+                workers = [line.split('command: ', 1)[1] for line in f if 'command: celery -A website worker' in line]
+            self.assertEqual(len(workers), 2)
+            bookkeeping, model = workers
+            self.assertIn('-Q celery --pool prefork', bookkeeping)
+            self.assertIn('-Q ${CELERY_MODEL_QUEUE:-model} --pool threads', model)
+
+
+class StartupTests(SimpleTestCase):
+    def setUp(self):
+        patcher = mock.patch.object(model_backends, '_openai_client', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_openai_client_is_created_on_first_use_and_reused(self):
+        openai = mock.Mock()
+        with mock.patch.dict('sys.modules', {'openai': openai}):
+            client = model_backends.openai_client()
+            self.assertIs(model_backends.openai_client(), client)
+            self.assertEqual(openai.OpenAI.call_count, 1)
+            # A forked worker child starts over with its own connections
+            model_backends._forget_openai_client()
+            model_backends.openai_client()
+        self.assertEqual(openai.OpenAI.call_count, 2)
+
+    def test_setup_does_not_import_the_model_clients(self):
+        code = 'import sys, django; django.setup(); import lastresort.tasks, lastresort.views; print(sorted(set(sys.modules) & {"openai", "httpx"}))'
+        result = subprocess.run([sys.executable, '-c', code], env=dict(os.environ), check=True, capture_output=True, text=True)
+        self.assertEqual(result.stdout.strip(), '[]')
+
+    def test_import_times_are_parsed(self):
+        output = '\n'.join([
+            'import time: self [us] | cumulative | imported package',
+            'import time:       120 |        450 |   encodings',
+            'import time:      2000 |      52000 | openai',
+            'import time:        90 |         90 |     openai._types',
+        ])
+        self.assertEqual(list(check_startup.import_times(output)), [('  encodings', 0.45), ('openai', 52), ('    openai._types', 0.09)])
+
+    def test_startup_check_reports_slow_and_eager_imports(self):
+        profile = SimpleNamespace(stderr='import time:      2000 |      52000 | openai\nimport time:        90 |         90 |   httpx._api\n')
+        stdout = io.StringIO()
+        with mock.patch.object(check_startup.subprocess, 'run', return_value=profile) as run, \
+                self.assertRaisesMessage(CommandError, 'imported during setup: httpx, openai'):
+            call_command('check_startup', runs=2, budget_ms=0, stdout=stdout)
+        self.assertEqual(run.call_count, 3)
+        self.assertIn('ms  openai', stdout.getvalue())
+
+    def test_startup_check_passes_within_the_budget(self):
+        stdout = io.StringIO()
+        call_command('check_startup', runs=1, budget_ms=60000, stdout=stdout)
+        self.assertIn('Startup check passed', stdout.getvalue())
+
+
+class SolutionStorageTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user('stored', password='password')
+        self.psa_group = PSAGroup.submit(user, None, [(f'Problem {number}', 'Solution', '1') for number in range(4)])
+        self.psa_entries = list(self.psa_group.psaentry_set.order_by('id'))
+
+    def test_solution_round_trips_through_zlib(self):
+        text = 'Étape 1: 2 + 2 = 4 ✓\n' * 200 + '4'
+        ai_response = AIResponse.objects.create(psa_entry=self.psa_entries[0], ai_solution=text, ai_answer='4')
+        stored = AISolution.objects.get(ai_response=ai_response)
+        self.assertLess(len(stored.compressed_text), len(text.encode('utf-8')) / 10)
+        self.assertEqual(AIResponse.objects.get(id=ai_response.id).ai_solution, text)
+        loaded = AIResponse.objects.select_related('solution').get(id=ai_response.id)
+        with self.assertNumQueries(0):
+            self.assertEqual(loaded.ai_solution, text)
+        # Saving a new solution replaces the stored one
+        loaded.ai_solution = 'Revised\n5'
+        loaded.save()
+        self.assertEqual(AIResponse.objects.get(id=ai_response.id).ai_solution, 'Revised\n5')
+        self.assertEqual(AISolution.objects.count(), 1)
+
+    def test_response_without_a_solution_reads_empty(self):
+        ai_response = AIResponse.objects.create(psa_entry=self.psa_entries[0], ai_answer='4')
+        self.assertFalse(AISolution.objects.exists())
+        self.assertEqual(AIResponse.objects.get(id=ai_response.id).ai_solution, '')
+
+    def test_bulk_create_stores_solutions_in_one_insert(self):
+        def create(psa_entries):
+            with CaptureQueriesContext(connections['default']) as queries:
+                created = AIResponse.objects.bulk_create([
+                    AIResponse(psa_entry=psa_entry, ai_solution=f'Worked on {psa_entry.problem}\n1', ai_answer='1') for psa_entry in psa_entries
+                ])
+            return created, [query['sql'].split()[2] for query in queries.captured_queries if query['sql'].startswith('INSERT')]
+        created, inserts = create(self.psa_entries[:1])
+        self.assertEqual(create(self.psa_entries[1:])[1], inserts)
+        self.assertEqual(inserts, ['"lastresort_airesponse"', '"lastresort_aisolution"'])
+        self.assertFalse(created[0]._ai_solution_changed)
+        self.assertEqual(
+            [ai_response.ai_solution for ai_response in AIResponse.objects.select_related('solution').order_by('id')],
+            [f'Worked on Problem {number}\n1' for number in range(4)]
+        )
+
+
+class SolutionMigrationTests(TransactionTestCase):
+    before = [('lastresort', '0007_psagroup_progress')]
+    after = [('lastresort', '0008_aisolution')]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes('lastresort'))
+
+    def test_solutions_are_moved_and_restored(self):
+        texts = [f'Solution {number} ✓\n{number}' for number in range(5)]
+        apps = self.migrate(self.before)
+        user = apps.get_model('auth', 'User').objects.create(username='migrated')
+        psa_group = apps.get_model('lastresort', 'PSAGroup').objects.create(name='migrated', user=user)
+        psa_entry = apps.get_model('lastresort', 'PSAEntry').objects.create(group=psa_group, problem='Problem', solution='', answer='1')
+        ids = [
+            apps.get_model('lastresort', 'AIResponse').objects.create(psa_entry=psa_entry, ai_solution=text, ai_answer='1').id
+            for text in texts
+        ]
+
+        # A small chunk size makes the migration write several batches
+        with mock.patch.object(import_module('lastresort.migrations.0008_aisolution'), 'CHUNK_SIZE', 2):
+            apps = self.migrate(self.after)
+            solutions = dict(apps.get_model('lastresort', 'AISolution').objects.values_list('ai_response_id', 'compressed_text'))
+            self.assertEqual({ai_response_id: AISolution.decompress(data) for ai_response_id, data in solutions.items()}, dict(zip(ids, texts)))
+
+            apps = self.migrate(self.before)
+            restored = dict(apps.get_model('lastresort', 'AIResponse').objects.values_list('id', 'ai_solution'))
+        self.assertEqual(restored, dict(zip(ids, texts)))
+
+
+@override_settings(CACHES=LOCMEM_CACHES, DATABASE_REPLICAS=[])
+class PastCompetitionsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('veteran', password='password')
+        self.competitions = [create_competition(name=f'Past {number}') for number in range(40)]
+        for number, competition in enumerate(self.competitions):
+            Competition.objects.filter(id=competition.id).update(end_date=timezone.now() - timedelta(hours=number + 1))
+        # Every fourth one is the user's own, listed apart from the past ones
+        self.user.competitions.add(*self.competitions[::4])
+        self.url = reverse('lastresort:dashboard')
+
+    def pages(self, user):
+        self.client.force_login(user)
+        response = self.client.get(self.url)
+        pages = [[competition.id for competition in response.context['past_competitions']]]
+        cursor = response.context['next_cursor']
+        while cursor:
+            response = self.client.get(self.url, {'cursor': cursor}, HTTP_HX_REQUEST='true')
+            self.assertTemplateUsed(response, 'lastresort/past_competitions_partial.html')
+            pages.append([competition.id for competition in response.context['past_competitions']])
+            cursor = response.context['next_cursor']
+        return pages
+
+    def test_own_competitions_are_left_out_before_paging(self):
+        pages = self.pages(self.user)
+        self.assertEqual([len(page) for page in pages], [24, 6])
+        others = [competition.id for number, competition in enumerate(self.competitions) if number % 4]
+        self.assertEqual(sum(pages, []), others)
+
+    def test_pages_are_cached_per_user(self):
+        self.pages(self.user)
+        # Another user's pages still hold every past competition
+        self.assertEqual([len(page) for page in self.pages(User.objects.create_user('newcomer', password='password'))], [24, 16])
+        # Joining one more takes it out of the user's cached pages
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.competitions.add(self.competitions[1])
+        pages = self.pages(self.user)
+        self.assertEqual([len(page) for page in pages], [24, 5])
+        self.assertNotIn(self.competitions[1].id, sum(pages, []))
+
+
+class CursorTests(TestCase):
+    def test_round_trip(self):
+        moment = timezone.now().replace(microsecond=123456)
+        self.assertEqual(decode_cursor(encode_cursor(moment, 42)), (moment, 42))
+
+    def test_invalid_cursors(self):
+        for cursor in (None, '', 'abc', '123', '123-', '-5', '12.5-3', '1-2-3', '123-x', f'{10 ** 30}-1', '1e6-1'):
+            with self.subTest(cursor=cursor):
+                self.assertIsNone(decode_cursor(cursor))
+
+
+class KeysetPageTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('keyset', password='password')
+        self.competition = create_competition()
+        self.moment = timezone.now()
+        # Five groups share one pub_date, so only the id tiebreak separates them
+        self.groups = [PSAGroup.objects.create(name='keyset', competition=self.competition, user=self.user) for _ in range(7)]
+        PSAGroup.objects.filter(id__in=[group.id for group in self.groups[:5]]).update(pub_date=self.moment)
+        PSAGroup.objects.filter(id__in=[group.id for group in self.groups[5:]]).update(pub_date=self.moment - timedelta(hours=1))
+
+    def pages(self, size):
+        pages, cursor = [], None
+        while True:
+            rows, cursor = keyset_page(PSAGroup.objects.filter(competition=self.competition), 'pub_date', cursor, size)
+            pages.append([row.id for row in rows])
+            if cursor is None:
+                return pages
+
+    def newest_first(self):
+        ids = [group.id for group in self.groups]
+        return sorted(ids[:5], reverse=True) + sorted(ids[5:], reverse=True)
+
+    def test_ties_are_split_by_id(self):
+        for size in (1, 2, 3, 7):
+            with self.subTest(size=size):
+                pages = self.pages(size)
+                self.assertEqual(sum(pages, []), self.newest_first())
+                self.assertTrue(all(len(page) == size for page in pages[:-1]))
+
+    def test_exact_last_page_has_no_cursor(self):
+        rows, cursor = keyset_page(PSAGroup.objects.all(), 'pub_date', None, 7)
+        self.assertEqual(len(rows), 7)
+        self.assertIsNone(cursor)
+
+    def test_invalid_cursor_starts_at_the_top(self):
+        first, _ = keyset_page(PSAGroup.objects.all(), 'pub_date', None, 3)
+        for cursor in ('garbage', '1-2-x', f'{10 ** 30}-1'):
+            with self.subTest(cursor=cursor):
+                rows, _ = keyset_page(PSAGroup.objects.all(), 'pub_date', cursor, 3)
+                self.assertEqual(rows, first)
+
+    def test_tampered_cursor_only_moves_the_position(self):
+        # A cursor is a position, not a token; editing it can only select rows the query already allows
+        ordered = self.newest_first()
+        rows, _ = keyset_page(PSAGroup.objects.filter(user=self.user), 'pub_date', encode_cursor(self.moment, ordered[1]), 10)
+        self.assertEqual([row.id for row in rows], ordered[2:])
+        other = User.objects.create_user('other', password='password')
+        rows, _ = keyset_page(PSAGroup.objects.filter(user=other), 'pub_date', encode_cursor(self.moment + timedelta(days=1), 0), 10)
+        self.assertEqual(rows, [])
+
+
+@override_settings(CACHES=LOCMEM_CACHES, DATABASE_REPLICAS=[])
+class LoadMoreViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('loadmore', password='password')
+        self.competition = create_competition()
+        self.competition.user.add(self.user)
+        moment = timezone.now()
+        self.groups = [PSAGroup.objects.create(name='loadmore', competition=self.competition, user=self.user, status='pending') for _ in range(25)]
+        PSAGroup.objects.filter(user=self.user).update(pub_date=moment)
+        self.client.force_login(self.user)
+        self.url = reverse('lastresort:competition', args=(self.competition.id,))
+
+    def test_full_page_then_partial(self):
+        response = self.client.get(self.url)
+        self.assertTemplateUsed(response, 'lastresort/competition.html')
+        self.assertEqual(len(response.context['user_submissions']), 20)
+        cursor = response.context['next_cursor']
+        self.assertContains(response, f'hx-get="?cursor={cursor}"')
+
+        response = self.client.get(self.url, {'cursor': cursor}, HTTP_HX_REQUEST='true')
+        self.assertTemplateUsed(response, 'lastresort/user_submissions_partial.html')
+        self.assertTemplateNotUsed(response, 'lastresort/competition.html')
+        self.assertEqual(len(response.context['user_submissions']), 5)
+        self.assertIsNone(response.context['next_cursor'])
+        self.assertNotContains(response, 'Load more')
+        shown = [group.id for group in self.client.get(self.url).context['user_submissions']] + [group.id for group in response.context['user_submissions']]
+        self.assertEqual(shown, sorted((group.id for group in self.groups), reverse=True))
+
+    def test_cursor_without_htmx_renders_the_full_page(self):
+        cursor = self.client.get(self.url).context['next_cursor']
+        response = self.client.get(self.url, {'cursor': cursor})
+        self.assertTemplateUsed(response, 'lastresort/competition.html')
+        self.assertEqual(len(response.context['user_submissions']), 5)
+
+    def test_tampered_cursor_shows_the_first_page(self):
+        response = self.client.get(self.url, {'cursor': 'not-a-cursor'}, HTTP_HX_REQUEST='true')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['user_submissions']), 20)
+
+
+@override_settings(DATABASE_REPLICAS=['replica1'], DATABASE_REPLICA_CHECK_INTERVAL=60, DATABASE_REPLICA_STICKY_SECONDS=15)
+class ReplicaRoutingTests(SimpleTestCase):
+    """Routing decisions only; no query reaches the replica alias, so it need not exist"""
+
+    def setUp(self):
+        replicas._health.clear()
+        replicas._mark('replica1', True)
+        self.factory = RequestFactory()
+
+    def tearDown(self):
+        replicas._health.clear()
+
+    def request(self, method='get', session=None, user=None):
+        request = getattr(self.factory, method)('/')
+        request.session = {} if session is None else session
+        request.user = user or AnonymousUser()
+        return request
+
+    def test_reads_use_the_replica_only_inside_marked_views(self):
+        seen = []
+
+        @replicas.replica_reads
+        def view(request):
+            seen.append((router.db_for_read(Competition), router.db_for_write(Competition)))
+            return HttpResponse()
+
+        view(self.request())
+        self.assertEqual(seen, [('replica1', 'default')])
+        self.assertEqual(router.db_for_read(Competition), 'default')
+        self.assertIsNone(replicas.current_replica())
+        self.assertFalse(router.allow_migrate('replica1', 'lastresort'))
+        self.assertTrue(router.allow_migrate('default', 'lastresort'))
+
+    def test_primary_when_unsafe_or_no_replica_is_usable(self):
+        self.assertIsNone(replicas.choose_replica(self.request('post')))
+        replicas._mark('replica1', False)
+        self.assertIsNone(replicas.choose_replica(self.request()))
+        with override_settings(DATABASE_REPLICAS=[]):
+            self.assertIsNone(replicas.choose_replica(self.request()))
+
+    def test_lagging_or_unreachable_replica_is_skipped(self):
+        replicas._health.clear()
+        with mock.patch.object(replicas, 'replica_lag', return_value=60):
+            self.assertFalse(replicas.is_usable('replica1'))
+        replicas._health.clear()
+        with mock.patch.object(replicas, 'replica_lag', side_effect=OperationalError('unreachable')):
+            self.assertFalse(replicas.is_usable('replica1'))
+        replicas._health.clear()
+        with mock.patch.object(replicas, 'replica_lag', return_value=1):
+            self.assertTrue(replicas.is_usable('replica1'))
+        # The result is reused until the next check is due
+        with mock.patch.object(replicas, 'replica_lag', return_value=60) as replica_lag:
+            self.assertTrue(replicas.is_usable('replica1'))
+        replica_lag.assert_not_called()
+
+    def test_sessions_read_from_the_primary_after_writing(self):
+        middleware = replicas.PrimaryAfterWriteMiddleware(lambda request: HttpResponse())
+        session = {}
+        with mock.patch.object(replicas.time, 'time', return_value=1000.0):
+            middleware(self.request('get', session, User(id=1)))
+            middleware(self.request('post', session, AnonymousUser()))
+            self.assertNotIn(replicas.SESSION_KEY, session)
+            middleware(self.request('post', session, User(id=1)))
+        self.assertEqual(session[replicas.SESSION_KEY], 1015.0)
+        with mock.patch.object(replicas.time, 'time', return_value=1014.0):
+            self.assertIsNone(replicas.choose_replica(self.request(session=session)))
+        with mock.patch.object(replicas.time, 'time', return_value=1016.0):
+            self.assertEqual(replicas.choose_replica(self.request(session=session)), 'replica1')
+
+    def test_operational_error_retries_on_the_primary(self):
+        seen = []
+
+        @replicas.replica_reads
+        def view(request):
+            seen.append(replicas.current_replica())
+            if replicas.current_replica():
+                raise OperationalError('replica went away')
+            return HttpResponse('primary')
+
+        response = view(self.request())
+        self.assertEqual(response.content, b'primary')
+        self.assertEqual(seen, ['replica1', None])
+        # Marked down until the next check, so the following request goes straight to the primary
+        self.assertIsNone(replicas.choose_replica(self.request()))
+
+    def test_streamed_response_keeps_reading_from_the_replica(self):
+        @replicas.replica_reads
+        def view(request):
+            return StreamingHttpResponse(f'{router.db_for_read(PSAEntry)}\n' for _ in range(3))
+
+        response = view(self.request())
+        self.assertIsNone(replicas.current_replica())
+        self.assertEqual(b''.join(response.streaming_content), b'replica1\nreplica1\nreplica1\n')
+        self.assertIsNone(replicas.current_replica())
+
+
+@skipUnless(settings.DATABASE_REPLICAS, 'Needs a replica database alias, e.g. from POSTGRES_REPLICA_HOSTS')
+@override_settings(CACHES=LOCMEM_CACHES)
+class ReplicaDatabaseTests(TransactionTestCase):
+    """Views against a real second alias; in tests replicas mirror the default database"""
+
+    databases = '__all__'
+
+    def setUp(self):
+        cache.clear()
+        self.alias = settings.DATABASE_REPLICAS[0]
+        for alias in settings.DATABASE_REPLICAS:
+            replicas._mark(alias, alias == self.alias)
+        self.user = User.objects.create_user('replica', password='password', is_staff=True)
+        self.competition = create_competition(end_date=timezone.now() - timedelta(days=1), is_active=False)
+        psa_group = PSAGroup.objects.create(name='replica', competition=self.competition, user=self.user, status='completed', entry_count=1)
+        PSAEntry.objects.create(group=psa_group, problem='replica problem', solution='solution', answer='1')
+        self.client.force_login(self.user)
+
+    def tearDown(self):
+        replicas._health.clear()
+
+    def test_view_reads_from_the_replica(self):
+        with CaptureQueriesContext(connections[self.alias]) as replica_queries:
+            response = self.client.get(reverse('lastresort:competition', args=(self.competition.id,)))
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(len(replica_queries), 0)
+
+    def test_export_streams_from_the_replica(self):
+        response = self.client.get(reverse('lastresort:export_competition', args=(self.competition.id,)), {'format': 'jsonl'})
+        with CaptureQueriesContext(connections[self.alias]) as replica_queries, CaptureQueriesContext(connections['default']) as primary_queries:
+            body = b''.join(response.streaming_content).decode()
+        self.assertIn('replica problem', body)
+        self.assertGreater(len(replica_queries), 0)
+        self.assertEqual(len(primary_queries), 0)
+
+
+class ScriptedStubBackend(StubBackend):
+    """Stub whose calls answer in order from a script of (answer, delay); a None answer fails the call"""
+
+    def __init__(self, script):
+        self.script = list(script)
+        self.calls = 0
+        self.cancelled = 0
+
+    async def acomplete(self, prompt):
+        answer, delay = self.script[self.calls]
+        self.calls += 1
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        if answer is None:
+            raise ValueError('Scripted failure')
+        return f'Scripted solution\n{answer}'
+
+
+@override_settings(AI_BACKEND='stub', AI_STUB_LATENCY=0, AI_STUB_ERROR_RATE=0, AI_RATE_LIMIT_RPM=0, AI_RATE_LIMIT_TPM=0, AI_MAX_RETRIES=0)
+class SampleEntryTests(SimpleTestCase):
+    def setUp(self):
+        self.psa_entry = PSAEntry(id=1, group_id=1, problem='What is 6 times 7?', answer='42')
+
+    def sample(self, backend, samples):
+        async def run():
+            return await _sample_entry(self.psa_entry, backend, asyncio.Semaphore(10), samples, correct_samples_needed(samples))
+        return asyncio.run(run())
+
+    def test_correct_samples_needed_is_a_strict_majority(self):
+        self.assertEqual([correct_samples_needed(samples) for samples in range(1, 7)], [1, 2, 2, 3, 3, 4])
+
+    def test_single_sample_is_one_call(self):
+        expected = StubBackend()._output(SOLUTION_PROMPT.format(problem=self.psa_entry.problem)).rsplit('\n', 1)[1]
+        results = asyncio.run(_solve_entries([self.psa_entry]))
+        self.assertEqual(len(results), 1)
+        self.assertEqual([answer for _, answer in results[0]], [expected])
+
+    def test_agreeing_samples_stop_at_the_majority(self):
+        # Three matching answers settle five samples, whether they are right or wrong
+        for answer in ('42', '0'):
+            with self.subTest(answer=answer):
+                backend = ScriptedStubBackend([(answer, 0)] * 5)
+                results = self.sample(backend, 5)
+                self.assertEqual([result[1] for result in results], [answer] * 3)
+                self.assertEqual(backend.calls, 3)
+
+    def test_disagreement_starts_the_remaining_samples(self):
+        backend = ScriptedStubBackend([('42', 0), ('7', 0), ('42', 0.05), ('42', 0.01), ('9', 5)])
+        with mock.patch.object(metrics, 'inc') as inc:
+            results = self.sample(backend, 5)
+        self.assertEqual(sorted(result[1] for result in results), ['42', '42', '42', '7'])
+        self.assertEqual(backend.calls, 5)
+        # The slow fifth sample was no longer needed once three answers were right
+        self.assertEqual(backend.cancelled, 1)
+        inc.assert_called_once_with('lastresort_model_samples_cancelled_total', 1)
+
+    def test_failed_sample_fails_the_entry(self):
+        backend = ScriptedStubBackend([(None, 0), ('42', 5), ('42', 5)])
+        with mock.patch.object(metrics, 'inc') as inc:
+            self.assertIsNone(self.sample(backend, 5))
+        self.assertEqual(backend.cancelled, 2)
+        inc.assert_called_once_with('lastresort_model_samples_cancelled_total', 2)
+
+
+class MajorityGradingTests(TestCase):
+    def grade(self, samples, answers):
+        """Score of a group whose entries got these sampled answers; every entry's right answer is '1'"""
+        user = User.objects.create_user(f'grading-{samples}-{len(answers)}', password='password')
+        competition = create_competition(samples_per_entry=samples)
+        psa_group = PSAGroup.submit(user, competition, [(f'Problem {number}', 'Solution', '1') for number in range(len(answers))])
+        for psa_entry, entry_answers in zip(psa_group.psaentry_set.order_by('id'), answers):
+            for answer in entry_answers:
+                AIResponse.objects.create(psa_entry=psa_entry, ai_solution='Solution', ai_answer=answer, is_correct=answer == '1')
+        psa_group.grade()
+        return psa_group.score
+
+    def test_single_sample(self):
+        self.assertEqual(self.grade(1, [['1'], ['2']]), 50)
+
+    def test_entry_is_solved_by_a_strict_majority(self):
+        # Two of three right solves an entry; one of three does not, nor does an unsettled two of four
+        self.assertEqual(self.grade(3, [['1', '1'], ['1', '2', '2'], ['2', '1', '1'], ['2', '2']]), 50)
+        self.assertEqual(self.grade(4, [['1', '1', '1'], ['1', '1', '2', '2']]), 50)
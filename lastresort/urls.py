@@ -14,6 +14,10 @@ urlpatterns = [
     path('leaderboard/<int:competition_id>/', views.leaderboard, name='leaderboard'),
     path('output/<int:psa_group_id>/<int:competition_id>/', views.output, name='output'),
     path('check-outputs/<int:psa_group_id>/', views.check_outputs, name='check_outputs'),
+    path('ai-solution/<int:ai_response_id>/', views.ai_solution, name='ai_solution'),
+    path('stream-outputs/<int:psa_group_id>/', views.stream_outputs, name='stream_outputs'),
     path('download-submission/<int:psa_group_id>/', views.download_submission, name='download_submission'),
+    path('export-competition/<int:competition_id>/', views.export_competition, name='export_competition'),
     path('admin-review/<int:competition_id>/', views.admin_review, name='admin_review'),
+    path('performance/', views.performance, name='performance'),
 ]
\ No newline at end of file
@@ -1,15 +1,44 @@
-from django.shortcuts import render, get_object_or_404
+import json
+import time
+from asgiref.sync import sync_to_async
+from django.shortcuts import render, get_object_or_404, aget_object_or_404
+from django.template.loader import render_to_string
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
 from django.utils import timezone
-from django.http import HttpResponseRedirect, HttpResponse
+from django.http import HttpResponseRedirect, HttpResponse, HttpResponseForbidden, StreamingHttpResponse
 from django.urls import reverse
-from .models import PSAGroup, PSAEntry, AIResponse, Competition
-from .forms import PSAEntryForm
+from django.conf import settings
+from django.db import transaction
+from django.core.paginator import Page, Paginator
+from django.db.models import Avg, Count, F, Max, Window
+from django.db.models.functions import Rank
+from .models import PSAGroup, PSAEntry, AIResponse, Competition, LeaderboardEntry
+from .forms import PSAEntryForm, PSAUploadForm
+from .events import get_async_connection, group_channel, partial_key
+from .exports import EXPORT_FORMATS, stream_export, stream_submission_text
+from .pagination import keyset_page
+from .performance import budget, report
+from .replicas import replica_reads
+from . import fragments
+from .tasks import dispatch_ai_generation, dispatch_accepted_groups
 from django.contrib.auth.forms import UserCreationForm, AuthenticationForm
 from django.contrib import messages
 from django.contrib.auth import login, logout
 from django.contrib.auth.decorators import login_required
 from celery import chain
 
+LEADERBOARD_PAGE_SIZE = 50
+OUTPUTS_PAGE_SIZE = 25
+OUTPUT_STREAM_KEEPALIVE = 15
+OUTPUT_STREAM_TIMEOUT = 600
+PERFORMANCE_WINDOWS = [1, 6, 24]
+# Above this many questions the submit page only offers a file upload
+SUBMIT_FORM_MAX_QUESTIONS = 50
+ADMIN_REVIEW_PAGE_SIZE = 50
+PAST_COMPETITIONS_PAGE_SIZE = 24
+USER_SUBMISSIONS_PAGE_SIZE = 20
+
 def register(request):
     if request.user.is_authenticated:
         return HttpResponseRedirect(reverse('lastresort:dashboard'))
@@ -37,76 +66,129 @@ def login_view(request):
         form = AuthenticationForm()
     return render(request, 'lastresort/login.html', {'form': form})
 
+def _first_end(competitions):
+    """When the first of these open competitions ends, and a cached list of them goes stale"""
+    return min((competition.end_date for competition in competitions if competition.is_open()), default=None)
+
+def _past_competitions(cursor=None, exclude=()):
+    """A page of ended competitions, leaving out the excluded ids before paging so every page is full"""
+    return keyset_page(Competition.objects.ended().exclude(id__in=exclude), 'end_date', cursor, PAST_COMPETITIONS_PAGE_SIZE)
+
+def _is_htmx(request):
+    return request.headers.get('HX-Request') == 'true'
+
 @login_required(login_url='lastresort:login')
+@replica_reads
+@budget(queries=8, ms=300)
 def dashboard(request):
-    competitions = Competition.objects.filter(is_active=True).order_by('-pub_date')
-    competitions_to_update = Competition.objects.all()
-    for competition in competitions_to_update:
-        competition.save()
-
-    your_competitions = request.user.competitions.all().order_by('-is_active', '-pub_date')
-    active_competitions = Competition.objects.filter(is_active=True).exclude(user=request.user).order_by('-pub_date')
-    past_competitions = Competition.objects.filter(is_active=False).exclude(user=request.user).order_by('-end_date')
+    # Expiry is flipped in bulk by the expire_competitions beat task; end_date
+    # is checked here too so a competition drops out the moment it ends.
+    your_competitions = fragments.cached(
+        'dashboard-yours', ['competitions', f'user:{request.user.id}:competitions'],
+        lambda: list(request.user.competitions.with_open_flag().order_by('-is_open_now', '-pub_date')),
+        vary=[request.user.id], expires=_first_end
+    )
+    yours = [competition.id for competition in your_competitions]
+    cursor = request.GET.get('cursor')
+    # The user's own competitions are left out of the query, so the pages are per user
+    past_competitions, past_cursor = fragments.cached(
+        'dashboard-past', ['competitions', f'user:{request.user.id}:competitions'],
+        lambda: _past_competitions(cursor, exclude=yours),
+        vary=[request.user.id, cursor or '']
+    )
+    if cursor and _is_htmx(request):
+        # "Load more" only needs the next page of past competitions
+        return render(request, 'lastresort/past_competitions_partial.html', {
+            'past_competitions': past_competitions,
+            'next_cursor': past_cursor
+        })
+    # The active list is shared by everyone; only the user's own are taken out per request
+    active = fragments.cached(
+        'dashboard-active', ['competitions'], lambda: list(Competition.objects.active().order_by('-pub_date')), expires=_first_end
+    )
+    active_competitions = [competition for competition in active if competition.id not in yours]
     
     return render(request, 'lastresort/dashboard.html', {
         'your_competitions': your_competitions,
         'active_competitions': active_competitions,
-        'past_competitions': past_competitions
+        'past_competitions': past_competitions,
+        'next_cursor': past_cursor
     })
 
 @login_required(login_url='lastresort:login')
+@replica_reads
+@budget(queries=8, ms=200)
 def competition(request, competition_id):
     competition = get_object_or_404(Competition, pk=competition_id)
     
-    # Get user's submissions for this competition
-    user_submissions = PSAGroup.objects.filter(
-        competition=competition,
-        user=request.user
-    ).order_by('-pub_date')
+    # Get user's submissions for this competition, a page at a time
+    cursor = request.GET.get('cursor')
+    user_submissions, next_cursor = fragments.cached(
+        'competition-submissions', [f'submissions:{competition.id}:{request.user.id}'],
+        lambda: keyset_page(PSAGroup.objects.filter(competition=competition, user=request.user), 'pub_date', cursor, USER_SUBMISSIONS_PAGE_SIZE),
+        vary=[competition.id, request.user.id, cursor or '']
+    )
+    if cursor and _is_htmx(request):
+        return render(request, 'lastresort/user_submissions_partial.html', {
+            'competition': competition,
+            'user_submissions': user_submissions,
+            'next_cursor': next_cursor
+        })
+    is_member = fragments.cached(
+        'competition-member', [f'user:{request.user.id}:competitions'],
+        lambda: competition.user.filter(pk=request.user.pk).exists(),
+        vary=[competition.id, request.user.id]
+    )
     
     return render(request, 'lastresort/competition.html', {
         'competition': competition,
-        'user_submissions': user_submissions
+        'user_submissions': user_submissions,
+        'next_cursor': next_cursor,
+        'is_member': is_member
     })
 
 @login_required(login_url='lastresort:login')
+@budget(queries=12, ms=300)
 def submit(request, competition_id):
     competition = get_object_or_404(Competition, pk=competition_id)
     
-    if not competition.is_active:
+    if not competition.is_open():
         return render(request, 'lastresort/access_denied.html', {
             'error_message': 'This competition is no longer active.'
         })
     
-    if request.user not in competition.user.all():
+    if not competition.user.filter(pk=request.user.pk).exists():
         return render(request, 'lastresort/access_denied.html', {
             'error_message': 'You are not registered for this competition.'
         })
     
+    show_form = competition.num_questions <= SUBMIT_FORM_MAX_QUESTIONS
+    form = PSAEntryForm(num_questions=competition.num_questions) if show_form else None
+    upload_form = PSAUploadForm(num_questions=competition.num_questions)
     if request.method == 'POST':
-        form = PSAEntryForm(request.POST, num_questions=competition.num_questions)
-        if form.is_valid():
-            group = PSAGroup.objects.create(
-                name=f"{request.user.username}", 
-                competition=competition, 
-                user=request.user,
-                status='pending'
-            )
-            for i in range(competition.num_questions):
-                psa_entry = PSAEntry.objects.create(group=group, problem=form.cleaned_data[f'question_{i}'], solution=form.cleaned_data[f'solution_{i}'], answer=form.cleaned_data[f'answer_{i}'])
+        # Above the limit the per-question form is never built, so anything posted is treated as an upload
+        if 'file' in request.FILES or not show_form:
+            upload_form = PSAUploadForm(request.POST, request.FILES, num_questions=competition.num_questions)
+            submitted = upload_form
+        else:
+            form = PSAEntryForm(request.POST, num_questions=competition.num_questions)
+            submitted = form
+        if submitted.is_valid():
+            PSAGroup.submit(request.user, competition, submitted.entries())
             
             messages.success(request, 'Your submission has been submitted successfully and is pending admin review.')
             return HttpResponseRedirect(reverse('lastresort:competition', args=(competition.id,)))
-    else:
-        form = PSAEntryForm(num_questions=competition.num_questions)
     return render(request, 'lastresort/submit.html', {
         'competition': competition,
         'form': form,
+        'upload_form': upload_form,
         'num_questions': competition.num_questions,
-        'question_range': range(competition.num_questions)
+        'question_range': range(competition.num_questions) if form else []
     })
 
 @login_required(login_url='lastresort:login')
+@replica_reads
+@budget(queries=8, ms=300)
 def output(request, psa_group_id, competition_id):
     psa_group = get_object_or_404(PSAGroup, pk=psa_group_id)
     competition = get_object_or_404(Competition, pk=competition_id)
@@ -121,86 +203,234 @@ def output(request, psa_group_id, competition_id):
             'error_message': 'This submission is pending review or has been rejected.'
         })
     
-    psa_entries = psa_group.psaentry_set.all().order_by('-pub_date')
-    ai_responses = AIResponse.objects.filter(psa_entry__group=psa_group).order_by('-pub_date')
     return render(request, 'lastresort/output.html', {
         'psa_group': psa_group,
         'competition': competition,
-        'psa_entries': psa_entries,
-        'ai_responses': ai_responses
+        'outputs_html': _completed_outputs_html(psa_group, _page_number(request)) if psa_group.graded_at else None
     })
 
+def _page_number(request):
+    try:
+        return max(int(request.GET.get('page', 1)), 1)
+    except ValueError:
+        return 1
+
+def _completed_outputs_html(psa_group, page_number=1):
+    """A page of a graded group's results, rendered once for its owner and staff until the group changes"""
+    def build():
+        # Only the compact columns; each solution is fetched from ai_solution when it is expanded
+        ai_responses = AIResponse.objects.filter(psa_entry__group=psa_group).select_related('psa_entry').only(
+            'psa_entry__answer', 'ai_answer', 'is_correct', 'pub_date'
+        ).order_by('-pub_date', '-id')
+        return render_to_string('lastresort/outputs_partial.html', {
+            'psa_group': psa_group,
+            'page_obj': Paginator(ai_responses, OUTPUTS_PAGE_SIZE).get_page(page_number),
+        })
+    return fragments.cached('outputs', [f'group:{psa_group.id}'], build, vary=[psa_group.id, page_number])
+
+def _outputs_etag(psa_group, page_number):
+    """Graded results never change until the group does, so they can be revalidated cheaply"""
+    if psa_group.graded_at is None:
+        return None
+    return quote_etag(f'outputs-{psa_group.id}-{psa_group.graded_at.timestamp()}-{psa_group.score}-{page_number}')
+
 @login_required(login_url='lastresort:login')
+@replica_reads
+@budget(queries=6, ms=200)
 def check_outputs(request, psa_group_id):
     """HTMX endpoint to check for outputs"""
     psa_group = get_object_or_404(PSAGroup, pk=psa_group_id)
-    psa_entries = psa_group.psaentry_set.all()
-    ai_responses = AIResponse.objects.filter(psa_entry__group=psa_group).order_by('-pub_date')
-    
-    if ai_responses.count() >= psa_entries.count():
-        correct = 0
-        for ai_response in ai_responses:
-            if ai_response.psa_entry.answer == ai_response.ai_answer:
-                correct += 1
-        psa_group.score = 100-correct*100/psa_entries.count()
-        psa_group.save()
-        return render(request, 'lastresort/outputs_partial.html', {
-            'psa_group': psa_group,
-            'psa_entries': psa_entries,
-            'ai_responses': ai_responses
-        })
+    
+    if psa_group.user_id != request.user.id and not (request.user.is_staff or request.user.is_superuser):
+        return HttpResponseForbidden('You can only view your own submissions.')
+    
+    page_number = _page_number(request)
+    etag = _outputs_etag(psa_group, page_number)
+    if etag:
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            return not_modified
+    
+    if psa_group.graded_at:
+        response = HttpResponse(_completed_outputs_html(psa_group, page_number))
+        response['ETag'] = etag
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
     else:
+        # Progress comes from the group's own counters, so polling costs no COUNT queries
         return render(request, 'lastresort/loading_partial.html', {
-            'psa_group': psa_group,
-            'psa_entries': psa_entries,
-            'ai_responses': ai_responses
+            'psa_group': psa_group
         })
 
 @login_required(login_url='lastresort:login')
+@replica_reads
+@budget(queries=3, ms=100)
+def ai_solution(request, ai_response_id):
+    """HTMX endpoint returning one AI response's full solution when the viewer expands it"""
+    ai_response = get_object_or_404(
+        AIResponse.objects.select_related('psa_entry__group', 'solution').only('psa_entry__group__user_id', 'solution__compressed_text'),
+        pk=ai_response_id
+    )
+    if ai_response.psa_entry.group.user_id != request.user.id and not (request.user.is_staff or request.user.is_superuser):
+        return HttpResponseForbidden('You can only view your own submissions.')
+    
+    response = render(request, 'lastresort/ai_solution_partial.html', {'ai_solution': ai_response.ai_solution})
+    # A stored solution never changes
+    patch_cache_control(response, private=True, max_age=3600)
+    return response
+
+def _sse_event(event, data=''):
+    lines = ''.join(f'data: {line}\n' for line in data.splitlines()) or 'data: \n'
+    return f'event: {event}\n{lines}\n'
+
+def _render_completed_outputs(psa_group):
+    psa_group.refresh_from_db(fields=['score', 'graded_at'])
+    return _completed_outputs_html(psa_group)
+
+async def _output_events(psa_group):
+    """Yield server-sent events for a group until it has been graded"""
+    connection = get_async_connection()
+    pubsub = connection.pubsub()
+    await pubsub.subscribe(group_channel(psa_group.id))
+    try:
+        # Subscribed before catching up, so nothing published meanwhile is missed
+        ai_responses = AIResponse.objects.filter(psa_entry__group=psa_group).select_related('psa_entry').only(
+            'psa_entry__answer', 'ai_answer', 'is_correct', 'pub_date'
+        ).order_by('pub_date')
+        answered = set()
+        async for ai_response in ai_responses:
+            answered.add(ai_response.psa_entry_id)
+            yield _sse_event('response', render_to_string('lastresort/ai_response_partial.html', {'ai_response': ai_response}))
+        
+        progress = await PSAGroup.objects.aget(pk=psa_group.id)
+        if progress.graded_at is None and progress.failed_count and progress.generation_finished():
+            yield _sse_event('incomplete', json.dumps({'answered': progress.answered_count, 'failed': progress.failed_count}))
+            return
+        if progress.graded_at is None:
+            # Solutions still being written are sent whole; later deltas carry their offset into them
+            entry_ids = [pk async for pk in PSAEntry.objects.filter(group=psa_group).values_list('id', flat=True) if pk not in answered]
+            if entry_ids:
+                texts = await connection.mget([partial_key(entry_id) for entry_id in entry_ids])
+                for entry_id, text in zip(entry_ids, texts):
+                    if text:
+                        yield _sse_event('partial', json.dumps({'psa_entry_id': entry_id, 'offset': 0, 'delta': text.decode('utf-8')}))
+            
+            deadline = time.monotonic() + OUTPUT_STREAM_TIMEOUT
+            while time.monotonic() < deadline:
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=OUTPUT_STREAM_KEEPALIVE)
+                if message is None:
+                    yield ': keepalive\n\n'
+                    continue
+                payload = json.loads(message['data'])
+                if payload['event'] == 'response':
+                    # The viewer was watching this solution being written, so it stays open
+                    ai_response = await AIResponse.objects.select_related('psa_entry', 'solution').aget(pk=payload['ai_response_id'])
+                    yield _sse_event('response', render_to_string('lastresort/ai_response_partial.html', {'ai_response': ai_response, 'show_solution': True}))
+                elif payload['event'] == 'partial':
+                    yield _sse_event('partial', json.dumps(payload))
+                elif payload['event'] == 'incomplete':
+                    yield _sse_event('incomplete', json.dumps(payload))
+                    return
+                elif payload['event'] == 'complete':
+                    break
+            else:
+                # Let the browser reconnect and catch up on a fresh connection
+                return
+        
+        yield _sse_event('complete', await sync_to_async(_render_completed_outputs)(psa_group))
+    finally:
+        await pubsub.unsubscribe()
+        await pubsub.aclose()
+        await connection.aclose()
+
+@login_required(login_url='lastresort:login')
+async def stream_outputs(request, psa_group_id):
+    """Server-sent events endpoint pushing AI responses as they are generated"""
+    user = await request.auser()
+    psa_group = await aget_object_or_404(PSAGroup, pk=psa_group_id)
+    
+    if psa_group.user_id != user.id and not (user.is_staff or user.is_superuser):
+        return HttpResponseForbidden('You can only view your own submissions.')
+    
+    if psa_group.status not in ['accepted', 'completed']:
+        return HttpResponseForbidden('This submission is pending review or has been rejected.')
+    
+    response = StreamingHttpResponse(_output_events(psa_group), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+@login_required(login_url='lastresort:login')
+@replica_reads
+@budget(queries=10, ms=300)
 def leaderboard(request, competition_id):
     competition = get_object_or_404(Competition, pk=competition_id)
-    all_groups = PSAGroup.objects.filter(
-        competition=competition, 
-        status__in=['accepted', 'completed']
-    ).select_related('user').order_by('user__username', '-score')
-    
-    user_best_scores = {}
-    for group in all_groups:
-        username = group.user.username
-        if username not in user_best_scores:
-            user_best_scores[username] = {
-                'username': username,
-                'best_score': group.score,
-                'best_submission_date': group.pub_date,
-                'user_id': group.user.id
-            }
-    
-    psa_groups = sorted(user_best_scores.values(), key=lambda x: x['best_score'], reverse=True)
-    
-    if psa_groups:
-        total_score = sum(group['best_score'] for group in psa_groups)
-        average_score = total_score / len(psa_groups)
-    else:
-        average_score = 0
+    page_number = _page_number(request)
+    
+    # Every viewer of a page sees the same ranking; only their own rank is looked up per user
+    board = fragments.cached(
+        'leaderboard', [f'leaderboard:{competition.id}'],
+        lambda: _leaderboard_page(competition, page_number),
+        vary=[competition.id, page_number]
+    )
+    your_entry, your_rank = fragments.cached(
+        'leaderboard-rank', [f'leaderboard:{competition.id}'],
+        lambda: _leaderboard_rank(competition, request.user),
+        vary=[competition.id, request.user.id]
+    )
+    page_obj = Page(board['entries'], board['number'], Paginator(range(board['count']), LEADERBOARD_PAGE_SIZE))
     
     return render(request, 'lastresort/leaderboard.html', {
         'competition': competition,
-        'psa_groups': psa_groups,
-        'average_score': average_score
+        'page_obj': page_obj,
+        'leaderboard_entries': page_obj.object_list,
+        'participant_count': board['participant_count'],
+        'average_score': board['average_score'] or 0,
+        'top_score': board['top_score'] or 0,
+        'your_entry': your_entry,
+        'your_rank': your_rank
     })
 
+def _leaderboard_page(competition, page_number):
+    entries = LeaderboardEntry.objects.filter(competition=competition)
+    ranked_entries = entries.select_related('user').annotate(
+        rank=Window(expression=Rank(), order_by=F('best_score').desc())
+    ).order_by('-best_score', 'best_submission_date', 'id')
+    page_obj = Paginator(ranked_entries, LEADERBOARD_PAGE_SIZE).get_page(page_number)
+    
+    stats = entries.aggregate(
+        participant_count=Count('id'),
+        average_score=Avg('best_score'),
+        top_score=Max('best_score')
+    )
+    return {
+        'entries': list(page_obj.object_list),
+        'number': page_obj.number,
+        'count': page_obj.paginator.count,
+        **stats
+    }
+
+def _leaderboard_rank(competition, user):
+    entries = LeaderboardEntry.objects.filter(competition=competition)
+    your_entry = entries.filter(user=user).first()
+    your_rank = None
+    if your_entry:
+        your_rank = entries.filter(best_score__gt=your_entry.best_score).count() + 1
+    return your_entry, your_rank
+
 @login_required(login_url='lastresort:login')
+@budget(queries=8, ms=200)
 def register_competition(request, competition_id):
     if request.method == 'POST':
         competition = get_object_or_404(Competition, pk=competition_id)
         
         # Check if competition is active
-        if not competition.is_active:
+        if not competition.is_open():
             messages.error(request, 'Cannot register for an inactive competition.')
             return HttpResponseRedirect(reverse('lastresort:competition', args=(competition.id,)))
         
         # Check if user is already registered
-        if request.user in competition.user.all():
+        if competition.user.filter(pk=request.user.pk).exists():
             messages.info(request, 'You are already registered for this competition.')
             return HttpResponseRedirect(reverse('lastresort:competition', args=(competition.id,)))
         
@@ -222,9 +452,11 @@ def landing(request):
     return render(request, 'lastresort/landing.html')
 
 @login_required(login_url='lastresort:login')
+@replica_reads
+@budget(queries=8, ms=300)
 def download_submission(request, psa_group_id):
-    """Download submission data as a text file"""
-    psa_group = get_object_or_404(PSAGroup, pk=psa_group_id)
+    """Download submission data as a text file, or as CSV/JSONL with ?format="""
+    psa_group = get_object_or_404(PSAGroup.objects.select_related('competition', 'user'), pk=psa_group_id)
     
     # Ensure user can only download their own submissions
     if psa_group.user != request.user:
@@ -232,39 +464,38 @@ def download_submission(request, psa_group_id):
             'error_message': 'You can only download your own submissions.'
         })
     
-    # Get all PSA entries for this group
-    psa_entries = PSAEntry.objects.filter(group=psa_group).order_by('pub_date')
-    
-    # Generate the text content
-    content = f"Submission Details\n"
-    content += f"=" * 50 + "\n\n"
-    content += f"Competition: {psa_group.competition.name}\n"
-    content += f"Submitted by: {psa_group.user.username}\n"
-    content += f"Submission Date: {psa_group.pub_date.strftime('%Y-%m-%d %H:%M:%S')}\n"
-    content += f"Status: {psa_group.status}\n"
-    content += f"Score: {psa_group.score}%\n"
-    if psa_group.reason:
-        content += f"Reason: {psa_group.reason}\n"
-    content += f"\n"
-    
-    content += f"Questions and Solutions\n"
-    content += f"=" * 50 + "\n\n"
-    
-    for i, entry in enumerate(psa_entries, 1):
-        content += f"Question {i}:\n"
-        content += f"Problem: {entry.problem}\n"
-        content += f"Solution: {entry.solution}\n"
-        content += f"Answer: {entry.answer}\n"
-        content += f"Submitted: {entry.pub_date.strftime('%Y-%m-%d %H:%M:%S')}\n"
-        content += f"\n"
-    
-    # Create the response
-    response = HttpResponse(content, content_type='text/plain')
-    response['Content-Disposition'] = f'attachment; filename="submission_{psa_group.id}_{psa_group.user.username}.txt"'
+    export_format = request.GET.get('format')
+    if export_format in EXPORT_FORMATS:
+        response = StreamingHttpResponse(stream_export([psa_group.id], export_format), content_type=EXPORT_FORMATS[export_format])
+    else:
+        export_format = 'txt'
+        response = StreamingHttpResponse(stream_submission_text(psa_group), content_type='text/plain')
+    response['Content-Disposition'] = f'attachment; filename="submission_{psa_group.id}_{psa_group.user.username}.{export_format}"'
     
     return response
 
 @login_required(login_url='lastresort:login')
+@replica_reads
+@budget(queries=6, ms=200)
+def export_competition(request, competition_id):
+    """Stream every entry, AI response and score of a competition as CSV or JSONL"""
+    competition = get_object_or_404(Competition, pk=competition_id)
+    
+    if not request.user.is_staff and not request.user.is_superuser:
+        return render(request, 'lastresort/access_denied.html', {
+            'error_message': 'You do not have permission to access this page.'
+        })
+    
+    export_format = request.GET.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        export_format = 'csv'
+    psa_groups = PSAGroup.objects.filter(competition=competition).values('id')
+    response = StreamingHttpResponse(stream_export(psa_groups, export_format), content_type=EXPORT_FORMATS[export_format])
+    response['Content-Disposition'] = f'attachment; filename="competition_{competition.id}.{export_format}"'
+    return response
+
+@login_required(login_url='lastresort:login')
+@budget(queries=10, ms=500)
 def admin_review(request, competition_id):
     """Admin view to review all submissions for a competition"""
     competition = get_object_or_404(Competition, pk=competition_id)
@@ -275,43 +506,68 @@ def admin_review(request, competition_id):
         })
     
     if request.method == 'POST':
-        submission_id = request.POST.get('submission_id')
         action = request.POST.get('action')
         reason = request.POST.get('reason', '')
+        pending = PSAGroup.objects.filter(competition=competition, status='pending')
         
-        if submission_id and action:
-            submission = get_object_or_404(PSAGroup, pk=submission_id, competition=competition)
-            
-            if action == 'accept':
-                submission.status = 'accepted'
-                submission.reason = reason
-                submission.save()
-                
-                from .tasks import generate_ai_responses, mark_submission_completed
-                from django.db import transaction
-                chain = generate_ai_responses.s(submission.id) | mark_submission_completed.s(submission.id)
-                transaction.on_commit(lambda: chain.delay())
-                
-                messages.success(request, f'Submission #{submission.id} has been accepted.')
-                
-            elif action == 'reject':
-                submission.status = 'rejected'
-                submission.reason = reason
-                submission.save()
-                
-                messages.success(request, f'Submission #{submission.id} has been rejected.')
+        if action == 'accept_all':
+            action = 'accept'
+        elif request.POST.getlist('submission_ids'):
+            pending = pending.filter(id__in=request.POST.getlist('submission_ids'))
+        elif request.POST.get('submission_id'):
+            pending = pending.filter(id=request.POST.get('submission_id'))
+        else:
+            action = None
+        
+        if action in ['accept', 'reject']:
+            status = 'accepted' if action == 'accept' else 'rejected'
+            with transaction.atomic():
+                submission_ids = list(pending.select_for_update().values_list('id', flat=True))
+                PSAGroup.objects.filter(id__in=submission_ids).update(status=status, reason=reason)
+                fragments.bump_groups(PSAGroup.objects.filter(id__in=submission_ids))
+                if status == 'accepted' and submission_ids:
+                    if len(submission_ids) == 1:
+                        transaction.on_commit(lambda: dispatch_ai_generation(submission_ids[0]))
+                    else:
+                        transaction.on_commit(lambda: dispatch_accepted_groups.delay(submission_ids))
             
-            return HttpResponseRedirect(reverse('lastresort:admin_review', args=(competition.id,)))
+            if len(submission_ids) == 1:
+                messages.success(request, f'Submission #{submission_ids[0]} has been {status}.')
+            else:
+                messages.success(request, f'{len(submission_ids)} submissions have been {status}.')
+        
+        return HttpResponseRedirect(reverse('lastresort:admin_review', args=(competition.id,)))
     
-    submissions = PSAGroup.objects.filter(
-        competition=competition,
-        status__in=['pending']
-    ).select_related('user').order_by('-pub_date')
+    pending = PSAGroup.objects.filter(competition=competition, status='pending')
+    cursor = request.GET.get('cursor')
+    submissions, next_cursor = keyset_page(
+        pending.select_related('user').prefetch_related('psaentry_set'), 'pub_date', cursor, ADMIN_REVIEW_PAGE_SIZE
+    )
+    if cursor and _is_htmx(request):
+        return render(request, 'lastresort/review_submissions_partial.html', {
+            'submissions': submissions,
+            'next_cursor': next_cursor
+        })
     
     return render(request, 'lastresort/admin_review.html', {
         'competition': competition,
-        'submissions': submissions
+        'submissions': submissions,
+        'next_cursor': next_cursor,
+        'pending_count': pending.count()
     })
 
-
-
+@login_required(login_url='lastresort:login')
+def performance(request):
+    """Staff page with per-view and per-task query counts and latency"""
+    if not request.user.is_staff and not request.user.is_superuser:
+        return render(request, 'lastresort/access_denied.html', {
+            'error_message': 'You do not have permission to access this page.'
+        })
+    
+    hours = request.GET.get('hours', '')
+    hours = min(max(int(hours) if hours.isdigit() else 1, 1), max(settings.PERFORMANCE_RETENTION_HOURS // 2, 1))
+    return render(request, 'lastresort/performance.html', {
+        'rows': report(hours),
+        'hours': hours,
+        'hour_options': PERFORMANCE_WINDOWS
+    })
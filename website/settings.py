@@ -46,11 +46,14 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'lastresort.performance.PerformanceMiddleware',
+    'lastresort.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'lastresort.replicas.PrimaryAfterWriteMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -89,6 +92,27 @@ DATABASES = {
     }
 }
 
+# Streaming replicas of the primary, as comma-separated host[:port]s with the same database and
+# credentials. Views marked with replicas.replica_reads read from them while they keep up; tests
+# mirror them onto the default database.
+DATABASE_REPLICAS = []
+for number, address in enumerate(filter(None, os.environ.get('POSTGRES_REPLICA_HOSTS', '').split(',')), 1):
+    host, _, port = address.strip().partition(':')
+    DATABASES[f'replica{number}'] = {
+        **DATABASES['default'],
+        'HOST': host,
+        'PORT': port or DATABASES['default']['PORT'],
+        'OPTIONS': {'connect_timeout': 2},
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(f'replica{number}')
+DATABASE_ROUTERS = ['lastresort.replicas.ReplicaRouter']
+# A replica further behind than this is skipped until it catches up
+DATABASE_REPLICA_MAX_LAG = float(os.environ.get('DATABASE_REPLICA_MAX_LAG', 5))
+DATABASE_REPLICA_CHECK_INTERVAL = float(os.environ.get('DATABASE_REPLICA_CHECK_INTERVAL', 5))
+# How long a session reads from the primary after it writes
+DATABASE_REPLICA_STICKY_SECONDS = float(os.environ.get('DATABASE_REPLICA_STICKY_SECONDS', 15))
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -108,12 +132,117 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 CELERY_BROKER_URL = os.environ.get('CELERY_BROKER_URL')
+# Required: realtime generation completes each submission through a chord over its entry tasks
 CELERY_RESULT_BACKEND = os.environ.get('CELERY_RESULT_BACKEND')
 CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'America/New_York'
 CELERY_ENABLE_UTC = False
+# Model calls spend their time waiting on the network, so they get their own queue, served by a
+# thread pool with high concurrency (CELERY_MODEL_CONCURRENCY); grading and other database
+# bookkeeping stay on the default queue and its prefork workers
+CELERY_TASK_DEFAULT_QUEUE = os.environ.get('CELERY_DEFAULT_QUEUE', 'celery')
+CELERY_MODEL_QUEUE = os.environ.get('CELERY_MODEL_QUEUE', 'model')
+CELERY_TASK_ROUTES = {
+    task: {'queue': CELERY_MODEL_QUEUE}
+    for task in [
+        'lastresort.tasks.generate_single_ai_response',
+        'lastresort.tasks.generate_ai_responses_async',
+        'lastresort.tasks.submit_ai_batch',
+        'lastresort.tasks.poll_ai_batches',
+    ]
+}
+CELERY_BEAT_SCHEDULE = {
+    'expire-competitions': {
+        'task': 'lastresort.tasks.expire_competitions',
+        'schedule': float(os.environ.get('COMPETITION_EXPIRY_INTERVAL', 60)),
+    },
+    'evict-solution-cache': {
+        'task': 'lastresort.tasks.evict_solution_cache',
+        'schedule': 3600.0,
+    },
+    'poll-ai-batches': {
+        'task': 'lastresort.tasks.poll_ai_batches',
+        'schedule': float(os.environ.get('AI_BATCH_POLL_INTERVAL', 60)),
+    },
+}
+
+# 'realtime' runs one task per entry, 'async' solves a whole group concurrently in one task,
+# 'batch' sends accepted groups through the Batch API
+AI_EXECUTION_MODE = os.environ.get('AI_EXECUTION_MODE', 'realtime')
+AI_ASYNC_CONCURRENCY = int(os.environ.get('AI_ASYNC_CONCURRENCY', 20))
+# Groups generated at the same time after a bulk accept in admin review, in realtime or async mode;
+# batch mode sends them all in one job
+AI_DISPATCH_CONCURRENCY = int(os.environ.get('AI_DISPATCH_CONCURRENCY', 4))
+
+# Where model output comes from: 'openai', 'stub' (local, deterministic, no network) or
+# 'replay' (recorded responses from AI_REPLAY_PATH). Batch mode always uses the OpenAI API.
+AI_BACKEND = os.environ.get('AI_BACKEND', 'openai')
+AI_STUB_LATENCY = float(os.environ.get('AI_STUB_LATENCY', 0.5))
+AI_STUB_ERROR_RATE = float(os.environ.get('AI_STUB_ERROR_RATE', 0))
+AI_STUB_ANSWER_RANGE = int(os.environ.get('AI_STUB_ANSWER_RANGE', 100))
+AI_REPLAY_PATH = os.environ.get('AI_REPLAY_PATH', str(BASE_DIR / 'ai_responses.jsonl'))
+
+# Stream model output in realtime mode so the output page can show solutions as they are written;
+# partial text is pushed to viewers at most once per AI_STREAM_FLUSH_INTERVAL seconds per entry
+AI_STREAM_PARTIALS = os.environ.get('AI_STREAM_PARTIALS', 'True') == 'True'
+AI_STREAM_FLUSH_INTERVAL = float(os.environ.get('AI_STREAM_FLUSH_INTERVAL', 0.2))
+
+# Model API quota shared by every worker through Redis (0 disables a limit)
+AI_RATE_LIMIT_RPM = int(os.environ.get('AI_RATE_LIMIT_RPM', 500))
+AI_RATE_LIMIT_TPM = int(os.environ.get('AI_RATE_LIMIT_TPM', 30000))
+AI_EXPECTED_OUTPUT_TOKENS = int(os.environ.get('AI_EXPECTED_OUTPUT_TOKENS', 500))
+AI_RATE_LIMIT_MAX_WAIT = float(os.environ.get('AI_RATE_LIMIT_MAX_WAIT', 10))
+AI_MAX_RETRIES = int(os.environ.get('AI_MAX_RETRIES', 5))
+AI_RETRY_BACKOFF_BASE = float(os.environ.get('AI_RETRY_BACKOFF_BASE', 2))
+AI_RETRY_BACKOFF_MAX = float(os.environ.get('AI_RETRY_BACKOFF_MAX', 120))
+
+# Redis pub/sub used to push results to viewers of the output page
+EVENTS_REDIS_URL = os.environ.get('EVENTS_REDIS_URL', CELERY_BROKER_URL)
+
+# Versioned fragment cache behind the dashboard, competition, leaderboard and output pages.
+# 'redis' shares fragments between every web process; 'locmem' keeps them per process (tests, development)
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'redis' if EVENTS_REDIS_URL else 'locmem')
+CACHE_REDIS_URL = os.environ.get('CACHE_REDIS_URL', EVENTS_REDIS_URL)
+FRAGMENT_CACHE_TIMEOUT = int(os.environ.get('FRAGMENT_CACHE_TIMEOUT', 600))
+if CACHE_BACKEND == 'redis':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': CACHE_REDIS_URL,
+            'KEY_PREFIX': 'lastresort',
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'lastresort',
+        }
+    }
+
+# Reuse of model solutions for problems that were already solved; only with AI_BACKEND=openai,
+# so stub and replay answers are never cached
+SOLUTION_CACHE_ENABLED = os.environ.get('SOLUTION_CACHE_ENABLED', 'True') == 'True'
+SOLUTION_CACHE_TTL = int(os.environ.get('SOLUTION_CACHE_TTL', 30 * 24 * 3600))
+SOLUTION_CACHE_MAX_ENTRIES = int(os.environ.get('SOLUTION_CACHE_MAX_ENTRIES', 100000))
+
+# Per-view and per-task query/latency tracking, kept in hourly Redis buckets.
+# Views over their declared budget raise BudgetExceeded when PERFORMANCE_BUDGET_RAISE is set
+# (useful in tests); task violations are only logged.
+PERFORMANCE_TRACKING_ENABLED = os.environ.get('PERFORMANCE_TRACKING_ENABLED', 'True') == 'True'
+PERFORMANCE_BUDGET_RAISE = os.environ.get('PERFORMANCE_BUDGET_RAISE', 'False') == 'True'
+PERFORMANCE_RETENTION_HOURS = int(os.environ.get('PERFORMANCE_RETENTION_HOURS', 48))
+
+# Cold-start budget for django.setup(), checked by `manage.py check_startup`
+STARTUP_BUDGET_MS = float(os.environ.get('STARTUP_BUDGET_MS', 1000))
+
+# Prometheus metrics at /metrics/, summed in Redis across web and worker processes.
+# Scrapers must send "Authorization: Bearer <METRICS_TOKEN>"; with no token set, /metrics/ is
+# only served to logged-in staff unless DEBUG is on
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'True') == 'True'
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
 
 # Internationalization
 # https://docs.djangoproject.com/en/5.2/topics/i18n/
@@ -17,6 +17,7 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 from django.http import HttpResponse
+from lastresort.metrics import metrics_view
 
 def health_check(request):
     """Health check endpoint for Docker containers"""
@@ -24,6 +25,7 @@ def health_check(request):
 
 urlpatterns = [
     path('health/', health_check, name='health_check'),
+    path('metrics/', metrics_view, name='metrics'),
     path('lastresort/', include('lastresort.urls')),
     path('admin/', admin.site.urls),
 ]